@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from typing import List, Union
 from pydantic import field_validator, AnyHttpUrl
@@ -21,6 +22,57 @@ class Settings(BaseSettings):
     # Artifacts
     ARTIFACTS_DIR: Path = BASE_DIR / "artifacts"
 
+    # Model serving
+    MODEL_CACHE_SIZE: int = 4  # loaded (username, version) bundles kept in memory
+    TREE_ENGINE: str = "compiled"  # "compiled" (NumPy, parity-checked at load) or "sklearn"
+    MLP_ENGINE: str = "numpy"  # "numpy" (exported weights, no torch import) or "torch"
+    FUSED_SERVING: bool = True  # fold the StandardScaler into logreg/MLP weights at load
+    BATCHING_ENABLED: bool = True  # coalesce concurrent single-row scores per model version
+    BATCH_WINDOW_MS: float = 2.0  # max time a row queued behind an in-flight batch waits; idle rows go at once
+    BATCH_MAX_ROWS: int = 64  # flush a batch early once this many rows are queued
+    SCORE_CACHE_SIZE: int = 10_000  # cached (admin, version, features) results; 0 disables
+    SCORE_CACHE_DECIMALS: int = 4  # feature rounding used to build cache keys
+    SCORE_CACHE_BACKEND: str = "memory"  # "memory" (per worker) or "mongo" (shared, write-through)
+    SCORE_CACHE_TTL_SECONDS: int = 86_400  # expiry of shared "mongo" entries
+    EXPLAIN_TOP_K: int = 3  # features returned as top_features
+    EXPLAIN_CACHE_SIZE: int = 10_000  # cached (admin, version, features) explanations; 0 disables
+    EXPLAIN_BUDGET_MS: float = 0.0  # opt-in: wait this long for tree SHAP per request, else linear; 0 = linear only
+    RESCORE_EXPLAIN_METHOD: str = "linear"  # top_features for rescore jobs: "linear", "tree_shap" or "none"
+    SCORE_BATCH_MAX_ROWS: int = 100_000  # per /risk/score_batch call
+    SCORE_BATCH_MAX_BYTES: int = 64 * 1024**2  # /risk/score_batch bodies above this are rejected with 413
+    RESCORE_CHUNK_SIZE: int = 5000  # customers per portfolio rescoring batch
+    RESCORE_STALE_SECONDS: int = 600  # a running rescore job without a checkpoint this long counts as interrupted
+    INGEST_BATCH_ROWS: int = 10_000  # transactions per insert_many during bulk ingestion
+    INGEST_STALE_SECONDS: int = 600  # a running ingest job without a checkpoint this long counts as interrupted
+    POST_COMMIT_WORKERS: int = 4  # ordered per-customer rescoring/alert threads; 0 = inline in the request
+    POST_COMMIT_LEASE_SECONDS: int = 120  # a customer claimed for scoring is reclaimable after this (owner died)
+    PENDING_TX_STALE_SECONDS: int = 300  # transactions still "pending" after this are settled; also the recovery interval
+    RULE_SNAPSHOT_TTL_SECONDS: int = 300  # max age of the portfolio matrix used by /admin/rules/scan
+    TRAINING_EXECUTOR: str = "process"  # "process" (spawned worker pool) or "thread" (in-process, dev only)
+    TRAINING_WORKERS: int = 1  # concurrent retraining jobs per API process
+    UPLOAD_SPOOL_DIR: Path = Path(tempfile.gettempdir()) / "credit_risk_uploads"  # retraining uploads
+    UPLOAD_MAX_BYTES: int = 10 * 1024**3  # larger uploads are rejected with 413
+    TRAINING_CSV_CHUNK_ROWS: int = 200_000  # rows per pandas chunk when reading training CSVs
+    DATASET_CACHE_DIR: Path | None = None  # parsed training sets by content hash; default ARTIFACTS_DIR/_datasets
+    DATASET_CACHE_MAX_BYTES: int = 5 * 1024**3  # least recently used datasets are evicted beyond this
+    DATASET_CACHE_MMAP_MIN_BYTES: int = 64 * 1024**2  # memory-map cached columns at least this large
+    TRAINING_PARALLEL: bool = True  # fit logreg / forest / MLP concurrently in a process pool
+    TRAINING_FOREST_JOBS: int = 0  # forest cores; <= 0 = all cores left after the MLP and logreg
+    TRAINING_TORCH_THREADS: int = 4  # torch intra-op threads for the MLP (fixed for reproducibility)
+    MLP_TRAINING: str = "full_batch"  # "full_batch" (80 epochs, all rows) or opt-in "mini_batch" (MLP_* below)
+    MLP_BATCH_SIZE: int = 2048  # mini_batch: MLP mini-batch rows; <= 0 = full-batch
+    MLP_MAX_EPOCHS: int = 50  # mini_batch: upper bound on MLP epochs
+    MLP_EPOCH_ROWS: int = 1_000_000  # mini_batch: training rows per MLP epoch on large sets; <= 0 = all rows
+    MLP_PATIENCE: int = 3  # mini_batch: stop after this many epochs without validation improvement; 0 = never
+    MLP_VALIDATION_FRACTION: float = 0.1  # mini_batch: share of MLP training rows held out for early stopping
+    MLP_LEARNING_RATE: float = 1e-3  # Adam learning rate for the MLP
+    INCREMENTAL_REPLAY_RATIO: float = 1.0  # replayed parent rows per new row in incremental retrains
+    INCREMENTAL_FOREST_TREES: int = 0  # trees added to the parent forest per incremental retrain; 0 = keep as is
+    INCREMENTAL_MLP_MAX_EPOCHS: int = 10  # epoch cap when continuing the parent MLP
+    THREADPOOL_SIZE: int = 40  # worker threads for sync endpoints (anyio default is 40)
+    REGISTRY_POLL_SECONDS: float = 2.0  # how often each worker checks for newly activated models; 0 disables
+    WARMUP_ON_STARTUP: bool = True  # preload active models before /health/ready reports ready
+
     # WhatsApp
     WHATSAPP_TOKEN: str | None = None
     WHATSAPP_PHONE_ID: str | None = None
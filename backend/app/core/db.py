@@ -1,8 +1,8 @@
 from typing import Optional
 
 from pymongo import MongoClient
-from pymongo.errors import OperationFailure
 from .config import settings
+from .indexes import apply_indexes
 
 _client: Optional[MongoClient] = None
 _db = None
@@ -17,18 +17,10 @@ def get_client() -> MongoClient:
 
 def ensure_indexes(db):
     """
-    Ensures all global indexes exist.
-    This is safe to run on every startup — MongoDB will ignore if index already exists.
+    Ensures all registered indexes exist (see app/core/indexes.py).
+    This is safe to run on every startup — existing matching indexes are left alone.
     """
-    try:
-        db["customers"].create_index(
-            [("user_id", 1), ("source", 1)],
-            unique=True,
-            name="uniq_user_source"
-        )
-    except OperationFailure as e:
-        # If index already exists or namespace conflict, ignore safely
-        print("Index creation skipped:", e)
+    return apply_indexes(db)
 
 
 def get_db():
@@ -0,0 +1,303 @@
+# app/core/indexes.py
+"""
+Declarative registry of every MongoDB index the app relies on, and the
+query shapes they exist for.
+
+apply_indexes() creates missing indexes at startup and recreates any whose
+definition changed here. explain_query_shapes() runs explain() on each
+registered query shape and flags plans that scan the collection or sort in
+memory (run it via scripts/check_indexes.py). When adding a query to a
+model, router or service, register its shape (and index, if it needs a new
+one) below.
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .config import settings
+
+logger = logging.getLogger("early_risk_app")
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: tuple  # ((field, 1 | -1), ...)
+    name: str
+    unique: bool = False
+    expire_after_seconds: Optional[int] = None  # TTL index
+    partial_filter: Optional[dict] = field(default=None)  # index only the documents matching this
+
+    def options(self) -> dict:
+        opts = {"name": self.name}
+        if self.unique:
+            opts["unique"] = True
+        if self.expire_after_seconds is not None:
+            opts["expireAfterSeconds"] = self.expire_after_seconds
+        if self.partial_filter is not None:
+            opts["partialFilterExpression"] = self.partial_filter
+        return opts
+
+
+@dataclass(frozen=True)
+class QueryShape:
+    """A query the app issues, with representative values for explain()."""
+
+    name: str
+    collection: str
+    filter: dict
+    sort: Optional[tuple] = None  # ((field, 1 | -1), ...)
+    limit: int = 0
+    source: str = ""  # where the query lives
+    projection: Optional[dict] = field(default=None)
+
+
+INDEXES = (
+    # customers
+    IndexSpec("customers", (("user_id", 1), ("source", 1)), "uniq_user_source", unique=True),
+    IndexSpec("customers", (("source", 1), ("_id", 1)), "customers_source_id"),
+    IndexSpec("customers", (("source", 1), ("created_at", -1)), "customers_latest"),
+    IndexSpec("customers", (("source", 1), ("risk_band", 1), ("updated_at", -1)), "customers_flagged"),
+    IndexSpec("customers", (("source", 1), ("UtilisationPct", -1)), "customers_top_utilisation"),
+    IndexSpec("customers", (("source", 1), ("CashWithdrawalPct", -1)), "customers_top_cash"),
+    IndexSpec("customers", (("score_status", 1),), "customers_score_status"),
+    # transactions / risk history
+    IndexSpec("transactions", (("customer_id", 1), ("timestamp", -1)), "transactions_customer_time"),
+    # only in-flight / crashed transactions carry "pending"
+    IndexSpec(
+        "transactions", (("timestamp", 1),), "transactions_pending", partial_filter={"pending": True}
+    ),
+    IndexSpec("risk_scores", (("customer_id", 1), ("timestamp", -1)), "risk_scores_customer_time"),
+    # one history row per customer and rescore job, so a resumed job can replay a chunk
+    IndexSpec(
+        "risk_scores", (("customer_id", 1), ("rescore_job_id", 1)), "risk_scores_rescore_job",
+        unique=True, partial_filter={"rescore_job_id": {"$exists": True}},
+    ),
+    # users / OTPs
+    IndexSpec("users", (("username", 1),), "uniq_username", unique=True),
+    IndexSpec("users", (("phone", 1),), "users_phone"),
+    IndexSpec("otp_codes", (("phone", 1), ("purpose", 1), ("created_at", -1)), "otp_latest"),
+    # expired codes can never verify; let Mongo delete them
+    IndexSpec("otp_codes", (("expires_at", 1),), "ttl_otp_expired", expire_after_seconds=0),
+    # model registry
+    # polled by every worker to pick up newly activated model versions
+    IndexSpec("model_versions", (("is_active", 1), ("created_at", 1)), "active_model_versions"),
+    IndexSpec("model_versions", (("username", 1), ("created_at", -1)), "model_versions_by_user"),
+    IndexSpec("model_versions", (("username", 1), ("version", 1)), "model_versions_user_version"),
+    # background jobs
+    IndexSpec("training_jobs", (("admin_username", 1), ("created_at", -1)), "training_jobs_by_admin"),
+    IndexSpec(
+        "training_jobs", (("admin_username", 1), ("status", 1), ("version", -1)), "training_jobs_reserved"
+    ),
+    # one queued/running job per (admin, version); the insert is the reservation
+    IndexSpec(
+        "training_jobs", (("admin_username", 1), ("version", 1)), "training_jobs_version",
+        unique=True, partial_filter={"reserved": True},
+    ),
+    IndexSpec("rescore_jobs", (("admin_username", 1), ("created_at", -1)), "rescore_jobs_by_admin"),
+    IndexSpec("rescore_jobs", (("status", 1), ("updated_at", 1)), "rescore_jobs_stale"),
+    IndexSpec("ingest_jobs", (("admin_username", 1), ("created_at", -1)), "ingest_jobs_by_admin"),
+    IndexSpec("ingest_jobs", (("status", 1), ("updated_at", 1)), "ingest_jobs_stale"),
+    # shared score cache entries expire on their own
+    IndexSpec(
+        "score_cache", (("created_at", 1),), "ttl_score_cache",
+        expire_after_seconds=settings.SCORE_CACHE_TTL_SECONDS,
+    ),
+    IndexSpec("score_cache", (("admin_username", 1), ("version", 1)), "score_cache_admin_version"),
+)
+
+_NOW = datetime(2000, 1, 1)
+
+QUERY_SHAPES = (
+    QueryShape(
+        "customer for user", "customers", {"user_id": "u", "source": "app_user"},
+        source="models.customer.ensure_customer_for_user",
+    ),
+    QueryShape(
+        "admin customer list", "customers", {"source": "app_user"},
+        source="models.customer.admin_list_customers",
+    ),
+    QueryShape(
+        "portfolio page", "customers", {"source": "app_user", "_id": {"$gt": 0}}, sort=(("_id", 1),),
+        limit=1000, source="services.rescoring_service.run_rescore_job",
+    ),
+    QueryShape(
+        "top latest", "customers", {"source": "app_user"}, sort=(("created_at", -1),), limit=10,
+        source="routers.admin.top_customers",
+    ),
+    QueryShape(
+        "top flagged", "customers", {"source": "app_user", "risk_band": "High"},
+        sort=(("updated_at", -1),), limit=10, source="routers.admin.top_customers",
+    ),
+    QueryShape(
+        "top utilisation", "customers", {"source": "app_user"}, sort=(("UtilisationPct", -1),), limit=10,
+        source="routers.admin.top_customers",
+    ),
+    QueryShape(
+        "top cash", "customers", {"source": "app_user"}, sort=(("CashWithdrawalPct", -1),), limit=10,
+        source="routers.admin.top_customers",
+    ),
+    QueryShape(
+        "unscored customers", "customers", {"score_status": {"$in": ["pending", "failed", "processing"]}},
+        source="services.post_commit_service.requeue_unscored",
+    ),
+    QueryShape(
+        "recent transactions", "transactions", {"customer_id": "c", "pending": {"$ne": True}},
+        sort=(("timestamp", -1),), limit=20, source="models.customer.get_recent_transactions_for_customer",
+    ),
+    QueryShape(
+        "transaction history", "transactions", {"customer_id": "c"},
+        source="models.customer.rebuild_customer_aggregates",
+    ),
+    QueryShape(
+        "spend window edges", "transactions",
+        {"customer_id": "c", "$or": [{"timestamp": {"$gte": _NOW, "$lt": _NOW}}] * 3},
+        source="models.customer.recent_spend_change_pct",
+    ),
+    QueryShape(
+        "stale pending transactions", "transactions", {"pending": True, "timestamp": {"$lt": _NOW}},
+        source="models.customer.recover_pending_transactions",
+    ),
+    QueryShape(
+        "pending transactions", "transactions", {"pending": True, "timestamp": {"$lte": _NOW}},
+        source="services.aggregate_reconcile_service._recomputed_aggregates",
+    ),
+    QueryShape(
+        "latest risk score", "risk_scores", {"customer_id": "c"}, sort=(("timestamp", -1),), limit=1,
+        source="models.customer.get_customer_with_latest_score",
+    ),
+    QueryShape("user by username", "users", {"username": "u"}, source="models.user.get_user_by_username"),
+    QueryShape("user by phone", "users", {"phone": "p"}, source="models.user.get_user_by_phone"),
+    QueryShape(
+        "latest otp", "otp_codes", {"phone": "p", "purpose": "register"}, sort=(("created_at", -1),), limit=1,
+        source="models.otp.verify_otp",
+    ),
+    QueryShape(
+        "active versions", "model_versions", {"is_active": True}, sort=(("created_at", 1),),
+        source="ml.active_models.ActiveModelRegistry.refresh",
+    ),
+    QueryShape(
+        "active version", "model_versions", {"username": "a", "is_active": True},
+        sort=(("created_at", -1),), limit=1, source="ml.model_registry.get_active_model_version",
+    ),
+    QueryShape(
+        "versions by user", "model_versions", {"username": "a"}, sort=(("created_at", -1),),
+        source="ml.model_registry.list_model_versions",
+    ),
+    QueryShape(
+        "version by number", "model_versions", {"username": "a", "version": 1},
+        source="ml.model_registry.get_model_version",
+    ),
+    QueryShape(
+        "training jobs", "training_jobs", {"admin_username": "a"}, sort=(("created_at", -1),), limit=20,
+        source="services.training_job_service.list_training_jobs",
+    ),
+    QueryShape(
+        "reserved version", "training_jobs", {"admin_username": "a", "status": {"$in": ["pending", "running"]}},
+        sort=(("version", -1),), limit=1, source="services.training_job_service._next_version_for",
+    ),
+    QueryShape(
+        "rescore jobs", "rescore_jobs", {"admin_username": "a"}, sort=(("created_at", -1),), limit=20,
+        source="services.rescoring_service.list_rescore_jobs",
+    ),
+    QueryShape(
+        "stale rescore jobs", "rescore_jobs",
+        {"status": {"$in": ["pending", "running"]}, "updated_at": {"$lt": _NOW}},
+        source="services.rescoring_service.mark_interrupted_rescore_jobs",
+    ),
+    QueryShape(
+        "ingest jobs", "ingest_jobs", {"admin_username": "a"}, sort=(("created_at", -1),), limit=20,
+        source="services.transaction_ingest_service.list_ingest_jobs",
+    ),
+    QueryShape(
+        "stale ingest jobs", "ingest_jobs",
+        {"status": {"$in": ["pending", "running"]}, "updated_at": {"$lt": _NOW}},
+        source="services.transaction_ingest_service.mark_interrupted_ingest_jobs",
+    ),
+    QueryShape(
+        "score cache invalidation", "score_cache", {"admin_username": "a", "version": {"$ne": 1}},
+        source="ml.score_cache.ScoreCache.invalidate",
+    ),
+)
+
+
+def _matches(existing: dict, spec: IndexSpec) -> bool:
+    if [(k, int(d)) for k, d in existing["key"]] != list(spec.keys):
+        return False
+    return (
+        bool(existing.get("unique")) == spec.unique
+        and existing.get("expireAfterSeconds") == spec.expire_after_seconds
+        and existing.get("partialFilterExpression") == spec.partial_filter
+    )
+
+
+def apply_indexes(db, specs=INDEXES) -> dict:
+    """
+    Create every registered index; an existing index with the same name
+    but a different definition is dropped and recreated. Failures (e.g. a
+    unique index over duplicate data) are logged and skipped so startup
+    goes on. Returns {"created": [...], "recreated": [...], "failed": [...]}.
+    """
+    report = {"created": [], "recreated": [], "failed": []}
+    existing_by_collection: dict[str, dict] = {}
+    for spec in specs:
+        col = db[spec.collection]
+        label = f"{spec.collection}.{spec.name}"
+        try:
+            if spec.collection not in existing_by_collection:
+                existing_by_collection[spec.collection] = col.index_information()
+            existing = existing_by_collection[spec.collection].get(spec.name)
+            if existing is not None and _matches(existing, spec):
+                continue
+            if existing is not None:
+                col.drop_index(spec.name)
+            col.create_index(list(spec.keys), **spec.options())
+            report["recreated" if existing is not None else "created"].append(label)
+        except (OperationFailure, PyMongoError) as e:
+            logger.warning(f"Index {label} not applied: {e}")
+            report["failed"].append({"index": label, "error": str(e)})
+    if report["created"] or report["recreated"]:
+        logger.info(f"Indexes created: {report['created']}, recreated: {report['recreated']}")
+    return report
+
+
+def _plan_stages(plan: dict):
+    """Every stage name in a (classic or SBE) explain plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def explain_query_shapes(db, shapes=QUERY_SHAPES) -> list[dict]:
+    """
+    explain() each registered query shape and report its winning plan's
+    stages; ``problems`` lists COLLSCAN (no usable index) and SORT (sorted
+    in memory instead of read in index order).
+    """
+    results = []
+    for shape in shapes:
+        cursor = db[shape.collection].find(shape.filter, shape.projection)
+        if shape.sort:
+            cursor = cursor.sort(list(shape.sort))
+        if shape.limit:
+            cursor = cursor.limit(shape.limit)
+        try:
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        except (OperationFailure, PyMongoError, KeyError) as e:
+            results.append({"query": shape.name, "collection": shape.collection, "source": shape.source,
+                            "stages": [], "problems": [f"explain failed: {e}"]})
+            continue
+        stages = list(_plan_stages(plan))
+        problems = [s for s in stages if s in ("COLLSCAN", "SORT")]
+        results.append({"query": shape.name, "collection": shape.collection, "source": shape.source,
+                        "stages": stages, "problems": problems})
+    return results
@@ -1,3 +1,6 @@
+from contextlib import asynccontextmanager
+
+from anyio import to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -5,9 +8,26 @@ from app.core.config import settings
 from app.routers import auth, user, admin
 from app.routers import risk  # new ML / risk API
 from app.routers.auth_whatsapp import router as whatsapp_auth_router
+from app.routers import health
+from app.services.warmup_service import skip_warmup, start_warmup
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Scoring uses immutable per-version ModelBundles, so the sync endpoint
+    # threadpool can be sized for load instead of being kept small for safety.
+    to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+
+    # connect, ensure indexes and preload active models off the event loop;
+    # /health/ready reports 503 until this has finished
+    if settings.WARMUP_ON_STARTUP:
+        start_warmup()
+    else:
+        skip_warmup()
+    yield
 
 
-app = FastAPI(title="Early Risk Signals - Credit Card Delinquency")
+app = FastAPI(title="Early Risk Signals - Credit Card Delinquency", lifespan=lifespan)
 
 # CORS origins: from env if set, else default to local dev URLs
 if settings.CORS_ORIGINS:
@@ -32,6 +52,7 @@ app.include_router(user.router)
 app.include_router(admin.router)
 app.include_router(risk.router)
 app.include_router(whatsapp_auth_router)
+app.include_router(health.router)
 
 
 @app.get("/")
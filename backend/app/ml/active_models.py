@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from app.ml.ml_pipeline import FEATURE_COLUMNS
+from app.ml.model_loader import ModelBundle, load_models_for, predict_probas, predict_probas_batched
+from app.ml.model_registry import model_versions_col, get_active_model_version
+
+logger = logging.getLogger("early_risk_app")
+
+
+@dataclass(frozen=True)
+class ActiveModel:
+    """The model an admin is currently serving. ``registration`` is the
+    model_versions document id, so re-training an existing version number
+    still counts as a change."""
+    username: str
+    version: int
+    registration: object
+    bundle: ModelBundle
+
+
+def warmup_row(bundle: ModelBundle) -> np.ndarray:
+    means = (bundle.baseline_stats or {}).get("feature_means") or {}
+    return np.array([[float(means.get(col, 0.0)) for col in FEATURE_COLUMNS]], dtype=float)
+
+
+def warm_bundle(bundle: ModelBundle):
+    """One single-row (through the batcher) and one small batch inference, so
+    lazy allocations and the batcher lane exist before real traffic."""
+    row = warmup_row(bundle)
+    predict_probas_batched(bundle, row)
+    predict_probas(bundle, np.repeat(row, 64, axis=0))
+
+
+class ActiveModelRegistry:
+    """
+    In-memory view of each admin's active model version, kept current by
+    polling model_versions.
+
+    Readers take one dict lookup, no DB round trip and no lock. When the
+    active registration of an admin changes, the new bundle is loaded and
+    warmed on a background thread and then swapped in by replacing the dict;
+    requests already holding the previous ActiveModel finish on it, and no
+    request waits on a load (only the very first request for an admin this
+    worker has never seen loads inline).
+    """
+
+    def __init__(self, poll_seconds: float):
+        self.poll_seconds = poll_seconds
+        self._active: dict[str, ActiveModel] = {}
+        self._lock = threading.Lock()
+        # username -> (version, registration) the latest poll asked for
+        self._wanted: dict[str, tuple] = {}
+        self._loading: dict[tuple, Future] = {}
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-swap")
+        self._watcher: Optional[threading.Thread] = None
+        self.polls = 0
+        self.swaps = 0
+        self.failed_loads = 0
+
+    def get(self, username: str) -> Optional[ActiveModel]:
+        active = self._active.get(username)
+        if active is not None:
+            return active
+        return self._load_inline(username)
+
+    def _load_inline(self, username: str) -> Optional[ActiveModel]:
+        with self._lock:
+            target = self._wanted.get(username)
+            future = self._loading.get((username, target)) if target else None
+        if future is not None:
+            # already being loaded in the background; nothing older to serve meanwhile
+            future.result()
+            return self._active.get(username)
+
+        mv = get_active_model_version(username)
+        if not mv:
+            return None
+        target = (int(mv["version"]), mv["_id"])
+        with self._lock:
+            # just read from the registry, so at least as fresh as the last poll's
+            self._wanted[username] = target
+        bundle = load_models_for(username, target[0])
+        self._install(username, target, bundle)
+        # a poll may have asked for another registration while this loaded;
+        # it swaps that in, and this request is served what was active when it came in
+        return self._active.get(username) or ActiveModel(username, target[0], target[1], bundle)
+
+    def _install(self, username: str, target: tuple, bundle: ModelBundle):
+        with self._lock:
+            if self._wanted.get(username) != target:
+                return  # superseded by a newer activation while loading
+            current = self._active.get(username)
+            if current is not None and (current.version, current.registration) == target:
+                return
+            active = dict(self._active)
+            active[username] = ActiveModel(username, target[0], target[1], bundle)
+            self._active = active
+            self.swaps += 1
+        logger.info(f"Serving model {username} v{target[0]}")
+
+    def _swap_in(self, username: str, target: tuple) -> dict:
+        t0 = time.perf_counter()
+        try:
+            bundle = load_models_for(username, target[0])
+            warm_bundle(bundle)
+        except Exception as e:
+            with self._lock:
+                self.failed_loads += 1
+                self._loading.pop((username, target), None)
+            logger.exception(f"Loading {username} v{target[0]} failed; keeping the current model")
+            return {"username": username, "version": target[0], "error": str(e)}
+        self._install(username, target, bundle)
+        with self._lock:
+            self._loading.pop((username, target), None)
+        return {
+            "username": username,
+            "version": target[0],
+            "seconds": round(time.perf_counter() - t0, 3),
+        }
+
+    def refresh(self, wait: bool = False) -> list[dict]:
+        """
+        Read every active registration in one query and schedule background
+        loads for those that differ from what is being served. With
+        ``wait=True`` block until the scheduled loads finish and return their
+        results.
+        """
+        wanted: dict[str, tuple] = {}
+        cursor = model_versions_col().find(
+            {"is_active": True}, {"username": 1, "version": 1, "created_at": 1}
+        ).sort("created_at", 1)
+        for mv in cursor:
+            # later registrations win, like get_active_model_version
+            wanted[mv["username"]] = (int(mv["version"]), mv["_id"])
+
+        futures = []
+        with self._lock:
+            self.polls += 1
+            self._wanted = wanted
+            # admins with no active model any more stop being served
+            if any(u not in wanted for u in self._active):
+                self._active = {u: a for u, a in self._active.items() if u in wanted}
+            for username, target in wanted.items():
+                current = self._active.get(username)
+                if current is not None and (current.version, current.registration) == target:
+                    continue
+                key = (username, target)
+                future = self._loading.get(key)
+                if future is None:
+                    future = self._loader.submit(self._swap_in, username, target)
+                    self._loading[key] = future
+                futures.append(future)
+
+        return [f.result() for f in futures] if wait else []
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Model registry poll failed: {e}")
+
+    def start_watching(self):
+        with self._lock:
+            if self._watcher is not None or self.poll_seconds <= 0:
+                return
+            self._watcher = threading.Thread(target=self._watch, name="model-registry-watcher", daemon=True)
+            self._watcher.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "poll_seconds": self.poll_seconds,
+                "watching": self._watcher is not None,
+                "polls": self.polls,
+                "swaps": self.swaps,
+                "failed_loads": self.failed_loads,
+                "loading": len(self._loading),
+                "active": {u: a.version for u, a in self._active.items()},
+            }
+
+
+_active_models: Optional[ActiveModelRegistry] = None
+_init_lock = threading.Lock()
+
+
+def get_active_models() -> ActiveModelRegistry:
+    global _active_models
+    if _active_models is None:
+        with _init_lock:
+            if _active_models is None:
+                from app.core.config import settings
+
+                _active_models = ActiveModelRegistry(settings.REGISTRY_POLL_SECONDS)
+    return _active_models
+
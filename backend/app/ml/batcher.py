@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Hashable, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("early_risk_app")
+
+# lanes with no traffic for this long stop their worker thread
+LANE_IDLE_SECONDS = 60.0
+
+
+class _Lane:
+    """Pending single-row requests for one loaded model bundle."""
+
+    def __init__(self, key: Hashable, bundle, lock: threading.Lock):
+        self.key = key
+        self.bundle = bundle
+        self.pending: list[Tuple[np.ndarray, Future, float]] = []
+        # batches being scored right now (inline or by the lane thread)
+        self.in_flight = 0
+        self.cond = threading.Condition(lock)
+
+
+class InferenceBatcher:
+    """
+    Coalesces concurrent single-row predictions for the same model bundle.
+
+    A row arriving while nothing for its bundle is queued or being scored
+    runs at once in the caller's thread, so an idle server adds no delay.
+    Rows arriving while a batch is in flight queue up; a per-bundle worker
+    thread sends them through ``predict_fn`` as one (N, F) batch as soon as
+    that batch finishes, after at most ``window_ms`` from the first queued
+    row, or once ``max_rows`` are queued, and hands each caller back its
+    own row. Under heavy load one vectorized call serves many requests.
+    """
+
+    def __init__(self, predict_fn: Callable, window_ms: float, max_rows: int):
+        self.predict_fn = predict_fn
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_rows = max(1, int(max_rows))
+        self._lock = threading.Lock()
+        self._lanes: dict[Hashable, _Lane] = {}
+
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_queue_depth = 0
+
+    def submit(self, bundle, row: np.ndarray) -> Tuple[float, float, float]:
+        """Score one feature row; returns (p_logreg, p_tree, p_nn) for that row."""
+        future: Future = Future()
+        key = (bundle.username, bundle.version, id(bundle))
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = _Lane(key, bundle, self._lock)
+                self._lanes[key] = lane
+                threading.Thread(
+                    target=self._run_lane, args=(lane,), name=f"batcher-{key[0]}-v{key[1]}", daemon=True
+                ).start()
+            inline = not lane.pending and lane.in_flight == 0
+            if inline:
+                lane.in_flight += 1
+                self._count([(row, future, time.perf_counter())])
+            else:
+                lane.pending.append((row, future, time.perf_counter()))
+                self.max_queue_depth = max(self.max_queue_depth, len(lane.pending))
+                lane.cond.notify()
+        if not inline:
+            return future.result()
+
+        try:
+            p_log, p_tree, p_nn = self.predict_fn(bundle, np.vstack([row]))
+        finally:
+            with self._lock:
+                lane.in_flight -= 1
+                # rows that queued behind this one go next
+                lane.cond.notify()
+        return p_log[0], p_tree[0], p_nn[0]
+
+    def _count(self, batch: list):
+        started = time.perf_counter()
+        self.batches += 1
+        self.rows += len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.total_wait += sum(started - enqueued for _, _, enqueued in batch)
+
+    def _run_lane(self, lane: _Lane):
+        while True:
+            with self._lock:
+                while not lane.pending:
+                    if not lane.cond.wait(timeout=LANE_IDLE_SECONDS) and not lane.pending:
+                        # idle: retire the lane; the next submit starts a new one
+                        del self._lanes[lane.key]
+                        return
+
+                # collect rows while another batch is being scored, up to the window
+                deadline = lane.pending[0][2] + self.window
+                while lane.in_flight and len(lane.pending) < self.max_rows:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    lane.cond.wait(timeout=remaining)
+
+                batch = lane.pending[: self.max_rows]
+                del lane.pending[: self.max_rows]
+                lane.in_flight += 1
+                self._count(batch)
+
+            futures = [f for _, f, _ in batch]
+            try:
+                X = np.vstack([r for r, _, _ in batch])
+                p_log, p_tree, p_nn = self.predict_fn(lane.bundle, X)
+            except Exception as e:
+                for f in futures:
+                    f.set_exception(e)
+                continue
+            else:
+                for i, f in enumerate(futures):
+                    f.set_result((p_log[i], p_tree[i], p_nn[i]))
+            finally:
+                with self._lock:
+                    lane.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_rows": self.max_rows,
+                "batches": self.batches,
+                "rows": self.rows,
+                "avg_batch_size": (self.rows / self.batches) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "avg_wait_ms": (self.total_wait / self.rows * 1000.0) if self.rows else 0.0,
+                "queue_depth": sum(len(lane.pending) for lane in self._lanes.values()),
+                "max_queue_depth": self.max_queue_depth,
+                "lanes": len(self._lanes),
+            }
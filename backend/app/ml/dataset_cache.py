@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger("early_risk_app")
+
+# bump when normalization changes, so entries built by older code are ignored
+CACHE_FORMAT = 1
+META_FILE = "meta.json"
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _root() -> Path:
+    return Path(settings.DATASET_CACHE_DIR or settings.ARTIFACTS_DIR / "_datasets")
+
+
+def _entry_dir(sha256: str) -> Path:
+    return _root() / f"{sha256}-v{CACHE_FORMAT}"
+
+
+def _entry_size(entry: Path) -> int:
+    return sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+
+
+def load_dataset(sha256: str) -> Optional["pd.DataFrame"]:
+    """
+    The normalized training frame cached for this upload hash, or None.
+    Column files larger than DATASET_CACHE_MMAP_MIN_BYTES are memory-mapped
+    (read-only) instead of read into memory.
+    """
+    import pandas as pd
+
+    entry = _entry_dir(sha256)
+    try:
+        meta = json.loads((entry / META_FILE).read_text())
+    except (OSError, ValueError):
+        return None
+
+    columns = {}
+    for name in meta["columns"]:
+        path = entry / f"{name}.npy"
+        mmap = "r" if path.stat().st_size >= settings.DATASET_CACHE_MMAP_MIN_BYTES else None
+        columns[name] = np.load(path, mmap_mode=mmap)
+    # refresh recency for eviction
+    os.utime(entry / META_FILE)
+    return pd.DataFrame(columns, copy=False)
+
+
+def store_dataset(sha256: str, df: "pd.DataFrame"):
+    """
+    Write df as one .npy file per column. The entry is built in a temporary
+    directory and renamed into place, so readers never see a partial entry.
+    """
+    entry = _entry_dir(sha256)
+    if entry.exists():
+        return
+    root = _root()
+    root.mkdir(parents=True, exist_ok=True)
+
+    tmp = Path(tempfile.mkdtemp(prefix=".building-", dir=root))
+    try:
+        for name in df.columns:
+            np.save(tmp / f"{name}.npy", np.ascontiguousarray(df[name].to_numpy()))
+        (tmp / META_FILE).write_text(
+            json.dumps({"columns": [str(c) for c in df.columns], "rows": len(df), "created_at": time.time()})
+        )
+        try:
+            tmp.rename(entry)
+        except OSError:
+            # another process stored the same dataset first
+            pass
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    evict_datasets(settings.DATASET_CACHE_MAX_BYTES)
+
+
+def evict_datasets(max_bytes: int):
+    """Drop least recently used entries until the cache fits in max_bytes."""
+    root = _root()
+    if not root.exists():
+        return
+    entries = []
+    for entry in root.iterdir():
+        meta = entry / META_FILE
+        if entry.is_dir() and meta.exists():
+            entries.append((meta.stat().st_mtime, _entry_size(entry), entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        logger.info(f"Evicted cached training dataset {entry.name}")
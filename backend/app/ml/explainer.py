@@ -0,0 +1,223 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Hashable, Optional
+
+import numpy as np
+
+from app.ml.ml_pipeline import FEATURE_COLUMNS
+from app.ml.model_loader import ModelBundle, load_shap_explainer
+
+logger = logging.getLogger("early_risk_app")
+
+LINEAR = "linear"
+TREE_SHAP = "tree_shap"
+# units of each method's "contribution" values; they don't compare across methods
+UNITS = {LINEAR: "log_odds", TREE_SHAP: "probability"}
+
+# rows per TreeExplainer.shap_values call in portfolio jobs (~2 ms/row for 200 trees)
+TREE_SHAP_BATCH_ROWS = 1000
+
+
+def _scaled(bundle: ModelBundle, X: np.ndarray) -> np.ndarray:
+    if bundle.fused is not None:
+        return bundle.fused.scale_for_trees(np.asarray(X, dtype=np.float64))
+    return bundle.scaler.transform(X)
+
+
+def linear_contributions(bundle: ModelBundle, X: np.ndarray) -> np.ndarray:
+    """
+    Exact per-feature contributions of the logistic member, in log-odds,
+    relative to the training mean: coef_j * (x_j - mean_j) / scale_j.
+    They sum to logit(x) - logit(mean), so no sampling or approximation.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if bundle.fused is not None:
+        return (X - bundle.fused.mean) * bundle.fused.logreg.coef
+    return bundle.scaler.transform(X) * bundle.logreg_model.coef_[0]
+
+
+def tree_shap_contributions(
+    bundle: ModelBundle, X: np.ndarray, batch_rows: int = TREE_SHAP_BATCH_ROWS
+) -> np.ndarray:
+    """
+    TreeSHAP values of the random forest member for the positive class (in
+    probability units), computed batch_rows rows per explainer call.
+    """
+    explainer = load_shap_explainer(bundle)
+    if explainer is None:
+        raise RuntimeError(f"No SHAP explainer saved for {bundle.username} v{bundle.version}")
+
+    X_scaled = _scaled(bundle, X)
+    out = np.empty(X_scaled.shape, dtype=np.float64)
+    for start in range(0, X_scaled.shape[0], batch_rows):
+        block = X_scaled[start:start + batch_rows]
+        values = explainer.shap_values(block, check_additivity=False)
+        # older shap returns one array per class, newer an (N, F, classes) array
+        values = values[1] if isinstance(values, list) else values[..., 1]
+        out[start:start + len(block)] = values
+    return out
+
+
+def top_features(x: np.ndarray, contributions: np.ndarray, k: int) -> list[dict]:
+    """The k features with the largest |contribution| for one row."""
+    order = np.argsort(-np.abs(contributions), kind="stable")[:k]
+    return [
+        {
+            "feature": FEATURE_COLUMNS[j],
+            "value": float(x[j]),
+            "contribution": float(contributions[j]),
+        }
+        for j in order
+    ]
+
+
+def explain_matrix(bundle: ModelBundle, X: np.ndarray, method: str, k: int) -> list[list[dict]]:
+    """Top-k attributions for every row of X, used by portfolio jobs."""
+    contributions = (
+        tree_shap_contributions(bundle, X) if method == TREE_SHAP else linear_contributions(bundle, X)
+    )
+    return [top_features(X[i], contributions[i], k) for i in range(len(X))]
+
+
+class Explainer:
+    """
+    Per-request explanations with an LRU cache keyed by
+    (admin, model version, quantized feature vector).
+
+    With ``budget_ms`` = 0 (the default) only the exact linear attribution
+    is used and shap is never imported. With ``budget_ms`` > 0 a request
+    first tries tree SHAP and waits at most that long; on timeout it
+    returns the linear attribution and lets the SHAP computation finish in
+    the background, replacing the cached entry so the next request for the
+    same row gets it.
+    """
+
+    def __init__(self, max_size: int, decimals: int, budget_ms: float, top_k: int, workers: int = 2):
+        self.max_size = max(0, int(max_size))
+        self.decimals = int(decimals)
+        self.budget = max(0.0, budget_ms) / 1000.0
+        self.top_k = int(top_k)
+        self.workers = workers
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+        self.hits = 0
+        self.misses = 0
+        self.tree_shap = 0
+        self.fallbacks = 0
+
+    def key(self, bundle: ModelBundle, x: np.ndarray) -> tuple:
+        quantized = np.round(np.asarray(x, dtype=float).ravel(), self.decimals) + 0.0
+        return (bundle.username, bundle.version, tuple(quantized.tolist()))
+
+    def _get(self, key: tuple) -> Optional[tuple]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def _put(self, key: tuple, value: tuple):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _tree_shap_async(self, bundle: ModelBundle, x: np.ndarray, key: tuple):
+        with self._lock:
+            # don't queue SHAP work faster than the pool drains it
+            if self._in_flight >= 2 * self.workers:
+                return None
+            self._in_flight += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="explain")
+
+        def run():
+            try:
+                feats = top_features(x, tree_shap_contributions(bundle, x[None, :])[0], self.top_k)
+                self._put(key, (TREE_SHAP, feats))
+                return feats
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+        return self._pool.submit(run)
+
+    def is_final(self, bundle: ModelBundle, method: str) -> bool:
+        """Whether a row explained with ``method`` will never be upgraded to tree SHAP."""
+        return method == TREE_SHAP or self.budget == 0 or bundle.shap_path is None
+
+    def explain_row(self, bundle: ModelBundle, x: np.ndarray) -> tuple[str, list[dict]]:
+        """Return (method, top-k features) for one feature row."""
+        x = np.asarray(x, dtype=np.float64).ravel()
+        key = self.key(bundle, x)
+        cached = self._get(key) if self.max_size else None
+        if cached is not None:
+            return cached
+
+        if self.budget > 0 and bundle.shap_path is not None:
+            future = self._tree_shap_async(bundle, x, key)
+            if future is not None:
+                try:
+                    feats = future.result(timeout=self.budget)
+                    with self._lock:
+                        self.tree_shap += 1
+                    return TREE_SHAP, feats
+                except FutureTimeout:
+                    pass
+                except Exception as e:
+                    logger.warning(f"Tree SHAP failed, using linear attribution: {e}")
+            with self._lock:
+                self.fallbacks += 1
+
+        feats = top_features(x, linear_contributions(bundle, x[None, :])[0], self.top_k)
+        if self.max_size:
+            with self._lock:
+                # a SHAP result that finished meanwhile wins
+                if key not in self._entries:
+                    self._entries[key] = (LINEAR, feats)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return LINEAR, feats
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "budget_ms": self.budget * 1000.0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "tree_shap": self.tree_shap,
+                "fallbacks": self.fallbacks,
+                "in_flight": self._in_flight,
+            }
+
+
+_explainer: Optional[Explainer] = None
+_init_lock = threading.Lock()
+
+
+def get_explainer() -> Explainer:
+    global _explainer
+    if _explainer is None:
+        with _init_lock:
+            if _explainer is None:
+                from app.core.config import settings
+
+                _explainer = Explainer(
+                    settings.EXPLAIN_CACHE_SIZE,
+                    settings.SCORE_CACHE_DECIMALS,
+                    settings.EXPLAIN_BUDGET_MS,
+                    settings.EXPLAIN_TOP_K,
+                )
+    return _explainer
@@ -0,0 +1,85 @@
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.special import expit
+
+from app.ml.mlp_engine import NumpyMLP
+
+logger = logging.getLogger("early_risk_app")
+
+# max |p_fused - p_unfused| accepted when a bundle is fused at load time
+FUSED_ATOL = 1e-6
+
+
+@dataclass(frozen=True)
+class FoldedLogisticRegression:
+    """
+    Binary LogisticRegression with the StandardScaler folded in, so it takes
+    raw features: coef' = coef / scale, intercept' = intercept - coef . mean / scale.
+    """
+    coef: np.ndarray
+    intercept: float
+
+    @classmethod
+    def from_sklearn(cls, logreg, mean: np.ndarray, scale: np.ndarray) -> "FoldedLogisticRegression":
+        if logreg.coef_.shape[0] != 1:
+            raise ValueError("Only binary logistic regression can be folded")
+        coef = logreg.coef_[0].astype(np.float64)
+        return cls(
+            coef=np.ascontiguousarray(coef / scale),
+            intercept=float(logreg.intercept_[0] - (mean / scale) @ coef),
+        )
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Positive-class probability for each row, shape (N,)."""
+        z = X @ self.coef
+        z += self.intercept
+        return expit(z)
+
+
+@dataclass(frozen=True)
+class FusedModels:
+    """
+    Load-time precomputed serving path for one bundle: the linear and MLP
+    members consume raw features directly, and only the tree member is
+    given (X - mean) / scale.
+    """
+    mean: np.ndarray
+    scale: np.ndarray
+    logreg: FoldedLogisticRegression
+    mlp: NumpyMLP
+
+    def scale_for_trees(self, X: np.ndarray) -> np.ndarray:
+        # identical arithmetic to StandardScaler.transform, so tree splits match exactly
+        X_scaled = X - self.mean
+        X_scaled /= self.scale
+        return X_scaled
+
+
+def fuse_scaler(scaler, logreg, numpy_mlp: NumpyMLP) -> FusedModels:
+    n_features = scaler.n_features_in_
+    mean = np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(n_features), dtype=np.float64)
+    scale = np.asarray(scaler.scale_ if scaler.with_std else np.ones(n_features), dtype=np.float64)
+    return FusedModels(
+        mean=mean,
+        scale=scale,
+        logreg=FoldedLogisticRegression.from_sklearn(logreg, mean, scale),
+        mlp=numpy_mlp.fold_input_scaling(mean, scale),
+    )
+
+
+def check_fused(fused: FusedModels, scaler, logreg, numpy_mlp: NumpyMLP, X: np.ndarray) -> float:
+    """
+    Compare the fused linear/MLP outputs with scaler -> model on X and return
+    the max absolute difference; raise if it exceeds FUSED_ATOL.
+    """
+    X_scaled = scaler.transform(X)
+    diffs = [
+        np.abs(fused.logreg.predict_proba(X) - logreg.predict_proba(X_scaled)[:, 1]),
+        np.abs(fused.mlp.predict_proba(X) - numpy_mlp.predict_proba(X_scaled)),
+    ]
+    max_diff = float(max(d.max() for d in diffs)) if len(X) else 0.0
+    if max_diff > FUSED_ATOL:
+        raise RuntimeError(f"Fused serving differs by {max_diff:.2e} (> {FUSED_ATOL:.0e})")
+    return max_diff
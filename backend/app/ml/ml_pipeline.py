@@ -1,21 +1,24 @@
 import json
+import logging
+import os
+import time
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import TYPE_CHECKING, Callable, Tuple, Optional
 
-import joblib
 import numpy as np
-import pandas as pd
-import shap
-import torch
-import torch.nn as nn
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
+from scipy.special import expit
 
 from app.core.config import ARTIFACTS_DIR
 from app.core.db import get_db
+from app.ml.mlp_engine import export_mlp
+
+logger = logging.getLogger("early_risk_app")
+
+# pandas, sklearn, torch, shap and joblib are imported inside the training
+# functions: the API process imports this module for FEATURE_COLUMNS and
+# must not pay for training-only dependencies at startup.
+if TYPE_CHECKING:
+    import pandas as pd
 
 RANDOM_STATE = 42
 
@@ -31,6 +34,17 @@ FEATURE_COLUMNS = [
 
 TARGET_COLUMN = "DPDBucketNextMonthBinary"
 
+# CustomerFeatures field -> model feature column
+FEATURE_FIELD_MAP = {
+    "credit_limit": "CreditLimit",
+    "utilisation_pct": "UtilisationPct",
+    "avg_payment_ratio": "AvgPaymentRatio",
+    "min_due_paid_freq": "MinDuePaidFrequency",
+    "merchant_mix_index": "MerchantMixIndex",
+    "cash_withdrawal_pct": "CashWithdrawalPct",
+    "recent_spend_change_pct": "RecentSpendChangePct",
+}
+
 COLUMN_ALIAS_MAP = {
     "customer_id": "CustomerID",
     "customer id": "CustomerID",
@@ -52,14 +66,26 @@ COLUMN_ALIAS_MAP = {
     "delinquency_flag_next_month (dpd_bucket)": "DPDBucketNextMonth",
 }
 
-def normalize_bank_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
-    df = df_raw.copy()
-    norm_cols = [c.strip().lower() for c in df.columns]
+def canonical_column_map(columns) -> dict:
+    """
+    Map raw headers to canonical names: aliases from COLUMN_ALIAS_MAP
+    (case/whitespace-insensitive) are renamed, anything else is kept as is.
+    """
     rename_map = {}
-    for orig, norm in zip(df.columns, norm_cols):
+    for orig in columns:
+        norm = str(orig).strip().lower()
         if norm in COLUMN_ALIAS_MAP:
             rename_map[orig] = COLUMN_ALIAS_MAP[norm]
-    df.rename(columns=rename_map, inplace=True)
+    return rename_map
+
+
+def normalize_bank_dataframe(df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Rename bank headers to canonical names and drop rows with none of the
+    known columns filled. Works in place (no copy of the frame) and
+    returns df.
+    """
+    df.rename(columns=canonical_column_map(df.columns), inplace=True)
 
     required_any = [
         "CustomerID",
@@ -74,23 +100,18 @@ def normalize_bank_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
     ]
     intersection = [c for c in required_any if c in df.columns]
     if intersection:
-        df = df.dropna(subset=intersection, how="all")
+        empty = df[intersection].isna().all(axis=1).to_numpy()
+        if empty.any():
+            df.drop(index=df.index[empty], inplace=True)
     return df
 
-class MLP(nn.Module):
-    def __init__(self, input_dim: int):
-        super().__init__()
-        self.net = nn.Sequential(
-            nn.Linear(input_dim, 32),
-            nn.ReLU(),
-            nn.Dropout(0.2),
-            nn.Linear(32, 16),
-            nn.ReLU(),
-            nn.Linear(16, 1),
-        )
+def __getattr__(name):
+    # MLP lives in app.ml.torch_mlp so importing this module doesn't import torch
+    if name == "MLP":
+        from app.ml.torch_mlp import MLP
 
-    def forward(self, x):
-        return self.net(x)
+        return MLP
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def _get_artifact_paths(artifact_dir: Optional[Path] = None):
     base = ARTIFACTS_DIR if artifact_dir is None else artifact_dir
@@ -103,7 +124,84 @@ def _get_artifact_paths(artifact_dir: Optional[Path] = None):
     baseline_path = base / "baseline_stats.json"
     return logreg_path, tree_path, nn_path, scaler_path, shap_path, baseline_path
 
-def train_models(df: pd.DataFrame, artifact_dir: Optional[Path] = None) -> Tuple[float, float, float]:
+def baseline_stats_of(df: "pd.DataFrame") -> dict:
+    """Feature means / stds and target rate of a training frame, for drift checks."""
+    return {
+        "feature_means": {col: float(df[col].mean()) for col in FEATURE_COLUMNS},
+        "feature_stds": {col: float(df[col].std()) for col in FEATURE_COLUMNS},
+        "target_rate": float(df[TARGET_COLUMN].mean()),
+        "rows": int(len(df)),
+    }
+
+def _read_baseline_stats(artifact_dir: Path) -> dict:
+    path = artifact_dir / "baseline_stats.json"
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def merge_baseline_stats(parent: dict, new: dict) -> dict:
+    """
+    Baseline stats over the parent's rows plus the new ones: means and
+    target rate weighted by row count, stds via the pooled variance.
+    Without parent stats (or their row count) the new stats are returned.
+    """
+    n1, n2 = parent.get("rows") or 0, new["rows"]
+    if not n1 or "feature_means" not in parent:
+        return new
+    if not n2:
+        return parent
+    n = n1 + n2
+    means, stds = {}, {}
+    for col in FEATURE_COLUMNS:
+        m1, m2 = parent["feature_means"][col], new["feature_means"][col]
+        # std is NaN for a single row
+        s1, s2 = np.nan_to_num([parent["feature_stds"][col], new["feature_stds"][col]])
+        mean = (n1 * m1 + n2 * m2) / n
+        # stds are sample (ddof=1) stds; pool the sums of squared deviations
+        ss = (n1 - 1) * s1**2 + (n2 - 1) * s2**2
+        ss += n1 * (m1 - mean) ** 2 + n2 * (m2 - mean) ** 2
+        means[col], stds[col] = mean, float(np.sqrt(ss / (n - 1)))
+    return {
+        "feature_means": means,
+        "feature_stds": stds,
+        "target_rate": (n1 * parent["target_rate"] + n2 * new["target_rate"]) / n,
+        "rows": n,
+    }
+
+def train_models(
+    df: "pd.DataFrame",
+    artifact_dir: Optional[Path] = None,
+    progress: Optional[Callable[[str, float], None]] = None,
+    timings: Optional[dict] = None,
+    parallel: Optional[bool] = None,
+    record_metadata: bool = True,
+) -> Tuple[float, float, float]:
+    """
+    Train the three ensemble members and write their artifacts.
+
+    Members are fitted concurrently in a process pool when ``parallel``
+    (default: settings.TRAINING_PARALLEL on machines with more than two
+    cores); the artifacts are identical either way. ``progress(stage, fraction)`` is called as training moves
+    through stages ("training", "saving", "explainer") and may raise to
+    abort the run (used for job cancellation). Wall time per stage is
+    recorded into ``timings`` if given. ``record_metadata=False`` skips the
+    model_metadata write (benchmarks).
+    """
+    report = progress or (lambda stage, fraction: None)
+    timings = {} if timings is None else timings
+
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    from app.core.config import settings
+    from app.ml.training_members import train_members
+
+    if parallel is None:
+        # on one or two cores the pool only adds process overhead
+        parallel = settings.TRAINING_PARALLEL and (os.cpu_count() or 1) > 2
+
+    t0 = time.perf_counter()
     X = df[FEATURE_COLUMNS].values
     y = df[TARGET_COLUMN].values
 
@@ -114,76 +212,188 @@ def train_models(df: pd.DataFrame, artifact_dir: Optional[Path] = None) -> Tuple
     scaler = StandardScaler()
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
+    timings["prepare"] = time.perf_counter() - t0
 
-    logreg = LogisticRegression(
-        random_state=RANDOM_STATE, max_iter=1000, class_weight="balanced"
+    t0 = time.perf_counter()
+    logreg, tree, nn_state, member_timings = train_members(
+        X_train_scaled, y_train, parallel, lambda f: report("training", f)
     )
-    logreg.fit(X_train_scaled, y_train)
-    logreg_auc = roc_auc_score(y_test, logreg.predict_proba(X_test_scaled)[:, 1])
+    timings["members"] = time.perf_counter() - t0
+    timings.update({f"fit_{name}": seconds for name, seconds in member_timings.items()})
 
-    tree = RandomForestClassifier(
-        n_estimators=200,
-        max_depth=6,
-        min_samples_leaf=5,
-        random_state=RANDOM_STATE,
-        class_weight="balanced",
+    return _evaluate_and_save(
+        df, scaler, logreg, tree, nn_state, X_test_scaled, y_test,
+        artifact_dir, report, timings, record_metadata,
     )
-    tree.fit(X_train_scaled, y_train)
+
+
+def train_models_incremental(
+    new_df: "pd.DataFrame",
+    replay_df: Optional["pd.DataFrame"],
+    parent_dir: Path,
+    artifact_dir: Path,
+    progress: Optional[Callable[[str, float], None]] = None,
+    timings: Optional[dict] = None,
+    add_trees: Optional[int] = None,
+    record_metadata: bool = True,
+) -> Tuple[float, float, float]:
+    """
+    Continue the version in ``parent_dir`` on new_df plus a replay sample of
+    the parent's training rows, writing a full set of artifacts to
+    ``artifact_dir``.
+
+    The scaler statistics are updated with the new rows only (the replayed
+    rows are already in them), unless the forest can't be rebased onto the
+    updated scaler exactly (see training_members.incremental_scaler); the
+    members are rebased and warm-started (see continue_members). The
+    parent's baseline stats are merged with the new rows'.
+    ``add_trees`` defaults to settings.INCREMENTAL_FOREST_TREES. AUCs are
+    measured on a held-out quarter of new + replay rows. ``progress`` and
+    ``timings`` behave as in train_models.
+    """
+    report = progress or (lambda stage, fraction: None)
+    timings = {} if timings is None else timings
+
+    import copy
+
+    import joblib
+    import pandas as pd
+    import torch
+    from sklearn.model_selection import train_test_split
+
+    from app.core.config import settings
+    from app.ml.training_members import continue_members, incremental_scaler
+
+    if add_trees is None:
+        add_trees = settings.INCREMENTAL_FOREST_TREES
+
+    t0 = time.perf_counter()
+    logreg_path, tree_path, nn_path, scaler_path, _, _ = _get_artifact_paths(parent_dir)
+    old_scaler = joblib.load(scaler_path)
+    parent = (
+        joblib.load(logreg_path),
+        joblib.load(tree_path),
+        {k: v.numpy() for k, v in torch.load(nn_path, map_location="cpu").items()},
+    )
+
+    columns = FEATURE_COLUMNS + [TARGET_COLUMN]
+    frames = [new_df[columns]]
+    if replay_df is not None and len(replay_df):
+        frames.append(replay_df[columns])
+    df = pd.concat(frames, ignore_index=True)
+    is_new = np.arange(len(df)) < len(new_df)
+
+    X = df[FEATURE_COLUMNS].values
+    y = df[TARGET_COLUMN].values
+    X_train, X_test, y_train, y_test, new_train, _ = train_test_split(
+        X, y, is_new, test_size=0.25, random_state=RANDOM_STATE, stratify=y
+    )
+
+    scaler = copy.deepcopy(old_scaler)
+    if new_train.any():
+        scaler.partial_fit(X_train[new_train])
+    scaler, rebase_error = incremental_scaler(parent[1], old_scaler, scaler, X)
+    if rebase_error:
+        logger.warning(
+            f"Forest rebase onto the refitted scaler would change scores by up to {rebase_error:.2e}; "
+            "keeping the parent's scaler"
+        )
+    X_train_scaled = scaler.transform(X_train)
+    X_test_scaled = scaler.transform(X_test)
+    timings["prepare"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    logreg, tree, nn_state, member_timings = continue_members(
+        parent, old_scaler, scaler, X_train_scaled, y_train, add_trees,
+        lambda f: report("training", f), X_raw=X,
+    )
+    timings["members"] = time.perf_counter() - t0
+    timings.update({f"fit_{name}": seconds for name, seconds in member_timings.items()})
+
+    # the replayed rows are already in the parent's stats; parents saved
+    # before baseline_stats recorded their dataset size can't be weighted
+    parent_stats = _read_baseline_stats(parent_dir)
+    if not parent_stats.get("rows"):
+        logger.warning(f"{parent_dir} has no recorded dataset size; baseline stats cover the new rows only")
+    stats = merge_baseline_stats(parent_stats, baseline_stats_of(new_df))
+    return _evaluate_and_save(
+        df, scaler, logreg, tree, nn_state, X_test_scaled, y_test,
+        artifact_dir, report, timings, record_metadata, baseline_stats=stats,
+    )
+
+
+def _evaluate_and_save(
+    df: "pd.DataFrame",
+    scaler,
+    logreg,
+    tree,
+    nn_state: dict,
+    X_test_scaled: np.ndarray,
+    y_test: np.ndarray,
+    artifact_dir: Optional[Path],
+    report: Callable[[str, float], None],
+    timings: dict,
+    record_metadata: bool,
+    baseline_stats: Optional[dict] = None,
+) -> Tuple[float, float, float]:
+    """Test-split AUCs of the fitted members, then write every artifact and
+    ``baseline_stats`` (default: those of df)."""
+    import joblib
+    import shap
+    import torch
+    from sklearn.metrics import roc_auc_score
+
+    from app.ml.torch_mlp import MLP
+    from app.ml.training_members import mlp_logits
+
+    t0 = time.perf_counter()
+    logreg_auc = roc_auc_score(y_test, logreg.predict_proba(X_test_scaled)[:, 1])
     tree_auc = roc_auc_score(y_test, tree.predict_proba(X_test_scaled)[:, 1])
 
-    input_dim = X_train_scaled.shape[1]
-    nn_model = MLP(input_dim)
-    criterion = nn.BCEWithLogitsLoss()
-    optimizer = torch.optim.Adam(nn_model.parameters(), lr=1e-3)
-
-    X_train_t = torch.tensor(X_train_scaled, dtype=torch.float32)
-    y_train_t = torch.tensor(y_train.reshape(-1, 1), dtype=torch.float32)
-    X_test_t = torch.tensor(X_test_scaled, dtype=torch.float32)
-    y_test_t = torch.tensor(y_test.reshape(-1, 1), dtype=torch.float32)
-
-    nn_model.train()
-    for _ in range(80):
-        optimizer.zero_grad()
-        outputs = nn_model(X_train_t)
-        loss = criterion(outputs, y_train_t)
-        loss.backward()
-        optimizer.step()
-
-    nn_model.eval()
-    with torch.no_grad():
-        logits = nn_model(X_test_t).numpy().ravel()
-        probs = 1 / (1 + np.exp(-logits))
+    nn_model = MLP(X_test_scaled.shape[1])
+    nn_model.load_state_dict({k: torch.from_numpy(v) for k, v in nn_state.items()})
+    logits = mlp_logits(nn_model, X_test_scaled).astype(np.float64)
+    probs = expit(logits)
     nn_auc = roc_auc_score(y_test, probs)
+    timings["evaluate"] = time.perf_counter() - t0
 
     logreg_path, tree_path, nn_path, scaler_path, shap_path, baseline_path = _get_artifact_paths(
         artifact_dir
     )
 
+    report("saving", 0.0)
+    t0 = time.perf_counter()
     joblib.dump(logreg, logreg_path)
     joblib.dump(tree, tree_path)
     joblib.dump(scaler, scaler_path)
     torch.save(nn_model.state_dict(), nn_path)
+    # torch-free serving copy, verified against the torch forward pass on
+    # (up to the first 100k rows of) the test split
+    export_mlp(nn_model, nn_path.parent, X_test_scaled[:100_000])
 
+    timings["save"] = time.perf_counter() - t0
+
+    report("explainer", 0.0)
+    t0 = time.perf_counter()
     explainer = shap.TreeExplainer(tree)
     joblib.dump(explainer, shap_path)
+    timings["explainer"] = time.perf_counter() - t0
 
-    baseline_stats = {
-        "feature_means": {col: float(df[col].mean()) for col in FEATURE_COLUMNS},
-        "feature_stds": {col: float(df[col].std()) for col in FEATURE_COLUMNS},
-        "target_rate": float(df[TARGET_COLUMN].mean()),
-    }
+    if baseline_stats is None:
+        baseline_stats = baseline_stats_of(df)
     with open(baseline_path, "w") as f:
         json.dump(baseline_stats, f, indent=2)
 
-    db = get_db()
-    db["model_metadata"].delete_many({})
-    db["model_metadata"].insert_one(
-        {
-            "logreg_auc": logreg_auc,
-            "tree_auc": tree_auc,
-            "nn_auc": nn_auc,
-            "baseline_stats": baseline_stats,
-        }
-    )
+    if record_metadata:
+        db = get_db()
+        db["model_metadata"].delete_many({})
+        db["model_metadata"].insert_one(
+            {
+                "logreg_auc": logreg_auc,
+                "tree_auc": tree_auc,
+                "nn_auc": nn_auc,
+                "baseline_stats": baseline_stats,
+            }
+        )
 
     return logreg_auc, tree_auc, nn_auc
@@ -0,0 +1,144 @@
+import logging
+import os
+from pathlib import Path
+from typing import Mapping
+
+import numpy as np
+from scipy.special import expit
+
+logger = logging.getLogger("early_risk_app")
+
+NN_WEIGHTS_FILE = "nn_weights.npz"
+
+# max |p_numpy - p_torch| accepted by the equivalence check (float32 matmul noise)
+EQUIVALENCE_ATOL = 1e-6
+
+
+class NumpyMLP:
+    """
+    Inference-only copy of the ensemble MLP (Linear/ReLU stack ending in one
+    logit) held as plain float32 arrays. Dropout is a no-op in eval mode, so
+    a forward pass is just matmul + bias + ReLU per layer, and scoring never
+    has to import torch.
+    """
+
+    def __init__(
+        self,
+        weights: list[np.ndarray],
+        biases: list[np.ndarray],
+        input_dtype=np.float32,
+    ):
+        # stored as (in, out) so a forward pass is X @ W + b; only the input
+        # layer may run in float64 (see fold_input_scaling)
+        dtypes = [input_dtype] + [np.float32] * (len(weights) - 1)
+        self.weights = [np.ascontiguousarray(w, dtype=d) for w, d in zip(weights, dtypes)]
+        self.biases = [np.ascontiguousarray(b, dtype=d) for b, d in zip(biases, dtypes)]
+
+    @classmethod
+    def from_state_dict(cls, state_dict: Mapping) -> "NumpyMLP":
+        """
+        Build from an MLP state_dict (torch tensors or arrays). Linear layers
+        are taken in registration order, which is the forward order of
+        nn.Sequential.
+        """
+        weights, biases = [], []
+        for key, value in state_dict.items():
+            arr = value.detach().cpu().numpy() if hasattr(value, "detach") else np.asarray(value)
+            if key.endswith(".weight"):
+                weights.append(arr.T)
+            elif key.endswith(".bias"):
+                biases.append(arr)
+        if not weights or len(weights) != len(biases):
+            raise ValueError("state_dict does not look like a Linear/ReLU MLP")
+        return cls(weights, biases)
+
+    @classmethod
+    def load(cls, path: Path) -> "NumpyMLP":
+        with np.load(path) as data:
+            n = len([k for k in data.files if k.startswith("W")])
+            return cls([data[f"W{i}"] for i in range(n)], [data[f"b{i}"] for i in range(n)])
+
+    def save(self, path: Path):
+        """
+        Write to a temporary file beside ``path`` and rename it into place,
+        so a loader never sees a partly written file.
+        """
+        arrays = {}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"W{i}"] = w
+            arrays[f"b{i}"] = b
+        path = Path(path)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def fold_input_scaling(self, mean: np.ndarray, scale: np.ndarray) -> "NumpyMLP":
+        """
+        Return a copy that takes raw features instead of (X - mean) / scale.
+
+        The standardisation is absorbed into the first layer:
+        W' = W / scale[:, None] and b' = b - (mean / scale) @ W. That layer is
+        kept in float64 so raw, unscaled magnitudes (e.g. CreditLimit) lose no
+        precision before the float32 hidden layers.
+        """
+        w0 = self.weights[0].astype(np.float64)
+        b0 = self.biases[0].astype(np.float64)
+        mean = np.asarray(mean, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        weights = [w0 / scale[:, None]] + self.weights[1:]
+        biases = [b0 - (mean / scale) @ w0] + self.biases[1:]
+        return NumpyMLP(weights, biases, input_dtype=np.float64)
+
+    def logits(self, X: np.ndarray) -> np.ndarray:
+        h = np.asarray(X, dtype=self.weights[0].dtype)
+        last = len(self.weights) - 1
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            h = h @ w
+            h += b
+            if i < last:
+                np.maximum(h, 0.0, out=h)
+            if i == 0:
+                h = h.astype(np.float32, copy=False)
+        return h.ravel()
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Positive-class probability for each row, shape (N,)."""
+        # expit doesn't overflow on large negative logits
+        return expit(self.logits(X))
+
+
+def check_equivalence(torch_model, numpy_mlp: NumpyMLP, X: np.ndarray) -> float:
+    """
+    Run X through both the torch model (eval mode) and the NumPy copy and
+    return the max absolute probability difference. Raises if it exceeds
+    EQUIVALENCE_ATOL.
+    """
+    import torch
+
+    torch_model.eval()
+    with torch.no_grad():
+        logits = torch_model(torch.tensor(X, dtype=torch.float32)).numpy().ravel()
+    p_torch = expit(logits)
+    p_numpy = numpy_mlp.predict_proba(X)
+    max_diff = float(np.max(np.abs(p_torch - p_numpy))) if len(X) else 0.0
+    if max_diff > EQUIVALENCE_ATOL:
+        raise RuntimeError(
+            f"NumPy MLP differs from torch by {max_diff:.2e} (> {EQUIVALENCE_ATOL:.0e})"
+        )
+    return max_diff
+
+
+def export_mlp(torch_model, artifact_dir: Path, X_check: np.ndarray) -> NumpyMLP:
+    """
+    Export a trained torch MLP to NN_WEIGHTS_FILE after checking that the
+    NumPy forward pass matches torch on X_check.
+    """
+    numpy_mlp = NumpyMLP.from_state_dict(torch_model.state_dict())
+    max_diff = check_equivalence(torch_model, numpy_mlp, X_check)
+    numpy_mlp.save(artifact_dir / NN_WEIGHTS_FILE)
+    logger.info(f"Exported NumPy MLP to {artifact_dir} (max |dp| vs torch = {max_diff:.1e})")
+    return numpy_mlp
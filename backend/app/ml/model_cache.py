@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Any
+
+
+class ModelCache:
+    """
+    Bounded LRU cache of loaded model bundles keyed by (username, version).
+
+    Lookups are thread-safe. A miss loads the bundle outside the global lock
+    while holding a per-key lock, so concurrent requests for the same version
+    load it exactly once and requests for other versions are never blocked.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, int(max_size))
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # another thread may have finished loading while we waited
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+
+            value = loader()
+
+            with self._lock:
+                self.loads += 1
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+                self._key_locks.pop(key, None)
+            return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.loads
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "keys": [list(k) if isinstance(k, tuple) else k for k in self._entries],
+            }
@@ -1,24 +1,50 @@
 import json
 import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Tuple, Optional
+from types import MappingProxyType
+from typing import Any, Mapping, Tuple, Optional
 
-import joblib
 import numpy as np
-import torch
+from scipy.special import expit
 
-from app.core.config import ARTIFACTS_DIR
-from app.ml.ml_pipeline import MLP, FEATURE_COLUMNS
+from app.core.config import ARTIFACTS_DIR, settings
+from app.ml.ml_pipeline import FEATURE_COLUMNS
 from app.core.db import get_db
+from app.ml.batcher import InferenceBatcher
+from app.ml.fused_engine import FusedModels, fuse_scaler, check_fused
+from app.ml.model_cache import ModelCache
+from app.ml.mlp_engine import NumpyMLP, NN_WEIGHTS_FILE
+from app.ml.tree_engine import compile_forest
 
 logger = logging.getLogger("early_risk_app")
 
-logreg_model = None
-tree_model = None
-nn_model = None
-scaler = None
-shap_explainer = None
-baseline_stats: Dict = {}
+_model_cache = ModelCache(settings.MODEL_CACHE_SIZE)
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """
+    Everything needed to score with one model version.
+
+    Bundles are never mutated after loading, so any number of threads can
+    score with the same bundle concurrently, and a request that picked up a
+    bundle keeps using that exact version until it returns.
+    """
+    username: Optional[str]
+    version: Optional[int]
+    artifact_dir: Path
+    logreg_model: Any
+    tree_model: Any
+    nn_model: Any  # torch MLP; only loaded when MLP_ENGINE == "torch"
+    scaler: Any
+    nn_engine: Optional[NumpyMLP] = None
+    shap_path: Optional[Path] = None  # explainer is unpickled on demand, see load_shap_explainer
+    tree_engine: Any = None  # CompiledForest, or None to use tree_model.predict_proba
+    fused: Optional[FusedModels] = None  # scaler folded into logreg + MLP
+    baseline_stats: Mapping = field(default_factory=lambda: MappingProxyType({}))
+
 
 def _paths_from_dir(artifact_dir: Optional[Path]):
     base = ARTIFACTS_DIR if artifact_dir is None else artifact_dir
@@ -32,81 +58,199 @@ def _paths_from_dir(artifact_dir: Optional[Path]):
     baseline_path = base / "baseline_stats.json"
     return logreg_path, tree_path, nn_path, scaler_path, shap_path, baseline_path
 
-def load_models(artifact_dir: Optional[Path] = None):
-    global logreg_model, tree_model, nn_model, scaler, shap_explainer, baseline_stats
+def _load_torch_mlp(nn_path: Path):
+    import torch
+    from app.ml.torch_mlp import MLP
+
+    model = MLP(len(FEATURE_COLUMNS))
+    state_dict = torch.load(nn_path, map_location=torch.device("cpu"))
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model.float()
 
+def _fuse(scaler, logreg_model, nn_engine: NumpyMLP) -> Optional[FusedModels]:
+    try:
+        fused = fuse_scaler(scaler, logreg_model, nn_engine)
+        # probe rows in raw feature space around the training distribution
+        rng = np.random.default_rng(0)
+        X_check = fused.mean + fused.scale * rng.normal(0.0, 2.0, size=(512, len(fused.mean)))
+        check_fused(fused, scaler, logreg_model, nn_engine, X_check)
+        return fused
+    except (RuntimeError, ValueError, AttributeError) as e:
+        logger.warning(f"Fused serving disabled for this bundle: {e}")
+        return None
+
+def load_models(
+    artifact_dir: Optional[Path] = None,
+    username: Optional[str] = None,
+    version: Optional[int] = None,
+) -> ModelBundle:
+    """
+    Read every model artifact from disk and return them as a ModelBundle.
+    This is the only place that does disk I/O for scoring.
+    """
     logreg_path, tree_path, nn_path, scaler_path, shap_path, baseline_path = _paths_from_dir(
         artifact_dir
     )
 
-    logger.info(f"Loading model artifacts from {logreg_path.parent} ...")
+    import joblib
 
-    if logreg_path.exists():
-        logreg_model = joblib.load(logreg_path)
-    else:
-        logreg_model = None
-
-    if tree_path.exists():
-        tree_model = joblib.load(tree_path)
-    else:
-        tree_model = None
+    logger.info(f"Loading model artifacts from {logreg_path.parent} ...")
 
-    if scaler_path.exists():
-        scaler = joblib.load(scaler_path)
-    else:
-        scaler = None
+    logreg_model = joblib.load(logreg_path) if logreg_path.exists() else None
+    tree_model = joblib.load(tree_path) if tree_path.exists() else None
+    scaler = joblib.load(scaler_path) if scaler_path.exists() else None
 
-    if shap_path.exists():
-        shap_explainer = joblib.load(shap_path)
-    else:
-        shap_explainer = None
-
-    if nn_path.exists():
-        input_dim = len(FEATURE_COLUMNS)
-        model = MLP(input_dim)
-        state_dict = torch.load(nn_path, map_location=torch.device("cpu"))
-        model.load_state_dict(state_dict)
-        model.eval()
-        nn_model = model.float()
-    else:
-        nn_model = None
+    nn_model = None
+    nn_engine = None
+    nn_weights_path = nn_path.parent / NN_WEIGHTS_FILE
+    if settings.MLP_ENGINE == "numpy" and nn_weights_path.exists():
+        nn_engine = NumpyMLP.load(nn_weights_path)
+    elif nn_path.exists():
+        nn_model = _load_torch_mlp(nn_path)
+        if settings.MLP_ENGINE == "numpy":
+            # artifacts are never written here; see scripts/export_mlp_weights.py
+            logger.warning(
+                f"No {NN_WEIGHTS_FILE} in {nn_path.parent}; serving the MLP with torch"
+            )
 
-    baseline_stats.clear()
+    baseline_stats = {}
     if baseline_path.exists():
         with open(baseline_path, "r") as f:
-            baseline_stats.update(json.load(f))
+            baseline_stats = json.load(f)
     else:
         db = get_db()
         meta = db["model_metadata"].find_one()
         if meta and "baseline_stats" in meta:
-            baseline_stats.update(meta["baseline_stats"])
+            baseline_stats = meta["baseline_stats"]
 
-    if logreg_model is None or tree_model is None or nn_model is None or scaler is None:
+    if (
+        logreg_model is None
+        or tree_model is None
+        or (nn_model is None and nn_engine is None)
+        or scaler is None
+    ):
         raise RuntimeError("One or more models/scaler not loaded")
 
-def predict_probas(features_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    global logreg_model, tree_model, nn_model, scaler
-    if scaler is None or logreg_model is None or tree_model is None or nn_model is None:
-        raise RuntimeError("Models not loaded; call load_models_for(...) first")
+    tree_engine = compile_forest(tree_model) if settings.TREE_ENGINE == "compiled" else None
+    fused = None
+    if settings.FUSED_SERVING and nn_engine is not None:
+        fused = _fuse(scaler, logreg_model, nn_engine)
+
+    return ModelBundle(
+        username=username,
+        version=version,
+        artifact_dir=logreg_path.parent,
+        logreg_model=logreg_model,
+        tree_model=tree_model,
+        nn_model=nn_model,
+        scaler=scaler,
+        nn_engine=nn_engine,
+        shap_path=shap_path if shap_path.exists() else None,
+        tree_engine=tree_engine,
+        fused=fused,
+        baseline_stats=MappingProxyType(baseline_stats),
+    )
+
+def predict_probas(
+    bundle: ModelBundle, features_array: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if bundle.fused is not None:
+        return _predict_probas_fused(bundle, features_array)
+
+    X_scaled = bundle.scaler.transform(features_array)
+    p_logreg = bundle.logreg_model.predict_proba(X_scaled)[:, 1]
+    if bundle.tree_engine is not None:
+        p_tree = bundle.tree_engine.predict_proba(X_scaled)
+    else:
+        p_tree = bundle.tree_model.predict_proba(X_scaled)[:, 1]
+
+    if bundle.nn_engine is not None:
+        p_nn = bundle.nn_engine.predict_proba(X_scaled)
+    else:
+        import torch
+
+        X_t = torch.tensor(X_scaled, dtype=torch.float32)
+        with torch.no_grad():
+            logits = bundle.nn_model(X_t).numpy().ravel()
+            p_nn = expit(logits)
 
-    X_scaled = scaler.transform(features_array)
-    p_logreg = logreg_model.predict_proba(X_scaled)[:, 1]
-    p_tree = tree_model.predict_proba(X_scaled)[:, 1]
+    return p_logreg, p_tree, p_nn
 
-    X_t = torch.tensor(X_scaled, dtype=torch.float32)
-    with torch.no_grad():
-        logits = nn_model(X_t).numpy().ravel()
-        p_nn = 1 / (1 + np.exp(-logits))
+def _predict_probas_fused(
+    bundle: ModelBundle, features_array: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    fused = bundle.fused
+    X = np.asarray(features_array, dtype=np.float64)
+    p_logreg = fused.logreg.predict_proba(X)
+    p_nn = fused.mlp.predict_proba(X)
+
+    X_scaled = fused.scale_for_trees(X)
+    if bundle.tree_engine is not None:
+        p_tree = bundle.tree_engine.predict_proba(X_scaled)
+    else:
+        p_tree = bundle.tree_model.predict_proba(X_scaled)[:, 1]
 
     return p_logreg, p_tree, p_nn
 
-def load_models_for(username: str, version: int):
+def load_models_for(username: str, version: int) -> ModelBundle:
+    """
+    Return the bundle for (username, version), loading its artifacts
+    from disk only if they are not already in the in-process cache.
+    """
+    version = int(version)
     artifact_dir = ARTIFACTS_DIR / username / f"v{version}"
-    load_models(artifact_dir=artifact_dir)
+    return _model_cache.get_or_load(
+        (username, version),
+        lambda: load_models(artifact_dir=artifact_dir, username=username, version=version),
+    )
+
+
+@lru_cache(maxsize=settings.MODEL_CACHE_SIZE)
+def _load_shap_explainer(shap_path: Path):
+    import joblib
+
+    return joblib.load(shap_path)
+
+
+def load_shap_explainer(bundle: ModelBundle):
+    """
+    Unpickle the bundle's SHAP explainer the first time it is needed.
+    Scoring never needs it, so loading a bundle doesn't import shap.
+    """
+    if bundle.shap_path is None:
+        return None
+    return _load_shap_explainer(bundle.shap_path)
+
+
+def invalidate_models_for(username: str, version: int):
+    _model_cache.invalidate((username, int(version)))
+    _load_shap_explainer.cache_clear()
+
+
+def model_cache_stats() -> dict:
+    return _model_cache.stats()
 
 def predict_probas_for(username: str, version: int, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    load_models_for(username, version)
-    return predict_probas(X)
+    return predict_probas_batched(load_models_for(username, version), X)
+
+
+def predict_probas_batched(bundle: ModelBundle, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if _batcher is not None and X.shape[0] == 1:
+        # single-row calls are coalesced with concurrent ones for the same bundle
+        p_log, p_tree, p_nn = _batcher.submit(bundle, X[0])
+        return np.array([p_log]), np.array([p_tree]), np.array([p_nn])
+    return predict_probas(bundle, X)
+
+
+def batcher_stats() -> Optional[dict]:
+    return _batcher.stats() if _batcher is not None else None
+
+_batcher = (
+    InferenceBatcher(predict_probas, settings.BATCH_WINDOW_MS, settings.BATCH_MAX_ROWS)
+    if settings.BATCHING_ENABLED
+    else None
+)
 
 def compute_ensemble(p_logreg: np.ndarray, p_tree: np.ndarray, p_nn: np.ndarray) -> np.ndarray:
     return (p_logreg + p_tree + p_nn) / 3.0
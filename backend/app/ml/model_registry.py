@@ -1,10 +1,24 @@
 from datetime import datetime
 from app.core.db import get_db
+from app.ml.score_cache import get_score_cache
 
 def model_versions_col():
     return get_db()["model_versions"]
 
-def register_model_version(username: str, version: int, metrics: dict, is_active: bool = True):
+def register_model_version(
+    username: str,
+    version: int,
+    metrics: dict,
+    is_active: bool = True,
+    datasets: list | None = None,
+    parent_version: int | None = None,
+):
+    """
+    ``datasets`` is the version's training lineage: the content hashes of
+    every upload it learned from (the dataset cache key), oldest first;
+    incremental retrains replay from these. ``parent_version`` is set when
+    the version continued another one.
+    """
     col = model_versions_col()
     if is_active:
         col.update_many({"username": username}, {"$set": {"is_active": False}})
@@ -16,9 +30,14 @@ def register_model_version(username: str, version: int, metrics: dict, is_active
             "logreg_auc": metrics["logreg_auc"],
             "tree_auc": metrics["tree_auc"],
             "nn_auc": metrics["nn_auc"],
+            "datasets": datasets or [],
+            "parent_version": parent_version,
             "created_at": datetime.utcnow(),
         }
     )
+    if is_active:
+        # cached results belong to the previous version; drop them now
+        get_score_cache().invalidate(username, keep_version=version)
 
 def list_model_versions(username: str):
     col = model_versions_col()
@@ -27,3 +46,6 @@ def list_model_versions(username: str):
 def get_active_model_version(username: str):
     col = model_versions_col()
     return col.find_one({"username": username, "is_active": True}, sort=[("created_at", -1)])
+
+def get_model_version(username: str, version: int):
+    return model_versions_col().find_one({"username": username, "version": version})
@@ -1,61 +1,103 @@
+from dataclasses import dataclass
 from typing import List
+
+import numpy as np
+
+from app.ml.ml_pipeline import FEATURE_COLUMNS, FEATURE_FIELD_MAP
 from app.schemas.risk import CustomerFeatures, RuleTrigger
 
-def evaluate_rules(customer: CustomerFeatures) -> List[RuleTrigger]:
-    rules: List[RuleTrigger] = []
 
-    if customer.utilisation_pct > 80:
-        rules.append(
-            RuleTrigger(
-                rule_name="High utilisation",
-                reason=f"Utilisation {customer.utilisation_pct:.1f}% > 80%",
-                suggested_outreach="Send payment reminder and partial payment plan suggestion.",
-            )
-        )
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    feature: str  # FEATURE_COLUMNS name
+    op: str  # ">" or "<"
+    threshold: float
+    reason: str  # formatted with value=<feature value>
+    outreach: str
 
-    if customer.recent_spend_change_pct < -30:
-        rules.append(
-            RuleTrigger(
-                rule_name="Spend drop",
-                reason=f"Recent spend change {customer.recent_spend_change_pct:.1f}% < -30%",
-                suggested_outreach="Reach out via call to confirm financial stress.",
-            )
-        )
 
-    if customer.cash_withdrawal_pct > 40:
-        rules.append(
-            RuleTrigger(
-                rule_name="High cash withdrawal",
-                reason=f"Cash withdrawal {customer.cash_withdrawal_pct:.1f}% > 40%",
-                suggested_outreach="Offer EMI restructuring and educate on revolving interest.",
-            )
-        )
+RULES = (
+    Rule(
+        "High utilisation", "UtilisationPct", ">", 80,
+        "Utilisation {value:.1f}% > 80%",
+        "Send payment reminder and partial payment plan suggestion.",
+    ),
+    Rule(
+        "Spend drop", "RecentSpendChangePct", "<", -30,
+        "Recent spend change {value:.1f}% < -30%",
+        "Reach out via call to confirm financial stress.",
+    ),
+    Rule(
+        "High cash withdrawal", "CashWithdrawalPct", ">", 40,
+        "Cash withdrawal {value:.1f}% > 40%",
+        "Offer EMI restructuring and educate on revolving interest.",
+    ),
+    Rule(
+        "Low average payment", "AvgPaymentRatio", "<", 40,
+        "Average payment ratio {value:.1f}% < 40%",
+        "Send payment reminder and partial payment plan suggestion.",
+    ),
+    Rule(
+        "High minimum due frequency", "MinDuePaidFrequency", ">", 70,
+        "Min due paid frequency {value:.1f}% > 70%",
+        "Reach out via call to confirm financial stress.",
+    ),
+    Rule(
+        "Low merchant mix", "MerchantMixIndex", "<", 0.4,
+        "Merchant mix index {value:.2f} < 0.40",
+        "Review spending patterns and suggest budgeting tools.",
+    ),
+)
 
-    if customer.avg_payment_ratio < 40:
-        rules.append(
-            RuleTrigger(
-                rule_name="Low average payment",
-                reason=f"Average payment ratio {customer.avg_payment_ratio:.1f}% < 40%",
-                suggested_outreach="Send payment reminder and partial payment plan suggestion.",
-            )
-        )
+RULE_NAMES = [r.name for r in RULES]
+# bit i of a trigger mask is set when RULES[i] fires
+RULE_BITS = {r.name: np.uint16(1 << i) for i, r in enumerate(RULES)}
 
-    if customer.min_due_paid_freq > 70:
-        rules.append(
-            RuleTrigger(
-                rule_name="High minimum due frequency",
-                reason=f"Min due paid frequency {customer.min_due_paid_freq:.1f}% > 70%",
-                suggested_outreach="Reach out via call to confirm financial stress.",
-            )
-        )
 
-    if customer.merchant_mix_index < 0.4:
-        rules.append(
+class CompiledRules:
+    """
+    RULES as column-index / threshold arrays, one group per operator, so an
+    (N, len(FEATURE_COLUMNS)) matrix is evaluated with one comparison per
+    operator instead of per-row Python.
+    """
+
+    def __init__(self, rules=RULES):
+        if len(rules) > 16:
+            raise ValueError("Trigger masks are uint16; at most 16 rules are supported")
+        self.rules = tuple(rules)
+        self.columns = np.array([FEATURE_COLUMNS.index(r.feature) for r in rules], dtype=np.intp)
+        self.thresholds = np.array([r.threshold for r in rules], dtype=np.float64)
+        self.greater = np.array([r.op == ">" for r in rules])
+        self.bits = np.array([1 << i for i in range(len(rules))], dtype=np.uint16)
+
+    def masks(self, X: np.ndarray) -> np.ndarray:
+        """(N, n_rules) boolean matrix of rule hits."""
+        values = np.asarray(X, dtype=np.float64)[:, self.columns]
+        # NaN compares False either way, like the scalar checks
+        return np.where(self.greater, values > self.thresholds, values < self.thresholds)
+
+    def trigger_bits(self, X: np.ndarray) -> np.ndarray:
+        """Per-row uint16 bitmask of fired rules (bit i = RULES[i])."""
+        return np.bitwise_or.reduce(self.masks(X) * self.bits, axis=1).astype(np.uint16)
+
+    def triggers(self, x: np.ndarray, bits: int) -> List[RuleTrigger]:
+        """Build messages for one row from its bitmask (only for rows actually returned)."""
+        return [
             RuleTrigger(
-                rule_name="Low merchant mix",
-                reason=f"Merchant mix index {customer.merchant_mix_index:.2f} < 0.40",
-                suggested_outreach="Review spending patterns and suggest budgeting tools.",
+                rule_name=rule.name,
+                reason=rule.reason.format(value=float(x[self.columns[i]])),
+                suggested_outreach=rule.outreach,
             )
-        )
+            for i, rule in enumerate(self.rules)
+            if bits & (1 << i)
+        ]
+
+
+compiled_rules = CompiledRules()
 
-    return rules
+
+def evaluate_rules(customer: CustomerFeatures) -> List[RuleTrigger]:
+    x = np.array([getattr(customer, field) for field in FEATURE_FIELD_MAP], dtype=np.float64)
+    bits = int(compiled_rules.trigger_bits(x[None, :])[0])
+    return compiled_rules.triggers(x, bits)
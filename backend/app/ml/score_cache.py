@@ -0,0 +1,147 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Hashable, Optional
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+
+def score_cache_col(db):
+    return db["score_cache"]
+
+
+class ScoreCache:
+    """
+    Bounded LRU of scoring results keyed by
+    (admin_username, model_version, quantized feature vector).
+
+    Features are rounded to ``decimals`` places before keying, so repeated
+    page loads for an unchanged customer skip inference entirely. A new
+    model version never sees old entries because the version is part of
+    the key; ``invalidate`` additionally drops an admin's entries eagerly.
+
+    With ``shared`` set to a Mongo collection, misses fall through to it and
+    results are written through, so all workers share one cache (expired by
+    a TTL index on ``created_at``).
+    """
+
+    def __init__(self, max_size: int, decimals: int, shared=None):
+        self.max_size = max(0, int(max_size))
+        self.decimals = int(decimals)
+        self.shared = shared
+        self._entries: "OrderedDict[Hashable, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def key(self, admin_username: str, version: int, features: np.ndarray) -> tuple:
+        # + 0.0 folds -0.0 into 0.0 so both quantize to the same key
+        quantized = np.round(np.asarray(features, dtype=float).ravel(), self.decimals) + 0.0
+        return (admin_username, int(version), tuple(quantized.tolist()))
+
+    @staticmethod
+    def _shared_id(key: tuple) -> str:
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(value)
+
+        if self.shared is not None:
+            try:
+                doc = self.shared.find_one({"_id": self._shared_id(key)}, {"result": 1})
+            except PyMongoError:
+                doc = None
+            if doc:
+                self._store(key, doc["result"])
+                with self._lock:
+                    self.shared_hits += 1
+                return dict(doc["result"])
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: tuple, result: dict):
+        self._store(key, result)
+        if self.shared is not None:
+            try:
+                self.shared.replace_one(
+                    {"_id": self._shared_id(key)},
+                    {
+                        "admin_username": key[0],
+                        "version": key[1],
+                        "result": result,
+                        "created_at": datetime.utcnow(),
+                    },
+                    upsert=True,
+                )
+            except PyMongoError:
+                pass
+
+    def _store(self, key: tuple, result: dict):
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, admin_username: str, keep_version: Optional[int] = None):
+        """Drop every entry for this admin except those for keep_version."""
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == admin_username and k[1] != keep_version]
+            for k in stale:
+                del self._entries[k]
+        if self.shared is not None:
+            query = {"admin_username": admin_username}
+            if keep_version is not None:
+                query["version"] = {"$ne": int(keep_version)}
+            try:
+                self.shared.delete_many(query)
+            except PyMongoError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": ((self.hits + self.shared_hits) / lookups) if lookups else 0.0,
+                "shared": self.shared is not None,
+            }
+
+
+_score_cache: Optional[ScoreCache] = None
+_init_lock = threading.Lock()
+
+
+def get_score_cache() -> ScoreCache:
+    global _score_cache
+    if _score_cache is None:
+        with _init_lock:
+            if _score_cache is None:
+                from app.core.config import settings
+                from app.core.db import get_db
+
+                shared = None
+                if settings.SCORE_CACHE_BACKEND == "mongo":
+                    shared = score_cache_col(get_db())
+                _score_cache = ScoreCache(
+                    settings.SCORE_CACHE_SIZE, settings.SCORE_CACHE_DECIMALS, shared=shared
+                )
+    return _score_cache
@@ -0,0 +1,456 @@
+import copy
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import warnings
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Callable, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.ml.ml_pipeline import RANDOM_STATE
+
+# the MLP's first Linear layer, whose inputs are the scaled features
+MLP_INPUT_LAYER = "net.0"
+# rows per forward pass when scoring the validation / test split
+MLP_EVAL_BATCH_ROWS = 65_536
+# cap on rows held out for early stopping
+MLP_MAX_VALIDATION_ROWS = 200_000
+# mini-batches are shrunk on small sets to give at least this many steps per epoch
+MLP_MIN_BATCHES_PER_EPOCH = 16
+# smallest drop in validation loss that resets early-stopping patience
+MLP_MIN_DELTA = 1e-4
+# epochs of the default full-batch MLP training
+FULL_BATCH_EPOCHS = 80
+# incremental scaler refits smaller than this (in old standard deviations) keep the parent's scaler
+SCALER_SHIFT_TOL = 1e-3
+# largest forest probability change a scaler rebase may cause; any more keeps the parent's scaler
+FOREST_REBASE_ATOL = 0.0
+
+
+def forest_jobs() -> int:
+    """
+    Cores for the forest: TRAINING_FOREST_JOBS, or when <= 0 whatever is
+    left after the MLP's torch threads and the logistic regression.
+    """
+    if settings.TRAINING_FOREST_JOBS > 0:
+        return settings.TRAINING_FOREST_JOBS
+    return max(1, (os.cpu_count() or 1) - settings.TRAINING_TORCH_THREADS - 1)
+
+
+# Each member is fitted by a module-level function so it can run in a pool
+# process; they return (fitted model, seconds) and depend only on their
+# arguments and RANDOM_STATE, which makes parallel and sequential training
+# produce identical models.
+def fit_logreg(X: np.ndarray, y: np.ndarray):
+    from sklearn.linear_model import LogisticRegression
+
+    t0 = time.perf_counter()
+    logreg = LogisticRegression(
+        random_state=RANDOM_STATE, max_iter=1000, class_weight="balanced"
+    )
+    logreg.fit(X, y)
+    return logreg, time.perf_counter() - t0
+
+
+def fit_forest(X: np.ndarray, y: np.ndarray, n_jobs: int):
+    from sklearn.ensemble import RandomForestClassifier
+
+    t0 = time.perf_counter()
+    # trees are seeded from random_state up front, so n_jobs doesn't change the result
+    tree = RandomForestClassifier(
+        n_estimators=200,
+        max_depth=6,
+        min_samples_leaf=5,
+        random_state=RANDOM_STATE,
+        class_weight="balanced",
+        n_jobs=n_jobs,
+    )
+    tree.fit(X, y)
+    tree.n_jobs = None  # don't carry the training box's core count into serving
+    return tree, time.perf_counter() - t0
+
+
+def mlp_options() -> dict:
+    """MLP training settings, resolved in the API/training process and passed
+    to fit_mlp so a pool worker trains with exactly the same values.
+
+    MLP_TRAINING="full_batch" (the default) is the original loop: every
+    training row in one batch for FULL_BATCH_EPOCHS epochs, no hold-out.
+    "mini_batch" uses the MLP_* settings; on large sets it is much faster
+    and bounded in memory, at a slightly different AUC."""
+    if settings.MLP_TRAINING != "mini_batch":
+        return {
+            "batch_size": 0,
+            "max_epochs": FULL_BATCH_EPOCHS,
+            "epoch_rows": 0,
+            "patience": 0,
+            "validation_fraction": 0.0,
+            "learning_rate": settings.MLP_LEARNING_RATE,
+        }
+    return {
+        "batch_size": settings.MLP_BATCH_SIZE,
+        "max_epochs": settings.MLP_MAX_EPOCHS,
+        "epoch_rows": settings.MLP_EPOCH_ROWS,
+        "patience": settings.MLP_PATIENCE,
+        "validation_fraction": settings.MLP_VALIDATION_FRACTION,
+        "learning_rate": settings.MLP_LEARNING_RATE,
+    }
+
+
+def mlp_logits(nn_model, X: np.ndarray, batch_rows: int = MLP_EVAL_BATCH_ROWS) -> np.ndarray:
+    """Forward pass in fixed-size chunks, so activations stay bounded on large sets."""
+    import torch
+
+    out = np.empty(len(X), dtype=np.float32)
+    nn_model.eval()
+    with torch.no_grad():
+        for start in range(0, len(X), batch_rows):
+            chunk = torch.from_numpy(np.ascontiguousarray(X[start : start + batch_rows], dtype=np.float32))
+            out[start : start + batch_rows] = nn_model(chunk).numpy().ravel()
+    return out
+
+
+def fit_mlp(
+    X: np.ndarray,
+    y: np.ndarray,
+    torch_threads: int,
+    options: Optional[dict] = None,
+    progress: Optional[Callable] = None,
+    init_state: Optional[dict] = None,
+):
+    """
+    Train the MLP with Adam as set by ``options`` (see mlp_options).
+    ``batch_size <= 0`` trains full-batch; otherwise mini-batches are drawn
+    from a seeded shuffle of the rows. With ``patience`` > 0,
+    ``validation_fraction`` of the rows are held out for early stopping:
+    training stops once the validation loss hasn't improved for
+    ``patience`` epochs and the best weights are kept.
+
+    An epoch covers at most ``epoch_rows`` rows (continuing through the
+    shuffled order across epochs), so on very large sets the cost per epoch,
+    and with ``max_epochs`` the total, stays bounded. ``init_state``
+    continues training from existing weights instead of a fresh init.
+
+    Returns the trained weights as a {name: ndarray} state dict.
+    """
+    import torch
+    import torch.nn as nn
+
+    from app.ml.torch_mlp import MLP
+
+    opts = options or mlp_options()
+    t0 = time.perf_counter()
+    # a fixed thread count keeps float reductions, and so the weights, reproducible
+    torch.set_num_threads(max(1, torch_threads))
+    torch.manual_seed(RANDOM_STATE)
+    rng = np.random.default_rng(RANDOM_STATE)
+
+    # one float32 copy of the features; batches are gathered from it by index
+    X32 = np.ascontiguousarray(X, dtype=np.float32)
+    y32 = np.asarray(y, dtype=np.float32)
+
+    order = rng.permutation(len(X32))
+    n_val = 0
+    if opts["patience"] > 0:
+        n_val = min(int(len(X32) * opts["validation_fraction"]), MLP_MAX_VALIDATION_ROWS)
+    val_idx, train_idx = np.sort(order[:n_val]), order[n_val:]
+    X_val, y_val = X32[val_idx], y32[val_idx]
+
+    batch_size = max(1, len(train_idx))
+    if opts["batch_size"] > 0:
+        # small sets still get enough optimizer steps per epoch to converge
+        batch_size = max(1, min(opts["batch_size"], len(train_idx) // MLP_MIN_BATCHES_PER_EPOCH))
+    nn_model = MLP(X32.shape[1])
+    if init_state is not None:
+        nn_model.load_state_dict({k: torch.as_tensor(v) for k, v in init_state.items()})
+    criterion = nn.BCEWithLogitsLoss()
+    optimizer = torch.optim.Adam(nn_model.parameters(), lr=opts["learning_rate"])
+
+    epoch_rows = len(train_idx)
+    if opts["epoch_rows"] > 0:
+        epoch_rows = min(epoch_rows, opts["epoch_rows"])
+
+    best_loss, best_state, stale = np.inf, None, 0
+    max_epochs = opts["max_epochs"]
+    cursor = len(train_idx)  # forces a shuffle before the first epoch
+    for epoch in range(max_epochs):
+        if cursor + epoch_rows > len(train_idx):
+            rng.shuffle(train_idx)
+            cursor = 0
+        epoch_idx = train_idx[cursor : cursor + epoch_rows]
+        cursor += epoch_rows
+
+        nn_model.train()
+        for start in range(0, epoch_rows, batch_size):
+            idx = np.sort(epoch_idx[start : start + batch_size])
+            xb = torch.from_numpy(X32[idx])
+            yb = torch.from_numpy(y32[idx]).unsqueeze(1)
+            optimizer.zero_grad()
+            loss = criterion(nn_model(xb), yb)
+            loss.backward()
+            optimizer.step()
+
+        if progress is not None:
+            progress((epoch + 1) / max_epochs)
+        if n_val == 0:
+            continue
+
+        val_loss = float(
+            criterion(torch.from_numpy(mlp_logits(nn_model, X_val)), torch.from_numpy(y_val))
+        )
+        if val_loss < best_loss - MLP_MIN_DELTA:
+            best_loss, stale = val_loss, 0
+            best_state = {k: v.detach().clone() for k, v in nn_model.state_dict().items()}
+        else:
+            stale += 1
+            if stale >= opts["patience"]:
+                break
+
+    if best_state is not None:
+        nn_model.load_state_dict(best_state)
+    state = {k: v.detach().cpu().numpy() for k, v in nn_model.state_dict().items()}
+    return state, time.perf_counter() - t0
+
+
+# ---------------------------------------------------------------------------
+# Incremental retraining: continue the parent version's members
+# ---------------------------------------------------------------------------
+def _scaler_affine(old_scaler, new_scaler) -> tuple[np.ndarray, np.ndarray]:
+    """(a, c) such that old_scaler's output equals a * new_scaler's output + c
+    for the same raw row."""
+    a = new_scaler.scale_ / old_scaler.scale_
+    c = (new_scaler.mean_ - old_scaler.mean_) / old_scaler.scale_
+    return a, c
+
+
+# Refitting the scaler changes every member's input space. The rebase_*
+# functions rewrite the parent's members so that, fed rows scaled by the
+# new scaler, they compute what they did before; warm-started training
+# then continues from the parent's behaviour rather than a shifted version
+# of it. The forest can only be rebased up to float32 rounding of inputs
+# right at a split threshold, so incremental_scaler checks it and keeps
+# the parent's scaler when the rebase isn't exact.
+def rebase_logreg(logreg, old_scaler, new_scaler):
+    a, c = _scaler_affine(old_scaler, new_scaler)
+    logreg.intercept_ = logreg.intercept_ + logreg.coef_ @ c
+    logreg.coef_ = logreg.coef_ * a
+    return logreg
+
+
+def _float32_images(threshold, a, c):
+    """Thresholds between the new-scaler float32 images of the old float32
+    inputs either side of each split (x_old <= t  <=>  x_new <= (t - c) / a)."""
+    lo = threshold.astype(np.float32)
+    lo = np.where(lo > threshold, np.nextafter(lo, np.float32(-np.inf)), lo)
+    hi = np.nextafter(lo, np.float32(np.inf))
+    with np.errstate(over="ignore", invalid="ignore"):
+        new_lo = ((lo - c) / a).astype(np.float32).astype(np.float64)
+        new_hi = ((hi - c) / a).astype(np.float32).astype(np.float64)
+    return np.where(new_lo < new_hi, (new_lo + new_hi) / 2, (threshold - c) / a)
+
+
+def rebase_forest(forest, old_scaler, new_scaler, X_raw: Optional[np.ndarray] = None):
+    """
+    Trees compare float32 inputs, and rows whose value ties a threshold sit
+    within float32 rounding of it, so a plain (t - c) / a moves some of
+    them across. With the raw rows ``X_raw``, each rebased threshold is
+    clamped between the new-scaler float32 values of the nearest raw
+    values on either side, which keeps every one of those rows on its
+    side; other thresholds go between the float32 images of the inputs
+    either side of them.
+    """
+    a, c = _scaler_affine(old_scaler, new_scaler)
+    # per feature: sorted distinct raw values as float32 inputs under each scaler
+    grids = {}
+    if X_raw is not None and len(X_raw):
+        for f in range(X_raw.shape[1]):
+            u = np.unique(np.asarray(X_raw[:, f], dtype=np.float64))
+            u = u[np.isfinite(u)]
+            old32 = ((u - old_scaler.mean_[f]) / old_scaler.scale_[f]).astype(np.float32)
+            new32 = ((u - new_scaler.mean_[f]) / new_scaler.scale_[f]).astype(np.float32)
+            grids[f] = (old32, new32.astype(np.float64))
+
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        split = np.nonzero(tree.feature >= 0)[0]  # leaves have feature == -2
+        features = tree.feature[split]
+        rebased = _float32_images(tree.threshold[split], a[features], c[features])
+        for f, (old32, new32) in grids.items():
+            on_f = np.nonzero(features == f)[0]
+            if not len(on_f) or not len(old32):
+                continue
+            k = np.searchsorted(old32, tree.threshold[split[on_f]], side="right")
+            inside = (k > 0) & (k < len(old32))
+            left, right = new32[np.maximum(k - 1, 0)], new32[np.minimum(k, len(old32) - 1)]
+            ok = inside & (left < right)
+            exact = (tree.threshold[split[on_f]] - c[f]) / a[f]
+            rebased[on_f[ok]] = np.clip(exact[ok], left[ok], np.nextafter(right[ok], -np.inf))
+        tree.threshold[split] = rebased
+    return forest
+
+
+def forest_rebase_error(forest, rebased, X_old: np.ndarray, X_new: np.ndarray) -> float:
+    """Max |p| difference between the parent forest on X_old and its rebased copy on X_new."""
+    if not len(X_old):
+        return 0.0
+    p_old = forest.predict_proba(X_old)[:, 1]
+    p_new = rebased.predict_proba(X_new)[:, 1]
+    return float(np.max(np.abs(p_old - p_new)))
+
+
+def incremental_scaler(parent_forest, old_scaler, new_scaler, X: np.ndarray):
+    """
+    The scaler an incremental version trains with: ``new_scaler`` when the
+    parent forest rebases onto it exactly on the raw rows X, else
+    ``old_scaler`` (kept unchanged, so no member needs rebasing). A refit
+    that moves no mean or scale by more than SCALER_SHIFT_TOL old standard
+    deviations keeps the old scaler too. Returns (scaler, max |p|
+    difference of the rebase, or None when it wasn't tried).
+    """
+    a, c = _scaler_affine(old_scaler, new_scaler)
+    if np.all(np.abs(a - 1) <= SCALER_SHIFT_TOL) and np.all(np.abs(c) <= SCALER_SHIFT_TOL):
+        return old_scaler, None
+    # serving scales float64 features; match that, not the float32 training frame
+    X = np.asarray(X, dtype=np.float64)
+    rebased = rebase_forest(copy.deepcopy(parent_forest), old_scaler, new_scaler, X)
+    error = forest_rebase_error(parent_forest, rebased, old_scaler.transform(X), new_scaler.transform(X))
+    return (new_scaler if error <= FOREST_REBASE_ATOL else old_scaler), error
+
+
+def rebase_mlp_state(state: dict, old_scaler, new_scaler) -> dict:
+    a, c = _scaler_affine(old_scaler, new_scaler)
+    state = dict(state)
+    weight, bias = state[MLP_INPUT_LAYER + ".weight"], state[MLP_INPUT_LAYER + ".bias"]
+    state[MLP_INPUT_LAYER + ".bias"] = (bias + weight @ c).astype(bias.dtype)
+    state[MLP_INPUT_LAYER + ".weight"] = (weight * a).astype(weight.dtype)
+    return state
+
+
+def warm_start_logreg(logreg, X: np.ndarray, y: np.ndarray):
+    """Continue the solver from logreg's current coefficients."""
+    t0 = time.perf_counter()
+    logreg.set_params(warm_start=True)
+    logreg.fit(X, y)
+    logreg.set_params(warm_start=False)
+    return logreg, time.perf_counter() - t0
+
+
+def grow_forest(forest, X: np.ndarray, y: np.ndarray, n_trees: int, n_jobs: int):
+    """Add n_trees trees fitted on (X, y), keeping the existing ones."""
+    t0 = time.perf_counter()
+    if n_trees > 0:
+        forest.set_params(warm_start=True, n_estimators=len(forest.estimators_) + n_trees, n_jobs=n_jobs)
+        with warnings.catch_warnings():
+            # "balanced" weights are recomputed from (X, y) for the new trees only,
+            # which is the intent here
+            warnings.filterwarnings("ignore", message=".*class_weight.*warm_start.*")
+            forest.fit(X, y)
+        forest.set_params(warm_start=False, n_jobs=None)
+    return forest, time.perf_counter() - t0
+
+
+def continue_members(
+    parent: tuple,
+    old_scaler,
+    new_scaler,
+    X: np.ndarray,
+    y: np.ndarray,
+    add_trees: int,
+    progress: Callable[[float], None],
+    X_raw: Optional[np.ndarray] = None,
+) -> tuple[object, object, dict, dict]:
+    """
+    Warm-start the parent's (logreg, forest, mlp_state_dict) on the
+    new-scaler training set: logreg from its coefficients, the MLP from its
+    weights for up to INCREMENTAL_MLP_MAX_EPOCHS, and the forest gains
+    ``add_trees`` trees (0 keeps it as is). ``X_raw`` (the unscaled rows)
+    lets rebase_forest keep them on their side of every split. Runs
+    in-process; incremental sets are small. Returns (logreg, forest,
+    mlp_state_dict, timings).
+    """
+    logreg, forest, state = parent
+    if new_scaler is not old_scaler:
+        logreg = rebase_logreg(logreg, old_scaler, new_scaler)
+        forest = rebase_forest(forest, old_scaler, new_scaler, X_raw)
+        state = rebase_mlp_state(state, old_scaler, new_scaler)
+
+    opts = mlp_options()
+    opts["max_epochs"] = settings.INCREMENTAL_MLP_MAX_EPOCHS
+    timings = {}
+    progress(0.0)
+    logreg, timings["logreg"] = warm_start_logreg(logreg, X, y)
+    progress(0.05)
+    forest, timings["forest"] = grow_forest(forest, X, y, add_trees, forest_jobs())
+    progress(0.4)
+    state, timings["mlp"] = fit_mlp(
+        X, y, settings.TRAINING_TORCH_THREADS, opts, lambda f: progress(0.4 + 0.6 * f), init_state=state
+    )
+    return logreg, forest, state, timings
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # kept for the life of the training process so later jobs skip
+            # the worker start-up and sklearn/torch imports
+            _pool = ProcessPoolExecutor(max_workers=3, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def train_members(
+    X: np.ndarray,
+    y: np.ndarray,
+    parallel: bool,
+    progress: Callable[[float], None],
+) -> tuple[object, object, dict, dict]:
+    """
+    Fit the logistic regression, forest and MLP on the scaled training set,
+    concurrently in a process pool when ``parallel``. Returns
+    (logreg, forest, mlp_state_dict, timings).
+    """
+    n_jobs = forest_jobs()
+    torch_threads = settings.TRAINING_TORCH_THREADS
+    mlp_opts = mlp_options()
+    timings = {}
+
+    if not parallel:
+        progress(0.0)
+        logreg, timings["logreg"] = fit_logreg(X, y)
+        progress(0.05)
+        tree, timings["forest"] = fit_forest(X, y, n_jobs)
+        progress(0.4)
+        state, timings["mlp"] = fit_mlp(X, y, torch_threads, mlp_opts, lambda f: progress(0.4 + 0.6 * f))
+        # pool results arrive unpickled, which drops in-process object sharing
+        # and changes how they re-pickle; do the same here so both modes save
+        # byte-identical artifacts
+        logreg = pickle.loads(pickle.dumps(logreg))
+        tree = pickle.loads(pickle.dumps(tree))
+        return logreg, tree, state, timings
+
+    pool = _get_pool()
+    futures: dict[Future, str] = {
+        pool.submit(fit_forest, X, y, n_jobs): "forest",
+        pool.submit(fit_mlp, X, y, torch_threads, mlp_opts): "mlp",
+        pool.submit(fit_logreg, X, y): "logreg",
+    }
+    results = {}
+    progress(0.0)
+    try:
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            results[name], timings[name] = future.result()
+            progress(done / len(futures))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return results["logreg"], results["forest"], results["mlp"], timings
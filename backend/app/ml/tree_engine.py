@@ -0,0 +1,184 @@
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger("early_risk_app")
+
+# sklearn trees compare float32 inputs against float64 thresholds
+TREE_INPUT_DTYPE = np.float32
+
+ROW_BLOCK = 1024
+
+
+class CompiledForest:
+    """
+    A fitted binary RandomForestClassifier flattened into contiguous arrays.
+
+    All trees share one node table: split feature, threshold, first child and
+    the positive-class leaf probability. Nodes are renumbered so that every
+    right child sits right after its left sibling, which makes one traversal
+    step ``node = first_child[node] + (x[feature[node]] > threshold[node])``.
+    A NaN feature value goes right where ``missing_right`` is set, following
+    sklearn's per-node missing_go_to_left.
+    Leaves point to themselves with an +inf threshold, so all rows walk
+    exactly ``max_depth`` steps through all trees at once with plain NumPy
+    indexing, with no per-tree Python loop and no joblib dispatch.
+
+    Probabilities are summed over trees in estimator order and divided by
+    the tree count, the same arithmetic RandomForestClassifier.predict_proba
+    uses, so results are bit-for-bit identical.
+    """
+
+    def __init__(self, feature, threshold, first_child, leaf_proba, roots, max_depth, n_features, missing_right=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.first_child = first_child
+        self.missing_right = missing_right if missing_right is not None else np.zeros(len(feature), dtype=bool)
+        self.leaf_proba = leaf_proba
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features = n_features
+        self.n_trees = len(roots)
+
+    @classmethod
+    def from_sklearn(cls, forest) -> "CompiledForest":
+        if len(forest.classes_) != 2:
+            raise ValueError("CompiledForest supports binary classifiers only")
+
+        features, thresholds, first_children, leaf_proba, roots, missing_right = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for est in forest.estimators_:
+            tree = est.tree_
+            left, right = tree.children_left, tree.children_right
+
+            # breadth-first order with siblings adjacent
+            order = [0]
+            for node in order:
+                if left[node] != -1:
+                    order.extend((left[node], right[node]))
+            order = np.asarray(order, dtype=np.intp)
+            new_id = np.empty(tree.node_count, dtype=np.intp)
+            new_id[order] = np.arange(len(order), dtype=np.intp) + offset
+
+            is_leaf = left[order] == -1
+            first_child = np.where(is_leaf, new_id[order], new_id[np.where(is_leaf, 0, left[order])])
+            feat = np.where(is_leaf, 0, tree.feature[order]).astype(np.intp)
+            thr = np.where(is_leaf, np.inf, tree.threshold[order]).astype(np.float64)
+            # sklearn < 1.3 has no missing-value routing (NaN inputs were rejected)
+            go_left = getattr(tree, "missing_go_to_left", np.ones(tree.node_count, dtype=np.uint8))
+            missing_right.append(~is_leaf & (np.asarray(go_left)[order] == 0))
+
+            # same per-leaf normalisation as DecisionTreeClassifier.predict_proba
+            value = tree.value[order, 0, :2].astype(np.float64)
+            normalizer = value.sum(axis=1)
+            normalizer[normalizer == 0.0] = 1.0
+            proba = value[:, 1] / normalizer
+
+            features.append(feat)
+            thresholds.append(thr)
+            first_children.append(first_child)
+            leaf_proba.append(proba)
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += len(order)
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features)),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds)),
+            first_child=np.ascontiguousarray(np.concatenate(first_children)),
+            leaf_proba=np.ascontiguousarray(np.concatenate(leaf_proba)),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=int(max_depth),
+            n_features=int(forest.n_features_in_),
+            missing_right=np.ascontiguousarray(np.concatenate(missing_right)),
+        )
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """Return the (N, n_trees) leaf node index reached by every row in every tree."""
+        X = np.ascontiguousarray(X, dtype=TREE_INPUT_DTYPE)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected input of shape (N, {self.n_features}), got {X.shape}")
+
+        # flat view: X[row, feature] == x_flat[row * n_features + feature]
+        x_flat = X.ravel()
+        row_base = (np.arange(X.shape[0], dtype=np.intp) * self.n_features)[:, None]
+        feature, threshold, first_child = self.feature, self.threshold, self.first_child
+        has_nan = bool(np.isnan(x_flat).any())
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.n_trees))
+        for _ in range(self.max_depth):
+            values = x_flat[row_base + feature[nodes]]
+            go_right = values > threshold[nodes]
+            if has_nan:
+                go_right |= np.isnan(values) & self.missing_right[nodes]
+            nodes = first_child[nodes] + go_right
+        return nodes
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Positive-class probability for each row, shape (N,)."""
+        X = np.asarray(X)
+        out = np.empty(X.shape[0], dtype=np.float64)
+        # row blocks keep the (rows, n_trees) working arrays cache-resident
+        for start in range(0, X.shape[0], ROW_BLOCK):
+            leaf_p = self.leaf_proba[self.apply(X[start : start + ROW_BLOCK])]
+            # cumsum accumulates left to right, matching sklearn's sequential sum
+            out[start : start + ROW_BLOCK] = np.cumsum(leaf_p, axis=1)[:, -1] / self.n_trees
+        return out
+
+
+def parity_probe(forest, n_random: int = 256, seed: int = 0) -> np.ndarray:
+    """
+    Inputs that exercise the forest: random rows, rows that sit exactly on
+    split thresholds, where <= vs < mistakes would show up, and rows with
+    NaN features, which follow each split's missing-value direction.
+    """
+    rng = np.random.default_rng(seed)
+    n_features = int(forest.n_features_in_)
+    random_rows = rng.normal(0.0, 2.0, size=(n_random, n_features))
+
+    trees = [e.tree_ for e in forest.estimators_]
+    thresholds = np.concatenate([t.threshold[t.children_left != -1] for t in trees])
+    split_feats = np.concatenate([t.feature[t.children_left != -1] for t in trees])
+    # missing-value-only splits have an infinite threshold
+    finite = np.isfinite(thresholds)
+    thresholds, split_feats = thresholds[finite], split_feats[finite]
+    pick = rng.choice(len(thresholds), size=min(len(thresholds), n_random), replace=False)
+    edge_rows = rng.normal(0.0, 2.0, size=(len(pick), n_features))
+    edge_rows[np.arange(len(pick)), split_feats[pick]] = thresholds[pick]
+
+    nan_rows = rng.normal(0.0, 2.0, size=(n_random, n_features))
+    nan_rows[rng.random(nan_rows.shape) < 0.2] = np.nan
+
+    return np.vstack([random_rows, edge_rows, nan_rows])
+
+
+def check_parity(forest, compiled: CompiledForest, X: np.ndarray | None = None) -> bool:
+    """True when the compiled engine reproduces forest.predict_proba exactly on X."""
+    if X is None:
+        X = parity_probe(forest)
+    expected = forest.predict_proba(X)[:, 1]
+    return bool(np.array_equal(compiled.predict_proba(X), expected))
+
+
+def compile_forest(forest) -> CompiledForest | None:
+    """
+    Compile a fitted forest and verify it against sklearn. Returns None when
+    the forest can't be compiled or parity fails, so callers fall back to
+    forest.predict_proba.
+    """
+    try:
+        t0 = time.perf_counter()
+        compiled = CompiledForest.from_sklearn(forest)
+        ok = check_parity(forest, compiled)
+    except Exception as e:
+        logger.warning(f"Tree engine compilation failed, using sklearn: {e}")
+        return None
+    if not ok:
+        logger.warning("Compiled tree engine does not match sklearn; using sklearn")
+        return None
+    logger.info(
+        f"Compiled forest: {compiled.n_trees} trees, {len(compiled.feature)} nodes "
+        f"in {(time.perf_counter() - t0) * 1000:.1f} ms"
+    )
+    return compiled
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 
 def customers_col(db):
@@ -41,6 +42,7 @@ def ensure_customer_for_user(db, user):
         "MerchantMixIndex": 0.5,
         "CashWithdrawalPct": 0.0,
         "RecentSpendChangePct": 0.0,
+        "agg": empty_aggregates(),
         "spend_cap": None,
         "category_blocks": [],
         "alerts_enabled": True,
@@ -78,67 +80,360 @@ def add_transaction(
 def get_recent_transactions_for_customer(db, customer_id: str, limit: int = 20):
     return list(
         transactions_col(db)
-        .find({"customer_id": customer_id})
+        .find({"customer_id": customer_id, "pending": {"$ne": True}})
         .sort("timestamp", -1)
         .limit(limit)
     )
 
 
-def update_customer_aggregates_simple(db, customer):
-    """
-    Recompute behavioural aggregates:
-    - UtilisationPct
-    - MerchantMixIndex
-    - CashWithdrawalPct
-    - RecentSpendChangePct
+# ---------------------------------------------------------
+# Running aggregates
+# ---------------------------------------------------------
+# Customer docs carry running totals of their transactions under "agg", so
+# adding a transaction updates O(1) fields instead of rescanning history:
+#   balance, total_spend, tx_count, cash_spend, distinct_categories,
+#   category_spend.<key>, category_counts.<key>, daily_spend.<YYYYMMDD>,
+#   version
+# ``version`` is bumped by every write to "agg" and guards concurrent
+# updates (optimistic concurrency). daily_spend holds the spend per UTC
+# day for the last SPEND_BUCKET_DAYS days; older days are pruned.
+#
+# A transaction is inserted first with ``pending: True`` and only then
+# added to "agg", whose ``applied_tx`` lists the ids of the last
+# APPLIED_TX_KEEP transactions added, so the add is idempotent and a
+# pending transaction's fate can be told after a crash
+# (recover_pending_transactions). Aggregates, features and listings count
+# a pending transaction only once it is in applied_tx.
+CASH_CATEGORY = "cash"
+# incoming category spellings that mean a cash withdrawal
+CASH_ALIASES = {"atm", "atm_withdrawal", "atm withdrawal", "cash_withdrawal"}
+SPEND_BUCKET_DAYS = 61
+# give up on a customer doc that keeps changing under us
+AGG_UPDATE_RETRIES = 20
+# transaction ids remembered in agg.applied_tx
+APPLIED_TX_KEEP = 50
+
+
+def normalize_category(raw: str | None) -> str:
+    """Lower-cased category, with ATM withdrawals mapped to "cash" and blanks to "other"."""
+    category = (raw or "").strip().lower()
+    if category in CASH_ALIASES:
+        return CASH_CATEGORY
+    return category or "other"
+
+
+def category_key(category: str) -> str:
+    """Category as a field name ("." and a leading "$" are not allowed in keys)."""
+    return category.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def day_key(ts: datetime) -> str:
+    return ts.strftime("%Y%m%d")
+
+
+def _day_start(ts: datetime) -> datetime:
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def bucket_cutoff(now: datetime) -> str:
+    """Oldest day_key kept in agg.daily_spend."""
+    return day_key(now - timedelta(days=SPEND_BUCKET_DAYS - 1))
+
+
+def empty_aggregates() -> dict:
+    return {
+        "balance": 0.0,
+        "total_spend": 0.0,
+        "tx_count": 0,
+        "cash_spend": 0.0,
+        "distinct_categories": 0,
+        "category_spend": {},
+        "category_counts": {},
+        "daily_spend": {},
+        "applied_tx": [],
+        "version": 0,
+    }
+
+
+def counted_transactions(txs, customer) -> list:
+    """The transactions of ``txs`` that the customer's aggregates include."""
+    applied = set((customer.get("agg") or {}).get("applied_tx") or [])
+    return [t for t in txs if not t.get("pending") or str(t["_id"]) in applied]
+
+
+def aggregates_from_transactions(txs, now: datetime | None = None) -> dict:
+    """Full recompute of the running aggregates from transaction docs."""
+    agg = empty_aggregates()
+    cutoff = bucket_cutoff(now or datetime.utcnow())
+    for t in txs:
+        amount = float(t["amount"])
+        key = category_key(t.get("category") or "other")
+        agg["balance"] += amount
+        agg["total_spend"] += amount
+        agg["tx_count"] += 1
+        if t.get("category") == CASH_CATEGORY:
+            agg["cash_spend"] += amount
+        agg["category_spend"][key] = agg["category_spend"].get(key, 0.0) + amount
+        agg["category_counts"][key] = agg["category_counts"].get(key, 0) + 1
+        day = day_key(t["timestamp"])
+        if day >= cutoff:
+            agg["daily_spend"][day] = agg["daily_spend"].get(day, 0.0) + amount
+    agg["distinct_categories"] = len(agg["category_counts"])
+    return agg
+
+
+def derived_features(agg: dict, credit_limit: float) -> dict:
+    """UtilisationPct, MerchantMixIndex and CashWithdrawalPct from the running aggregates."""
+    total_spend = agg["total_spend"]
+    tx_count = agg["tx_count"]
+    return {
+        "UtilisationPct": (total_spend / credit_limit * 100.0) if credit_limit > 0 else 0.0,
+        "MerchantMixIndex": (agg["distinct_categories"] / tx_count) if tx_count else 0.0,
+        "CashWithdrawalPct": (agg["cash_spend"] / total_spend * 100.0) if total_spend > 0 else 0.0,
+    }
+
+
+def _spend_change_pct(spend_last: float, spend_prev: float) -> float:
+    if spend_prev > 0:
+        return ((spend_last - spend_prev) / spend_prev) * 100.0
+    return 0.0
+
+
+def recent_spend_change_pct(db, customer, now: datetime | None = None) -> float:
     """
-    customers = customers_col(db)
-    transactions = transactions_col(db)
+    Spend over the last 30 days (last_30 <= t <= now) vs the 30 days before
+    (prev_60 <= t < last_30), in percent.
 
-    cust_id = str(customer["_id"])
-    credit_limit = float(customer.get("CreditLimit", 1.0))
+    Whole days inside either window are summed from agg.daily_spend. The
+    three days a window edge falls in (those of prev_60, last_30 and now)
+    are read from transactions and split at the exact timestamp, so the
+    cost doesn't depend on history size and the result matches a full scan.
+    """
+    now = now or datetime.utcnow()
+    last_30 = now - timedelta(days=30)
+    prev_60 = now - timedelta(days=60)
+    edge_days = [_day_start(prev_60), _day_start(last_30), _day_start(now)]
+    d_prev, d_last, d_now = (day_key(d) for d in edge_days)
+
+    spend_last = spend_prev = 0.0
+    for day, amount in ((customer.get("agg") or {}).get("daily_spend") or {}).items():
+        if d_prev < day < d_last:
+            spend_prev += amount
+        elif d_last < day < d_now:
+            spend_last += amount
+
+    edges = transactions_col(db).find(
+        {
+            "customer_id": str(customer["_id"]),
+            "$or": [{"timestamp": {"$gte": d, "$lt": d + timedelta(days=1)}} for d in edge_days],
+        },
+        {"amount": 1, "timestamp": 1, "pending": 1},
+    )
+    for t in counted_transactions(edges, customer):
+        ts = t["timestamp"]
+        if last_30 <= ts <= now:
+            spend_last += float(t["amount"])
+        elif prev_60 <= ts < last_30:
+            spend_prev += float(t["amount"])
 
-    txs = list(transactions.find({"customer_id": cust_id}))
-    total_spend = sum(float(t["amount"]) for t in txs) or 0.0
-    utilisation_pct = (total_spend / credit_limit * 100.0) if credit_limit > 0 else 0.0
+    return _spend_change_pct(spend_last, spend_prev)
 
-    # MerchantMixIndex: distinct categories / total tx
-    categories = {t.get("category") for t in txs}
-    merchant_mix_index = (len(categories) / len(txs)) if txs else 0.0
 
-    # CashWithdrawalPct: share of spend where category == "cash"
-    cash_spend = sum(float(t["amount"]) for t in txs if t.get("category") == "cash")
-    cash_withdrawal_pct = (cash_spend / total_spend * 100.0) if total_spend > 0 else 0.0
+def rebuild_customer_aggregates(db, customer, expected_version: int | None = None, txs: list | None = None):
+    """
+    Recompute "agg" and every derived feature from the customer's full
+    transaction history and store them. With ``expected_version`` the write
+    only happens if "agg" wasn't changed meanwhile; returns the updated
+    customer, or None when that guard failed. ``txs`` is the history when
+    the caller already read it (amount, category and timestamp suffice).
+    """
+    cust_id = str(customer["_id"])
+    credit_limit = float(customer.get("CreditLimit", 1.0))
 
-    # RecentSpendChangePct: last 30d vs previous 30d
     now = datetime.utcnow()
     last_30 = now - timedelta(days=30)
     prev_60 = now - timedelta(days=60)
+    if txs is None:
+        txs = list(transactions_col(db).find({"customer_id": cust_id}))
+    txs = counted_transactions(txs, customer)
+    agg = aggregates_from_transactions(txs, now=now)
+    current = (customer.get("agg") or {}).get("version", 0)
+    agg["version"] = current + 1
+    agg["applied_tx"] = list((customer.get("agg") or {}).get("applied_tx") or [])
 
-    spend_last = sum(
-        float(t["amount"]) for t in txs if last_30 <= t["timestamp"] <= now
-    )
-    spend_prev = sum(
-        float(t["amount"]) for t in txs if prev_60 <= t["timestamp"] < last_30
-    )
-
-    if spend_prev > 0:
-        recent_change_pct = ((spend_last - spend_prev) / spend_prev) * 100.0
-    else:
-        recent_change_pct = 0.0
+    spend_last = sum(float(t["amount"]) for t in txs if last_30 <= t["timestamp"] <= now)
+    spend_prev = sum(float(t["amount"]) for t in txs if prev_60 <= t["timestamp"] < last_30)
 
     update = {
-        "UtilisationPct": utilisation_pct,
-        "MerchantMixIndex": merchant_mix_index,
-        "CashWithdrawalPct": cash_withdrawal_pct,
-        "RecentSpendChangePct": recent_change_pct,
-        "updated_at": datetime.utcnow(),
+        "agg": agg,
+        **derived_features(agg, credit_limit),
+        "RecentSpendChangePct": _spend_change_pct(spend_last, spend_prev),
+        "updated_at": now,
     }
-    customers.update_one({"_id": customer["_id"]}, {"$set": update})
+    query = {"_id": customer["_id"]}
+    if expected_version is not None:
+        query["agg.version"] = expected_version
+    res = customers_col(db).update_one(query, {"$set": update})
+    if expected_version is not None and res.matched_count == 0:
+        return None
     customer.update(update)
     return customer
 
 
+def rebuild_customer_aggregates_retrying(db, customer_id):
+    """
+    Recompute one customer's aggregates from its full history, conditioned
+    on the "agg" version so a concurrent single transaction isn't lost.
+    """
+    customers = customers_col(db)
+    for _ in range(AGG_UPDATE_RETRIES):
+        customer = customers.find_one({"_id": ObjectId(customer_id)})
+        if customer is None:
+            return None
+        version = (customer.get("agg") or {}).get("version")
+        rebuilt = rebuild_customer_aggregates(db, customer, expected_version=version)
+        if rebuilt is not None:
+            return rebuilt
+    raise RuntimeError(f"Customer {customer_id} aggregates kept changing; giving up")
+
+
+def settle_pending_transaction(db, tx: dict) -> str | None:
+    """
+    Settle one transaction left "pending". If its customer's agg.applied_tx
+    lists it, it was counted and is kept ("committed"). Otherwise it was
+    never acknowledged: it is deleted and the customer's aggregates are
+    rebuilt from history ("removed"). Returns None if another settler got
+    there first.
+    """
+    txs = transactions_col(db)
+    applied = customers_col(db).find_one(
+        {"_id": ObjectId(tx["customer_id"]), "agg.applied_tx": str(tx["_id"])}, {"_id": 1}
+    )
+    if applied is not None:
+        txs.update_one({"_id": tx["_id"]}, {"$unset": {"pending": ""}})
+        return "committed"
+    if txs.delete_one({"_id": tx["_id"], "pending": True}).deleted_count:
+        rebuild_customer_aggregates_retrying(db, tx["customer_id"])
+        return "removed"
+    return None
+
+
+def recover_pending_transactions(db, older_than: timedelta) -> dict:
+    """
+    Settle transactions left "pending" for longer than ``older_than`` by a
+    request that died between inserting them and clearing the marker (see
+    settle_pending_transaction). Returns {"committed": n, "removed": n}.
+    """
+    report = {"committed": 0, "removed": 0}
+    stale = {"pending": True, "timestamp": {"$lt": datetime.utcnow() - older_than}}
+    for t in transactions_col(db).find(stale, {"customer_id": 1}):
+        outcome = settle_pending_transaction(db, t)
+        if outcome is not None:
+            report[outcome] += 1
+    return report
+
+
+def ensure_customer_aggregates(db, customer):
+    """Customers created before running aggregates existed get them built once."""
+    if customer is not None and "daily_spend" not in (customer.get("agg") or {}):
+        rebuild_customer_aggregates(db, customer)
+    return customer
+
+
+def apply_transaction_aggregates(
+    db,
+    customer,
+    amount: float,
+    category: str,
+    timestamp: datetime,
+    extra: dict | None = None,
+    tx_id=None,
+):
+    """
+    Add one transaction to the customer's running aggregates and derived
+    features in a single atomic write, unless it would take the balance
+    over the credit limit. The same write adds it to its day's spend
+    bucket and prunes buckets past SPEND_BUCKET_DAYS.
+
+    The write is conditioned on the "agg" version and CreditLimit read
+    here, so the credit check and the derived values are exact even with
+    concurrent transactions (a lost race re-reads and retries).
+
+    ``extra`` fields are $set by the same write. With ``tx_id`` (the
+    inserted transaction's _id) the write also records it in
+    agg.applied_tx, and a transaction already recorded there isn't added
+    again.
+
+    Returns (applied, customer): the updated doc when applied, otherwise
+    the current doc the limit check failed against.
+    """
+    customers = customers_col(db)
+    key = category_key(category)
+
+    for _ in range(AGG_UPDATE_RETRIES):
+        customer = ensure_customer_aggregates(db, customer)
+        agg = customer["agg"]
+        if tx_id is not None and str(tx_id) in (agg.get("applied_tx") or []):
+            return True, customer
+        credit_limit = float(customer.get("CreditLimit", 1.0))
+        if agg["balance"] + amount > credit_limit:
+            return False, customer
+
+        new_category = key not in agg["category_counts"]
+        inc = {
+            "agg.balance": amount,
+            "agg.total_spend": amount,
+            "agg.tx_count": 1,
+            "agg.cash_spend": amount if category == CASH_CATEGORY else 0.0,
+            "agg.distinct_categories": 1 if new_category else 0,
+            f"agg.category_spend.{key}": amount,
+            f"agg.category_counts.{key}": 1,
+            "agg.version": 1,
+        }
+        cutoff = bucket_cutoff(datetime.utcnow())
+        if day_key(timestamp) >= cutoff:
+            inc[f"agg.daily_spend.{day_key(timestamp)}"] = amount
+        expired = {f"agg.daily_spend.{day}": "" for day in agg["daily_spend"] if day < cutoff}
+        after = {
+            "total_spend": agg["total_spend"] + amount,
+            "tx_count": agg["tx_count"] + 1,
+            "cash_spend": agg["cash_spend"] + inc["agg.cash_spend"],
+            "distinct_categories": agg["distinct_categories"] + inc["agg.distinct_categories"],
+        }
+        update = {
+            "$inc": inc,
+            "$set": {**derived_features(after, credit_limit), **(extra or {}), "updated_at": datetime.utcnow()},
+            **({"$unset": expired} if expired else {}),
+        }
+        if tx_id is not None:
+            update["$push"] = {"agg.applied_tx": {"$each": [str(tx_id)], "$slice": -APPLIED_TX_KEEP}}
+        updated = customers.find_one_and_update(
+            {
+                "_id": customer["_id"],
+                "agg.version": agg["version"],
+                "CreditLimit": customer.get("CreditLimit"),
+            },
+            update,
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is not None:
+            return True, updated
+        customer = customers.find_one({"_id": customer["_id"]})
+
+    raise RuntimeError(f"Customer {customer['_id']} aggregates kept changing; giving up")
+
+
+def update_customer_aggregates_simple(db, customer):
+    """
+    Recompute behavioural aggregates from the full transaction history:
+    - UtilisationPct
+    - MerchantMixIndex
+    - CashWithdrawalPct
+    - RecentSpendChangePct
+    """
+    return rebuild_customer_aggregates(db, customer)
+
+
 # ---------------------------------------------------------
 # Admin helpers for portfolio views
 # ---------------------------------------------------------
@@ -232,7 +527,7 @@ def get_transactions_for_customer_id(db, customer_id: str, limit: int = 20):
     cust_id_str = str(cust["_id"])
     return list(
         transactions_col(db)
-        .find({"customer_id": cust_id_str})
+        .find({"customer_id": cust_id_str, "pending": {"$ne": True}})
         .sort("timestamp", -1)
         .limit(limit)
     )
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from bson import ObjectId
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, UploadFile, File
 
 from ..core.deps import get_current_admin
 from ..core.db import get_db
@@ -17,6 +17,23 @@ from ..models.customer import (
 )
 from ..core.serialization import to_str_id, to_str_id_list
 from app.services.ml_service import score_customer
+from app.services.rescoring_service import (
+    start_rescore_job,
+    resume_rescore_job,
+    get_rescore_job,
+    list_rescore_jobs,
+    rescore_progress,
+)
+from app.services.rule_scan_service import scan_rules
+from app.services.aggregate_reconcile_service import reconcile_customer_aggregates
+from app.services.transaction_ingest_service import (
+    get_ingest_job,
+    ingest_progress,
+    list_ingest_jobs,
+    start_ingest_job,
+)
+from app.services.upload_service import spool_upload
+from app.ml.rule_engine import RULES
 
 # ⭐ WhatsApp alert dependencies
 from app.services.whatsapp_service import send_flagged_risk_message
@@ -141,6 +158,62 @@ def admin_update_features(
     }
 
 
+# -----------------------------------------------------------
+# PORTFOLIO RESCORING (after activating a new model version)
+# -----------------------------------------------------------
+def _rescore_job_view(job: dict) -> dict:
+    view = to_str_id(job)
+    view["last_id"] = str(job["last_id"]) if job.get("last_id") else None
+    view["progress"] = rescore_progress(job)
+    return view
+
+
+@router.post("/rescore")
+def start_portfolio_rescore(
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    """
+    Rescore every app-user customer with this admin's active model in the background.
+    """
+    job = start_rescore_job(db, current_admin["username"])
+    return _rescore_job_view(job)
+
+
+@router.get("/rescore")
+def list_portfolio_rescores(
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    jobs = list_rescore_jobs(db, current_admin["username"])
+    return {"jobs": [_rescore_job_view(j) for j in jobs]}
+
+
+@router.get("/rescore/{job_id}")
+def portfolio_rescore_status(
+    job_id: str,
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    job = get_rescore_job(db, current_admin["username"], job_id)
+    if not job:
+        raise HTTPException(404, "Rescore job not found")
+    return _rescore_job_view(job)
+
+
+@router.post("/rescore/{job_id}/resume")
+def resume_portfolio_rescore(
+    job_id: str,
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    """
+    Restart an interrupted or failed rescoring job from its last checkpoint.
+    """
+    job = resume_rescore_job(db, current_admin["username"], job_id)
+    return _rescore_job_view(job)
+
+
 # -----------------------------------------------------------
 # CUSTOMER TRANSACTIONS
 # -----------------------------------------------------------
@@ -243,3 +316,112 @@ def admin_send_manual_alert(
     )
 
     return {"status": "ok", "sent_to": phone}
+
+
+# -----------------------------------------------------------
+# RULE ENGINE — PORTFOLIO SCAN
+# -----------------------------------------------------------
+@router.get("/rules")
+def list_rules(current_admin=Depends(get_current_admin)):
+    return [
+        {
+            "rule_name": r.name,
+            "feature": r.feature,
+            "op": r.op,
+            "threshold": r.threshold,
+            "suggested_outreach": r.outreach,
+        }
+        for r in RULES
+    ]
+
+
+@router.get("/rules/scan")
+def scan_portfolio_rules(
+    rule: list[str] | None = Query(None),
+    match: str = Query("any", enum=["any", "all"]),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    refresh: bool = False,
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    """
+    Customers triggering the given rules (e.g. ?rule=High cash withdrawal),
+    evaluated over a cached snapshot of the whole portfolio.
+    """
+    return scan_rules(db, rule, match=match, limit=limit, offset=offset, refresh=refresh)
+
+
+# -----------------------------------------------------------
+# RUNNING AGGREGATES — RECONCILIATION
+# -----------------------------------------------------------
+@router.post("/aggregates/reconcile")
+def reconcile_aggregates(
+    fix: bool = False,
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    """
+    Check every customer's running transaction aggregates against a full
+    recompute from the transactions collection; ?fix=true rebuilds the
+    mismatching ones. Also available as scripts/reconcile_aggregates.py.
+    """
+    return reconcile_customer_aggregates(db, fix=fix)
+
+
+# -----------------------------------------------------------
+# BULK TRANSACTION INGESTION
+# -----------------------------------------------------------
+def _ingest_job_view(job: dict) -> dict:
+    view = to_str_id(job)
+    view.pop("path", None)
+    view["progress"] = ingest_progress(job)
+    return view
+
+
+@router.post("/transactions/ingest")
+def ingest_transactions(
+    file: UploadFile = File(...),
+    rescore: bool = True,
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    """
+    Bulk-load a CSV or NDJSON file of transactions in the background:
+    recompute each affected customer's aggregates once and (unless
+    ?rescore=false) rescore them with this admin's active model. Returns
+    the job; poll GET /transactions/ingest/{job_id} for progress and the
+    final report (counts, rejected rows, tx_per_sec). Also available as
+    scripts/ingest_transactions.py.
+    """
+    upload = spool_upload(file, prefix="ingest_")
+    try:
+        job = start_ingest_job(
+            db, upload.path, current_admin["username"], rescore=rescore,
+            filename=upload.filename, delete_file=True,
+        )
+    except BaseException:
+        upload.path.unlink(missing_ok=True)
+        raise
+    return _ingest_job_view(job)
+
+
+@router.get("/transactions/ingest")
+def list_transaction_ingests(
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    jobs = list_ingest_jobs(db, current_admin["username"])
+    return {"jobs": [_ingest_job_view(j) for j in jobs]}
+
+
+@router.get("/transactions/ingest/{job_id}")
+def transaction_ingest_status(
+    job_id: str,
+    current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
+):
+    job = get_ingest_job(db, current_admin["username"], job_id)
+    if not job:
+        raise HTTPException(404, "Ingest job not found")
+    return _ingest_job_view(job)
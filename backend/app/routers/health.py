@@ -0,0 +1,33 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services.warmup_service import readiness
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+
+@router.get("/live")
+def live():
+    """
+    Process is up and serving HTTP.
+    """
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def ready():
+    """
+    503 until the startup warm-up (DB connection, indexes, active models,
+    warm-up inference) has finished; point load balancer readiness checks here.
+    Warm-up steps that failed are listed in "errors" (phase "degraded").
+    """
+    state = readiness()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=jsonable(state))
+
+
+def jsonable(state: dict) -> dict:
+    return {
+        **state,
+        "started_at": state["started_at"].isoformat() if state["started_at"] else None,
+        "finished_at": state["finished_at"].isoformat() if state["finished_at"] else None,
+    }
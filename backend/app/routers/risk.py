@@ -1,47 +1,84 @@
-from pathlib import Path
-import shutil
 import numpy as np
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request
+from fastapi.concurrency import run_in_threadpool
 
+from app.core.config import settings
+from app.core.db import get_db
 from app.core.deps import get_current_admin
-from app.ml.model_registry import list_model_versions, get_active_model_version
-from app.ml.model_loader import predict_probas_for, compute_ensemble
+from app.core.serialization import to_str_id
+from app.ml.active_models import get_active_models
+from app.ml.explainer import UNITS, get_explainer
+from app.ml.model_registry import list_model_versions
+from app.ml.model_loader import (
+    predict_probas_batched,
+    compute_ensemble,
+    model_cache_stats,
+    batcher_stats,
+)
 from app.ml.rule_engine import evaluate_rules
+from app.ml.score_cache import get_score_cache
 from app.schemas.risk import CustomerFeatures, RiskSummary
-from app.services.ml_service import retrain_from_file
+from app.services.ml_service import lab_risk_bands, require_active_model
+from app.services.batch_scoring_service import parse_feature_matrix, score_batch
+from app.services.upload_service import spool_upload
+from app.services.training_job_service import (
+    submit_training_job,
+    get_training_job,
+    list_training_jobs,
+    cancel_training_job,
+)
 
 router = APIRouter(prefix="/risk", tags=["risk"])
 
 
-def _next_version_for(username: str) -> int:
-    """
-    Look at model_versions and return the next version number for this admin.
-    """
-    versions = list_model_versions(username)
-    if not versions:
-        return 1
-    return int(versions[0]["version"]) + 1
+def _training_job_view(job: dict) -> dict:
+    view = to_str_id(job)
+    view.pop("file_path", None)
+    return view
 
 
-@router.post("/retrain")
-async def retrain_model(
+@router.post("/retrain", status_code=202)
+def retrain_model(
     file: UploadFile = File(...),
+    mode: str = Query("full", pattern="^(full|incremental)$"),
+    add_trees: int | None = Query(None, ge=0, le=500),
     current_admin=Depends(get_current_admin),
+    db=Depends(get_db),
 ):
     """
-    Admin-only: upload labelled CSV/XLSX/JSON and retrain models.
+    Admin-only: upload labelled CSV/XLSX/JSON and queue retraining.
+
+    ``mode=incremental`` continues the active version on the uploaded rows
+    plus a replay sample of its earlier training data (e.g. a monthly
+    append) instead of retraining from scratch; ``add_trees`` grows its
+    forest by that many trees.
+
+    Training runs in a separate worker process; poll
+    GET /risk/retrain/jobs/{job_id} for stage, progress and metrics.
     """
-    tmp_path = Path(f"/tmp/{file.filename}")
-    with tmp_path.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
-
-    version = _next_version_for(current_admin["username"])
-    metrics = retrain_from_file(
-        username=current_admin["username"],
-        file_path=tmp_path,
-        version=version,
-    )
-    return {"message": "Model retrained", **metrics}
+    upload = spool_upload(file, prefix="retrain_")
+    job = submit_training_job(db, current_admin["username"], upload, mode=mode, add_trees=add_trees)
+    return _training_job_view(job)
+
+
+@router.get("/retrain/jobs")
+def list_retrain_jobs(current_admin=Depends(get_current_admin), db=Depends(get_db)):
+    jobs = list_training_jobs(db, current_admin["username"])
+    return {"jobs": [_training_job_view(j) for j in jobs]}
+
+
+@router.get("/retrain/jobs/{job_id}")
+def retrain_job_status(job_id: str, current_admin=Depends(get_current_admin), db=Depends(get_db)):
+    return _training_job_view(get_training_job(db, current_admin["username"], job_id))
+
+
+@router.post("/retrain/jobs/{job_id}/cancel")
+def cancel_retrain_job(job_id: str, current_admin=Depends(get_current_admin), db=Depends(get_db)):
+    """
+    Queued jobs are cancelled at once; running jobs stop at their next
+    progress checkpoint and leave no model version behind.
+    """
+    return _training_job_view(cancel_training_job(db, current_admin["username"], job_id))
 
 
 @router.get("/models")
@@ -55,6 +92,21 @@ def get_models(current_admin=Depends(get_current_admin)):
     return versions
 
 
+@router.get("/runtime_stats")
+def runtime_stats(current_admin=Depends(get_current_admin)):
+    """
+    In-process model serving counters: the version served per admin; bundle
+    cache loads / hits / evictions; micro-batching batch sizes, wait times and
+    queue depth; score and explanation cache hit ratios; and how often tree
+    SHAP fell back to the linear attribution.
+    """
+    return {
+        "active_models": get_active_models().stats(),
+        "model_cache": model_cache_stats(),
+        "batcher": batcher_stats(),
+        "score_cache": get_score_cache().stats(),
+        "explainer": get_explainer().stats(),
+    }
 
 
 @router.post("/score_row", response_model=RiskSummary)
@@ -66,11 +118,7 @@ def score_row(
     Score a single synthetic customer behaviour row using the admin's active model.
     Used by the React 'Risk Lab' page.
     """
-    mv = get_active_model_version(current_admin["username"])
-    if not mv:
-        raise HTTPException(status_code=400, detail="No active model")
-
-    version = mv["version"]
+    active = require_active_model(current_admin["username"])
 
     row_np = np.array(
         [[
@@ -85,34 +133,66 @@ def score_row(
         dtype=float,
     )
 
-    p_log, p_tree, p_nn = predict_probas_for(current_admin["username"], version, row_np)
+    p_log, p_tree, p_nn = predict_probas_batched(active.bundle, row_np)
     ensemble = compute_ensemble(p_log, p_tree, p_nn)
     ens = float(ensemble[0])
     prob = float(p_log[0])
-
-    if ens < 0.2:
-        band = "Very Low"
-    elif ens < 0.4:
-        band = "Low"
-    elif ens < 0.6:
-        band = "Medium"
-    elif ens < 0.8:
-        band = "High"
-    else:
-        band = "Critical"
+    band = str(lab_risk_bands(ensemble)[0])
 
     rules = evaluate_rules(features)
 
-    top_features = [
-        {"feature": "UtilisationPct", "value": features.utilisation_pct},
-        {"feature": "CashWithdrawalPct", "value": features.cash_withdrawal_pct},
-        {"feature": "AvgPaymentRatio", "value": features.avg_payment_ratio},
-    ]
+    method, top_features = get_explainer().explain_row(active.bundle, row_np[0])
 
     return RiskSummary(
         ml_probability=prob,
         ensemble_probability=ens,
         risk_band=band,
         top_features=top_features,
+        explanation_method=method,
+        explanation_units=UNITS[method],
         rules=rules,
     )
+
+
+async def _read_body_limited(request: Request, limit: int) -> bytes:
+    """
+    The request body, refused with 413 before reading when Content-Length is
+    over ``limit`` and while streaming when a body without one (chunked)
+    grows past it.
+    """
+    too_large = HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > limit:
+        raise too_large
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@router.post("/score_batch")
+async def score_batch_rows(
+    request: Request,
+    current_admin=Depends(get_current_admin),
+):
+    """
+    Score many customer behaviour rows in one call with the admin's active model.
+
+    Body is a JSON list of CustomerFeatures (or {"rows": [...]}), a CSV with a
+    header row, or an Arrow IPC stream/file. All rows are scored in a single
+    vectorized pass; results come back in input order. Bodies over
+    SCORE_BATCH_MAX_BYTES are rejected with 413 before they are read.
+    """
+    body = await _read_body_limited(request, settings.SCORE_BATCH_MAX_BYTES)
+    content_type = request.headers.get("content-type")
+
+    # parsing, the registry lookup and inference all block; keep them off the event loop
+    def _score():
+        active = require_active_model(current_admin["username"])
+        X = parse_feature_matrix(body, content_type)
+        return score_batch(active.bundle, X)
+
+    return await run_in_threadpool(_score)
@@ -11,6 +11,7 @@ from app.schemas.risk import RiskSummary
 from app.schemas.customer import CreditLimitUpdate
 from app.services.customer_service import handle_add_transaction, get_user_transactions
 from app.services.ml_service import score_customer
+from app.services.post_commit_service import score_status
 from app.core.serialization import to_str_id, to_str_id_list
 from app.models.customer import (
     ensure_customer_for_user,
@@ -33,7 +34,9 @@ def add_transaction(
 ):
     """
     Create a transaction for the logged-in customer and return both
-    the transaction doc and updated customer aggregates + risk.
+    the transaction doc and updated customer aggregates. Risk is
+    re-scored in the background; the customer's score_status stays
+    "pending" until then (see /user/score_status).
     If the transaction would exceed the credit limit, the underlying
     service raises HTTP 400 with LIMIT_EXCEEDED and available_credit.
     """
@@ -44,6 +47,23 @@ def add_transaction(
     }
 
 
+# -----------------------------------------------------------
+# POST-TRANSACTION SCORING STATUS (POLLED AFTER ADDING ONE)
+# -----------------------------------------------------------
+@router.get("/score_status")
+def get_score_status(
+    current_user=Depends(get_current_customer),
+    db=Depends(get_db),
+):
+    """
+    "pending" while the latest transactions are still being re-scored,
+    then "scored" (or "failed"), with the agg version the stored risk
+    band reflects.
+    """
+    customer = ensure_customer_for_user(db, current_user)
+    return score_status(customer)
+
+
 # -----------------------------------------------------------
 # LIST USER TRANSACTIONS
 # -----------------------------------------------------------
@@ -116,10 +136,9 @@ def risk_summary(
         ml_probability=risk["ml_probability"],
         ensemble_probability=risk["ensemble_probability"],
         risk_band=risk["risk_band"],
-        top_features=[
-            {"feature": f["feature"], "value": f["value"]}
-            for f in risk["top_features"]
-        ],
+        top_features=risk["top_features"],
+        explanation_method=risk["explanation_method"],
+        explanation_units=risk["explanation_units"],
         rules=[],
     )
 
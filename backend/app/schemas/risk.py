@@ -20,4 +20,6 @@ class RiskSummary(BaseModel):
     ensemble_probability: float
     risk_band: str
     top_features: List[dict]
+    explanation_method: str | None = None
+    explanation_units: str | None = None  # "log_odds" (linear) or "probability" (tree SHAP)
     rules: List[RuleTrigger] | None = None
@@ -0,0 +1,167 @@
+# app/services/aggregate_reconcile_service.py
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.models.customer import (
+    SPEND_BUCKET_DAYS,
+    aggregates_from_transactions,
+    bucket_cutoff,
+    category_key,
+    counted_transactions,
+    customers_col,
+    day_key,
+    derived_features,
+    rebuild_customer_aggregates,
+    transactions_col,
+)
+
+logger = logging.getLogger("early_risk_app")
+
+AGG_TOTALS = ("balance", "total_spend", "tx_count", "cash_spend", "distinct_categories")
+# cap on mismatching customers listed in a report
+REPORT_LIMIT = 100
+
+
+def _add_spend(agg: dict, category: str, spend: float, count: int):
+    key = category_key(category)
+    agg["balance"] += spend
+    agg["total_spend"] += spend
+    agg["tx_count"] += count
+    if category == "cash":
+        agg["cash_spend"] += spend
+    agg["category_spend"][key] = agg["category_spend"].get(key, 0.0) + spend
+    agg["category_counts"][key] = agg["category_counts"].get(key, 0) + count
+
+
+def _recomputed_aggregates(db, now: datetime) -> dict:
+    """
+    customer_id -> aggregates recomputed from the transactions collection,
+    grouped server-side per (customer, category) in one pass; daily spend
+    buckets come from a second pass over the retained days only. Pending
+    transactions count once their customer's aggregates include them,
+    like counted_transactions.
+    """
+    pipeline = [
+        # pending transactions are counted separately below
+        {"$match": {"pending": {"$ne": True}}},
+        {
+            "$group": {
+                "_id": {"customer_id": "$customer_id", "category": "$category"},
+                "spend": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }
+        }
+    ]
+    result: dict[str, dict] = {}
+    for row in transactions_col(db).aggregate(pipeline, allowDiskUse=True):
+        agg = result.setdefault(row["_id"]["customer_id"], aggregates_from_transactions([]))
+        _add_spend(agg, row["_id"].get("category") or "other", row["spend"], row["count"])
+
+    cutoff = bucket_cutoff(now)
+    recent = transactions_col(db).find(
+        {"timestamp": {"$gte": now - timedelta(days=SPEND_BUCKET_DAYS)}, "pending": {"$ne": True}},
+        {"customer_id": 1, "amount": 1, "timestamp": 1},
+    )
+    for t in recent:
+        day = day_key(t["timestamp"])
+        if day >= cutoff:
+            # a customer's first transaction may land between the two passes
+            agg = result.setdefault(t["customer_id"], aggregates_from_transactions([]))
+            agg["daily_spend"][day] = agg["daily_spend"].get(day, 0.0) + float(t["amount"])
+
+    pending: dict[str, list] = {}
+    cursor = transactions_col(db).find(
+        {"pending": True, "timestamp": {"$lte": now}},
+        {"customer_id": 1, "amount": 1, "category": 1, "timestamp": 1, "pending": 1},
+    )
+    for t in cursor:
+        pending.setdefault(t["customer_id"], []).append(t)
+    ids = [ObjectId(c) for c in pending if ObjectId.is_valid(c)]
+    for customer in customers_col(db).find({"_id": {"$in": ids}}, {"agg.applied_tx": 1}):
+        counted = counted_transactions(pending[str(customer["_id"])], customer)
+        if not counted:
+            continue
+        agg = result.setdefault(str(customer["_id"]), aggregates_from_transactions([]))
+        for t in counted:
+            _add_spend(agg, t.get("category") or "other", float(t["amount"]), 1)
+            day = day_key(t["timestamp"])
+            if day >= cutoff:
+                agg["daily_spend"][day] = agg["daily_spend"].get(day, 0.0) + float(t["amount"])
+
+    for agg in result.values():
+        agg["distinct_categories"] = len(agg["category_counts"])
+    return result
+
+
+def _close(a, b, rel_tol: float) -> bool:
+    return math.isclose(float(a or 0.0), float(b or 0.0), rel_tol=rel_tol, abs_tol=1e-6)
+
+
+def _diff(customer: dict, expected: dict, cutoff: str, rel_tol: float) -> list[str]:
+    """Names of the stored aggregates / derived features that disagree with ``expected``."""
+    stored = customer.get("agg")
+    if stored is None:
+        return ["agg"]
+
+    fields = [f for f in AGG_TOTALS if not _close(stored.get(f), expected[f], rel_tol)]
+    for name in ("category_spend", "category_counts", "daily_spend"):
+        have, want = stored.get(name) or {}, expected[name]
+        if name == "daily_spend":
+            # days before the cutoff are ignored until the next write prunes them
+            have = {day: v for day, v in have.items() if day >= cutoff}
+        if set(have) != set(want) or any(not _close(have[k], want[k], rel_tol) for k in want):
+            fields.append(name)
+
+    derived = derived_features(expected, float(customer.get("CreditLimit", 1.0)))
+    fields += [f for f, v in derived.items() if not _close(customer.get(f), v, rel_tol)]
+    return fields
+
+
+def reconcile_customer_aggregates(db, fix: bool = False, rel_tol: float = 1e-9) -> dict:
+    """
+    Verify every customer's running aggregates (and the features derived
+    from them) against a full recompute from the transactions collection.
+
+    With ``fix``, mismatching customers are rebuilt from their history. The
+    rebuild is conditioned on the aggregate version seen before recomputing,
+    so a transaction landing meanwhile makes that customer "skipped" rather
+    than overwritten; run again to pick it up.
+    """
+    t0 = time.perf_counter()
+    now = datetime.utcnow()
+    cutoff = bucket_cutoff(now)
+    expected_by_customer = _recomputed_aggregates(db, now)
+    empty = aggregates_from_transactions([])
+
+    report = {"checked": 0, "mismatched": 0, "fixed": 0, "skipped": 0, "customers": []}
+    projection = {"agg": 1, "CreditLimit": 1, "UtilisationPct": 1, "MerchantMixIndex": 1, "CashWithdrawalPct": 1}
+    for customer in customers_col(db).find({}, projection):
+        report["checked"] += 1
+        expected = expected_by_customer.get(str(customer["_id"]), empty)
+        fields = _diff(customer, expected, cutoff, rel_tol)
+        if not fields:
+            continue
+
+        report["mismatched"] += 1
+        entry = {"customer_id": str(customer["_id"]), "fields": fields}
+        if fix:
+            # customers without "agg" yet have nothing to race with
+            version = (customer.get("agg") or {}).get("version")
+            full = customers_col(db).find_one({"_id": customer["_id"]})
+            rebuilt = rebuild_customer_aggregates(db, full, expected_version=version)
+            entry["status"] = "fixed" if rebuilt is not None else "skipped"
+            report[entry["status"]] += 1
+        if len(report["customers"]) < REPORT_LIMIT:
+            report["customers"].append(entry)
+
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    if report["mismatched"]:
+        logger.warning(
+            f"Aggregate reconciliation: {report['mismatched']} of {report['checked']} customers "
+            f"mismatched ({report['fixed']} fixed, {report['skipped']} skipped)"
+        )
+    return report
@@ -0,0 +1,166 @@
+# app/services/batch_scoring_service.py
+import csv
+import io
+import json
+
+import numpy as np
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+
+from app.core.config import settings
+from app.ml.ml_pipeline import FEATURE_COLUMNS, FEATURE_FIELD_MAP, COLUMN_ALIAS_MAP
+from app.schemas.risk import CustomerFeatures
+from app.ml.model_loader import ModelBundle
+from app.services.ml_service import score_matrix, lab_risk_bands
+
+ARROW_CONTENT_TYPES = (
+    "application/vnd.apache.arrow.stream",
+    "application/vnd.apache.arrow.file",
+)
+
+_rows_adapter = TypeAdapter(list[CustomerFeatures])
+
+
+def _feature_column_for(header: str) -> str | None:
+    """
+    Map an incoming column header to its FEATURE_COLUMNS name. Accepts the
+    model column name, the CustomerFeatures field name or any bank alias.
+    """
+    name = header.strip()
+    if name in FEATURE_COLUMNS:
+        return name
+    if name in FEATURE_FIELD_MAP:
+        return FEATURE_FIELD_MAP[name]
+    return COLUMN_ALIAS_MAP.get(name.lower())
+
+
+def _column_positions(headers: list[str]) -> list[int]:
+    positions = {}
+    for i, h in enumerate(headers):
+        col = _feature_column_for(str(h))
+        if col is not None and col not in positions:
+            positions[col] = i
+    missing = [c for c in FEATURE_COLUMNS if c not in positions]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing columns: {missing}")
+    return [positions[c] for c in FEATURE_COLUMNS]
+
+
+def matrix_from_rows(rows: list[CustomerFeatures]) -> np.ndarray:
+    fields = list(FEATURE_FIELD_MAP)
+    return np.array([[getattr(r, f) for f in fields] for r in rows], dtype=float).reshape(
+        len(rows), len(fields)
+    )
+
+
+def matrix_from_json(body: bytes) -> np.ndarray:
+    try:
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            payload = payload.get("rows", [])
+        rows = _rows_adapter.validate_python(payload)
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid rows: {e}")
+    return matrix_from_rows(rows)
+
+
+def matrix_from_csv(body: bytes) -> np.ndarray:
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"CSV body is not valid UTF-8: {e}")
+    reader = csv.reader(io.StringIO(text))
+    try:
+        headers = next(reader)
+    except StopIteration:
+        raise HTTPException(status_code=400, detail="Empty CSV body")
+    positions = _column_positions(headers)
+    try:
+        return np.array(
+            [[row[i] for i in positions] for row in reader if row],
+            dtype=float,
+        ).reshape(-1, len(FEATURE_COLUMNS))
+    except (ValueError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid CSV row: {e}")
+
+
+def matrix_from_arrow(body: bytes, content_type: str) -> np.ndarray:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=415, detail="Arrow bodies require pyarrow on the server")
+
+    buf = pa.py_buffer(body)
+    try:
+        if content_type == "application/vnd.apache.arrow.file":
+            table = pa.ipc.open_file(buf).read_all()
+        else:
+            table = pa.ipc.open_stream(buf).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid Arrow body: {e}")
+
+    positions = _column_positions(table.column_names)
+    X = np.empty((table.num_rows, len(FEATURE_COLUMNS)), dtype=float)
+    for j, i in enumerate(positions):
+        try:
+            X[:, j] = table.column(i).to_numpy(zero_copy_only=False)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Column {table.column_names[i]!r} must be numeric: {e}",
+            )
+    return X
+
+
+def parse_feature_matrix(body: bytes, content_type: str) -> np.ndarray:
+    """
+    Build one (N, len(FEATURE_COLUMNS)) float matrix from a JSON, CSV or
+    Arrow request body, in FEATURE_COLUMNS order.
+    """
+    content_type = (content_type or "application/json").split(";")[0].strip().lower()
+    if content_type in ARROW_CONTENT_TYPES:
+        X = matrix_from_arrow(body, content_type)
+    elif content_type in ("text/csv", "application/csv"):
+        X = matrix_from_csv(body)
+    elif content_type == "application/json":
+        X = matrix_from_json(body)
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+
+    if len(X) > settings.SCORE_BATCH_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large; at most {settings.SCORE_BATCH_MAX_ROWS} rows per call",
+        )
+    if not np.isfinite(X).all():
+        raise HTTPException(status_code=400, detail="Feature values must be finite numbers")
+    return X
+
+
+def score_batch(bundle: ModelBundle, X: np.ndarray) -> dict:
+    """
+    Score every row of X in one vectorized pass and return per-row results.
+    """
+    version = bundle.version
+    if len(X) == 0:
+        return {"version": version, "count": 0, "results": []}
+
+    scores = score_matrix(bundle, X)
+    bands = lab_risk_bands(scores["ensemble_probability"])
+
+    results = [
+        {
+            "row": i,
+            "ml_probability": p,
+            "ensemble_probability": e,
+            "risk_band": b,
+        }
+        for i, (p, e, b) in enumerate(
+            zip(
+                scores["ml_probability"].tolist(),
+                scores["ensemble_probability"].tolist(),
+                bands.tolist(),
+            )
+        )
+    ]
+    return {"version": version, "count": len(results), "results": results}
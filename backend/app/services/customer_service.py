@@ -1,59 +1,84 @@
 # app/services/customer_service.py
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime
+
+from bson import ObjectId
 from fastapi import HTTPException
 
 from app.models.customer import (
     ensure_customer_for_user,
-    get_recent_transactions_for_customer,
+    ensure_customer_aggregates,
+    apply_transaction_aggregates,
     customers_col,
-    risk_scores_col,
+    normalize_category,
+    settle_pending_transaction,
+    transactions_col,
+    get_recent_transactions_for_customer,
 )
-from app.services.ml_service import score_customer
+from app.services.post_commit_service import get_post_commit_pipeline
 
-# WhatsApp alert support
-from app.services.whatsapp_service import send_flagged_risk_message
-from app.models.user import get_user_by_id
+logger = logging.getLogger("early_risk_app")
 
 
 # -----------------------------------------------------------
-# ADD A TRANSACTION + RECOMPUTE AGGREGATES + RE-SCORE
+# ADD A TRANSACTION + UPDATE AGGREGATES (RE-SCORE IN BACKGROUND)
 # -----------------------------------------------------------
 def handle_add_transaction(db, current_user, tx):
     """
-    Insert a transaction, recompute aggregates, re-score risk,
-    update customer + risk history, and trigger WhatsApp alerts
-    when risk transitions into HIGH.
+    Insert a transaction (marked pending), add it to the running
+    aggregates idempotently and clear the mark, then hand the
+    customer to the post-commit pipeline, which re-scores risk, writes the
+    risk history and triggers WhatsApp alerts when risk is HIGH in the
+    background. The returned customer has score_status "pending" until
+    that finishes (poll /user/score_status).
     """
 
-    customers = customers_col(db)
-    transactions = db["transactions"]
-
     # 1) Ensure the customer exists
     customer = ensure_customer_for_user(db, current_user)
     cust_id = str(customer["_id"])
-    credit_limit = float(customer.get("CreditLimit", 1.0))
-
-    # ⭐ Save previous risk band (for detecting transitions)
-    previous_band = customer.get("risk_band")
 
-    # 2) Compute current balance
-    existing_txs = list(transactions.find({"customer_id": cust_id}))
-    current_balance = sum(float(t["amount"]) for t in existing_txs) or 0.0
+    # 2) Normalize category
+    category = normalize_category(tx.category)
 
-    # 3) Normalize category
-    raw_category = (tx.category or "").strip().lower()
-    if raw_category in ["atm", "atm_withdrawal", "atm withdrawal", "cash_withdrawal"]:
-        category = "cash"
-    else:
-        category = raw_category or "other"
-
-    # 4) Projected balance
+    # 3) Insert the transaction, marked pending until the aggregates count it
     tx_amount = float(tx.amount)
-    projected_balance = current_balance + tx_amount
-
-    # 5) Prevent exceeding credit limit
-    if projected_balance > credit_limit:
-        available = max(0.0, credit_limit - current_balance)
+    tx_doc = {
+        "_id": ObjectId(),
+        "customer_id": cust_id,
+        "username": customer.get("username"),  # ← new field
+        "amount": tx_amount,
+        "category": category,
+        "description": tx.description,
+        "timestamp": datetime.utcnow(),
+    }
+    transactions = transactions_col(db)
+    transactions.insert_one({**tx_doc, "pending": True})
+
+    # 4) Update balance + aggregates atomically, unless it would exceed the
+    #    credit limit, and clear the mark. If either write fails the row is
+    #    settled here; only if that fails too is it left to the periodic
+    #    recover_pending_transactions
+    try:
+        applied, customer = apply_transaction_aggregates(
+            db, customer, tx_amount, category, tx_doc["timestamp"],
+            extra={"score_status": "pending"}, tx_id=tx_doc["_id"],
+        )
+        if applied:
+            transactions.update_one({"_id": tx_doc["_id"]}, {"$unset": {"pending": ""}})
+    except Exception:
+        try:
+            outcome = settle_pending_transaction(db, tx_doc)
+        except Exception:
+            logger.exception(f"Could not settle pending transaction {tx_doc['_id']}")
+            outcome = None
+        if outcome != "committed":
+            raise
+        # the aggregate write landed; only its acknowledgement was lost
+        applied, customer = True, customers_col(db).find_one({"_id": customer["_id"]})
+    if not applied:
+        transactions.delete_one({"_id": tx_doc["_id"]})
+        credit_limit = float(customer.get("CreditLimit", 1.0))
+        available = max(0.0, credit_limit - customer["agg"]["balance"])
         raise HTTPException(
             status_code=400,
             detail={
@@ -64,129 +89,11 @@ def handle_add_transaction(db, current_user, tx):
             },
         )
 
-    # 6) Insert transaction
-    tx_doc = {
-        "customer_id": cust_id,
-        "username": customer.get("username"),  # ← new field
-        "amount": tx_amount,
-        "category": category,
-        "description": tx.description,
-        "timestamp": datetime.utcnow(),
-    }
-    transactions.insert_one(tx_doc)
-
-    # 7) Recompute aggregates
-    _update_customer_aggregates(db, customer)
-
-    # Refresh updated customer
-    customer = customers.find_one({"_id": customer["_id"]})
-
-    # 8) Re-score using default admin model
-    admin_username = "admin"
-    risk = score_customer(admin_username, customer)
-
-    # 9) Insert risk history record
-    risk_scores_col(db).insert_one(
-        {
-            "customer_id": cust_id,
-            # "username": admin_username,
-            "username": customer.get("username"),
-            "ml_probability": risk["ml_probability"],
-            "ensemble_probability": risk["ensemble_probability"],
-            "risk_band": risk["risk_band"],
-            "timestamp": datetime.utcnow(),
-        }
-    )
-
-    # 10) Update customer record
-    customers.update_one(
-        {"_id": customer["_id"]},
-        {
-            "$set": {
-                "risk_band": risk["risk_band"],
-                "last_score": risk["ensemble_probability"],
-                "updated_at": datetime.utcnow(),
-            }
-        },
-    )
-
-    # ⭐ REFRESH snapshot after update
-    updated_customer = customers.find_one({"_id": customer["_id"]})
-    new_band = updated_customer.get("risk_band")
-
-    # ------------------------------------------------------------
-    # ⭐ 11) WhatsApp ALERT: Only if risk transitions → HIGH
-    # ------------------------------------------------------------
-    if new_band == "High":
-        user_id = updated_customer.get("user_id")
-        if user_id:
-            user = get_user_by_id(db, user_id)
-            phone = user.get("phone") if user else None
-
-            if phone:
-                reason = "Your recent spending behaviour indicates elevated delinquency risk."
-                send_flagged_risk_message(
-                    phone=phone,
-                    username=user["username"],
-                    band="High",
-                    reason=reason,
-                )
-
-    # ------------------------------------------------------------
-    return tx_doc, updated_customer
-
-
-# -----------------------------------------------------------
-# INTERNAL: Recompute aggregates
-# -----------------------------------------------------------
-def _update_customer_aggregates(db, customer):
-    """
-    Compute:
-      - UtilisationPct
-      - MerchantMixIndex
-      - CashWithdrawalPct
-      - RecentSpendChangePct
-    """
-    customers = customers_col(db)
-    transactions = db["transactions"]
+    # 5) Windowed spend feature, re-score, risk history and alerts run in the
+    #    background, in order per customer
+    get_post_commit_pipeline().submit(customer["_id"])
 
-    cust_id = str(customer["_id"])
-    credit_limit = float(customer.get("CreditLimit", 1.0))
-
-    txs = list(transactions.find({"customer_id": cust_id}))
-    total_spend = sum(float(t["amount"]) for t in txs) or 0.0
-
-    utilisation_pct = (total_spend / credit_limit * 100.0) if credit_limit > 0 else 0.0
-    categories = {t.get("category") for t in txs}
-    merchant_mix_index = (len(categories) / len(txs)) if txs else 0.0
-
-    cash_spend = sum(float(t["amount"]) for t in txs if t.get("category") == "cash")
-    cash_withdrawal_pct = (cash_spend / total_spend * 100.0) if total_spend > 0 else 0.0
-
-    now = datetime.utcnow()
-    last_30 = now - timedelta(days=30)
-    prev_60 = now - timedelta(days=60)
-
-    spend_last = sum(float(t["amount"]) for t in txs if last_30 <= t["timestamp"] <= now)
-    spend_prev = sum(float(t["amount"]) for t in txs if prev_60 <= t["timestamp"] < last_30)
-
-    if spend_prev > 0:
-        recent_change_pct = ((spend_last - spend_prev) / spend_prev) * 100.0
-    else:
-        recent_change_pct = 0.0
-
-    customers.update_one(
-        {"_id": customer["_id"]},
-        {
-            "$set": {
-                "UtilisationPct": utilisation_pct,
-                "MerchantMixIndex": merchant_mix_index,
-                "CashWithdrawalPct": cash_withdrawal_pct,
-                "RecentSpendChangePct": recent_change_pct,
-                "updated_at": datetime.utcnow(),
-            }
-        },
-    )
+    return tx_doc, customer
 
 
 # -----------------------------------------------------------
@@ -195,10 +102,8 @@ def _update_customer_aggregates(db, customer):
 def _get_balance_and_available(db, customer):
     if customer is None:
         return 0.0, 0.0, 0.0
-    transactions = db["transactions"]
-    cust_id = str(customer["_id"])
-    txs = list(transactions.find({"customer_id": cust_id}))
-    balance = sum(float(t["amount"]) for t in txs) or 0.0
+    customer = ensure_customer_aggregates(db, customer)
+    balance = float(customer["agg"]["balance"])
     credit_limit = float(customer.get("CreditLimit", 1.0))
     available = max(0.0, credit_limit - balance)
     return balance, available, credit_limit
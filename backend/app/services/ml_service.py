@@ -1,36 +1,119 @@
 from pathlib import Path
 
+from typing import TYPE_CHECKING
+
 import numpy as np
-import pandas as pd
 from fastapi import HTTPException
 
 from app.ml.ml_pipeline import (
     train_models,
+    train_models_incremental,
+    RANDOM_STATE,
     FEATURE_COLUMNS,
     TARGET_COLUMN,
     normalize_bank_dataframe,
+    canonical_column_map,
 )
-from app.ml.model_loader import predict_probas_for, compute_ensemble
-from app.ml.model_registry import register_model_version, get_active_model_version
-from app.core.config import ARTIFACTS_DIR
+from app.ml.active_models import ActiveModel, get_active_models
+from app.ml.dataset_cache import file_sha256, load_dataset, store_dataset
+from app.ml.explainer import UNITS, get_explainer
+from app.ml.model_loader import ModelBundle, predict_probas_batched, compute_ensemble, invalidate_models_for
+from app.ml.model_registry import get_model_version, register_model_version
+from app.ml.score_cache import get_score_cache
+from app.core.config import ARTIFACTS_DIR, settings
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def get_artifact_dir_for(username: str, version: int) -> Path:
     return ARTIFACTS_DIR / username / f"v{version}"
 
 
-def _load_training_dataframe(file_path: Path) -> pd.DataFrame:
+# columns a training file is reduced to, with their in-memory dtypes; labels
+# are read as float (DPD buckets like 30 or 1.0, missing values) and
+# narrowed by _binarise_target once derived
+TRAINING_DTYPES = {
+    **{col: np.float32 for col in FEATURE_COLUMNS},
+    TARGET_COLUMN: np.float32,
+    "DPDBucketNextMonth": np.float32,
+}
+
+
+def _training_usecols(columns) -> dict:
+    """Raw header -> canonical name, for the headers training needs (first wins)."""
+    aliases = canonical_column_map(columns)
+    usecols = {}
+    for orig in columns:
+        name = aliases.get(orig, str(orig).strip())
+        if name in TRAINING_DTYPES and name not in usecols.values():
+            usecols[orig] = name
+    return usecols
+
+
+def _read_training_csv(file_path: Path) -> "pd.DataFrame":
+    """
+    Read only the training columns, chunk by chunk, as float32, so peak memory stays near the size of the final frame
+    rather than the raw file parsed with default dtypes.
+    """
+    import pandas as pd
+
+    usecols = _training_usecols(pd.read_csv(file_path, nrows=0).columns)
+    dtypes = {orig: TRAINING_DTYPES[name] for orig, name in usecols.items()}
+    chunks = []
+    try:
+        for chunk in pd.read_csv(
+            file_path,
+            usecols=list(usecols),
+            dtype=dtypes,
+            chunksize=settings.TRAINING_CSV_CHUNK_ROWS,
+        ):
+            chunk.rename(columns=usecols, inplace=True)
+            chunks.append(chunk)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid training data: {e}")
+
+    if not chunks:
+        return pd.DataFrame({name: pd.Series(dtype=TRAINING_DTYPES[name]) for name in usecols.values()})
+    return pd.concat(chunks, ignore_index=True, copy=False)
+
+
+def _load_training_dataframe(file_path: Path, sha256: str | None = None) -> "pd.DataFrame":
     """
     Load a training dataframe from CSV, XLSX, or JSON (records),
     then normalize column names and derive the binary target if needed.
+
+    The result is cached by the file's content hash (pass ``sha256`` if it
+    is already known), so retraining on a file seen before skips parsing.
     """
+    sha256 = sha256 or file_sha256(file_path)
+    df = load_dataset(sha256)
+    if df is not None:
+        return df
+
+    df = _parse_training_file(file_path)
+    store_dataset(sha256, df)
+    return df
+
+
+def _parse_training_file(file_path: Path) -> "pd.DataFrame":
+    import pandas as pd
+
     suffix = file_path.suffix.lower()
     if suffix == ".csv":
-        df = pd.read_csv(file_path)
-    elif suffix in [".xlsx", ".xls"]:
-        df = pd.read_excel(file_path)
-    elif suffix == ".json":
-        df = pd.read_json(file_path, orient="records")
+        df = _read_training_csv(file_path)
+    elif suffix in [".xlsx", ".xls", ".json"]:
+        if suffix == ".json":
+            df = pd.read_json(file_path, orient="records")
+        else:
+            df = pd.read_excel(file_path)
+        usecols = _training_usecols(df.columns)
+        df = df[list(usecols)]
+        df.columns = list(usecols.values())
+        try:
+            df = df.astype({name: TRAINING_DTYPES[name] for name in df.columns})
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid training data: {e}")
     else:
         raise HTTPException(
             status_code=400,
@@ -42,13 +125,66 @@ def _load_training_dataframe(file_path: Path) -> pd.DataFrame:
 
     # if we only have DPD bucket, derive binary target
     if "DPDBucketNextMonthBinary" not in df.columns and "DPDBucketNextMonth" in df.columns:
-        df["DPDBucketNextMonthBinary"] = (df["DPDBucketNextMonth"] > 0).astype(int)
+        df["DPDBucketNextMonthBinary"] = (df["DPDBucketNextMonth"] > 0).astype(np.int8)
+
+    return _binarise_target(df)
+
 
+def _binarise_target(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Store a target holding only 0 / 1 as int8; any other target is kept as read."""
+    if TARGET_COLUMN in df.columns and df[TARGET_COLUMN].dtype != np.int8:
+        y = df[TARGET_COLUMN]
+        if y.notna().all() and y.isin([0, 1]).all():
+            df[TARGET_COLUMN] = y.astype(np.int8)
     return df
 
 
-def retrain_from_file(username: str, file_path: Path, version: int) -> dict:
-    df = _load_training_dataframe(file_path)
+def _replay_sample(datasets: list, rows: int) -> "pd.DataFrame | None":
+    """
+    Up to ``rows`` training rows drawn uniformly (seeded) from the cached
+    datasets of a version's lineage. Datasets evicted from the cache are
+    skipped, so the sample may be smaller or None.
+    """
+    import pandas as pd
+
+    columns = FEATURE_COLUMNS + [TARGET_COLUMN]
+    frames = [df for df in (load_dataset(sha) for sha in datasets) if df is not None]
+    frames = [df[columns] for df in frames if all(c in df.columns for c in columns)]
+    available = sum(len(df) for df in frames)
+    if rows <= 0 or not available:
+        return None
+
+    rng = np.random.default_rng(RANDOM_STATE)
+    take = np.sort(rng.choice(available, size=min(rows, available), replace=False))
+    parts, offset = [], 0
+    for df in frames:
+        local = take[(take >= offset) & (take < offset + len(df))] - offset
+        parts.append(df.iloc[local])
+        offset += len(df)
+    return pd.concat(parts, ignore_index=True)
+
+
+def train_version(
+    username: str,
+    file_path: Path,
+    version: int,
+    progress=None,
+    sha256: str | None = None,
+    parent_version: int | None = None,
+    add_trees: int | None = None,
+) -> dict:
+    """
+    Load and validate a training file, train all members into the version's
+    artifact directory and register the version as active. Touches only disk
+    and Mongo, so it can run in a training worker process.
+
+    With ``parent_version`` the version is trained incrementally: the
+    parent's members are continued on the file's rows plus a replay sample
+    of the parent's own training data (INCREMENTAL_REPLAY_RATIO replayed
+    rows per new row) instead of being refitted from scratch.
+    """
+    sha256 = sha256 or file_sha256(file_path)
+    df = _load_training_dataframe(file_path, sha256=sha256)
 
     # validate feature + target columns
     missing = [c for c in FEATURE_COLUMNS + [TARGET_COLUMN] if c not in df.columns]
@@ -56,52 +192,164 @@ def retrain_from_file(username: str, file_path: Path, version: int) -> dict:
         raise HTTPException(status_code=400, detail=f"Missing columns: {missing}")
 
     artifact_dir = get_artifact_dir_for(username, version)
-    log_auc, tree_auc, nn_auc = train_models(df, artifact_dir=artifact_dir)
+    timings = {}
+    datasets = [sha256]
+    replay_rows = None
+    if parent_version is None:
+        log_auc, tree_auc, nn_auc = train_models(
+            df, artifact_dir=artifact_dir, progress=progress, timings=timings
+        )
+    else:
+        parent = get_model_version(username, parent_version)
+        if not parent:
+            raise HTTPException(status_code=400, detail=f"Parent version {parent_version} not found")
+        lineage = parent.get("datasets", [])
+        replay = _replay_sample(lineage, int(len(df) * settings.INCREMENTAL_REPLAY_RATIO))
+        replay_rows = 0 if replay is None else len(replay)
+        log_auc, tree_auc, nn_auc = train_models_incremental(
+            df,
+            replay,
+            parent_dir=get_artifact_dir_for(username, parent_version),
+            artifact_dir=artifact_dir,
+            progress=progress,
+            timings=timings,
+            add_trees=add_trees,
+        )
+        datasets = [sha for sha in lineage if sha != sha256] + [sha256]
 
+    if progress is not None:
+        progress("registering", 0.0)
     register_model_version(
         username=username,
         version=version,
         metrics={"logreg_auc": log_auc, "tree_auc": tree_auc, "nn_auc": nn_auc},
         is_active=True,
+        datasets=datasets,
+        parent_version=parent_version,
     )
 
-    return {
+    metrics = {
         "logreg_auc": log_auc,
         "tree_auc": tree_auc,
         "nn_auc": nn_auc,
         "version": version,
+        "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
     }
+    if parent_version is not None:
+        metrics.update({"parent_version": parent_version, "new_rows": len(df), "replay_rows": replay_rows})
+    return metrics
 
 
-def score_customer(admin_username: str, customer: dict) -> dict:
+def activate_trained_version(username: str, version: int):
     """
-    Build a feature row from the customer document, score it with the
-    active model for this admin, and return probabilities + band + features.
+    Refresh this process's serving state after a version was trained
+    (possibly in another process).
     """
-    mv = get_active_model_version(admin_username)
-    if not mv:
-        raise HTTPException(status_code=400, detail="No active model for this admin")
+    # artifacts on disk changed; never serve a stale cached bundle for this version
+    invalidate_models_for(username, version)
+    get_score_cache().invalidate(username, keep_version=version)
+    # start loading the new version in this worker now; others pick it up on their next poll
+    get_active_models().refresh()
+
+
+def retrain_from_file(
+    username: str, file_path: Path, version: int, parent_version: int | None = None
+) -> dict:
+    metrics = train_version(username, file_path, version, parent_version=parent_version)
+    activate_trained_version(username, version)
+    return metrics
+
 
-    version = mv["version"]
+CUSTOMER_BAND_EDGES = [0.4, 0.7]
+CUSTOMER_BAND_LABELS = np.array(["Low", "Medium", "High"])
 
-    row = {col: float(customer.get(col, 0.0)) for col in FEATURE_COLUMNS}
-    X = np.array([[row[col] for col in FEATURE_COLUMNS]], dtype=float)
+LAB_BAND_EDGES = [0.2, 0.4, 0.6, 0.8]
+LAB_BAND_LABELS = np.array(["Very Low", "Low", "Medium", "High", "Critical"])
+
+
+def customer_risk_bands(ensemble: np.ndarray) -> np.ndarray:
+    """
+    Low / Medium / High bands used for stored customer scores
+    (> 0.7 High, > 0.4 Medium, otherwise Low).
+    """
+    return CUSTOMER_BAND_LABELS[np.digitize(ensemble, CUSTOMER_BAND_EDGES, right=True)]
 
-    p_log, p_tree, p_nn = predict_probas_for(admin_username, version, X)
+
+def lab_risk_bands(ensemble: np.ndarray) -> np.ndarray:
+    """
+    Five-band scale used by the admin Risk Lab
+    (< 0.2 Very Low, < 0.4 Low, < 0.6 Medium, < 0.8 High, otherwise Critical).
+    """
+    return LAB_BAND_LABELS[np.digitize(ensemble, LAB_BAND_EDGES)]
+
+
+def require_active_model(admin_username: str) -> ActiveModel:
+    """
+    The model currently served for this admin, from the in-memory registry
+    (no DB round trip once the admin has been seen).
+    """
+    active = get_active_models().get(admin_username)
+    if active is None:
+        raise HTTPException(status_code=400, detail="No active model for this admin")
+    return active
+
+
+def score_matrix(bundle: ModelBundle, X: np.ndarray) -> dict:
+    """
+    Score an (N, len(FEATURE_COLUMNS)) matrix with one predict_probas call
+    and one compute_ensemble call. Returns per-row numpy arrays.
+    """
+    p_log, p_tree, p_nn = predict_probas_batched(bundle, X)
     ensemble = compute_ensemble(p_log, p_tree, p_nn)
-    prob = float(p_log[0])
-    ens = float(ensemble[0])
+    return {
+        "ml_probability": p_log,
+        "tree_probability": p_tree,
+        "nn_probability": p_nn,
+        "ensemble_probability": ensemble,
+    }
+
+
+def score_customer(admin_username: str, customer: dict) -> dict:
+    """
+    Build a feature row from the customer document, score it with the
+    active model for this admin, and return probabilities + band + the
+    top feature attributions (with their units).
+    """
+    # hold this ActiveModel for the whole request, even if a new version is swapped in
+    active = require_active_model(admin_username)
+    version = active.version
 
-    if ens > 0.7:
-        band = "High"
-    elif ens > 0.4:
-        band = "Medium"
+    X = np.array([[float(customer.get(col, 0.0)) for col in FEATURE_COLUMNS]], dtype=float)
+
+    # unchanged features + same model version -> reuse the stored result
+    cache = get_score_cache()
+    cache_key = cache.key(admin_username, version, X[0]) if cache.enabled else None
+    cached = cache.get(cache_key) if cache_key is not None else None
+    if cached is not None and "top_features" in cached:
+        return cached
+
+    if cached is None:
+        scores = score_matrix(active.bundle, X)
+        result = {
+            "ml_probability": float(scores["ml_probability"][0]),
+            "ensemble_probability": float(scores["ensemble_probability"][0]),
+            "risk_band": str(customer_risk_bands(scores["ensemble_probability"])[0]),
+        }
     else:
-        band = "Low"
+        result = cached
 
-    return {
-        "ml_probability": prob,
-        "ensemble_probability": ens,
-        "risk_band": band,
-        "top_features": [{"feature": k, "value": v} for k, v in row.items()],
+    explainer = get_explainer()
+    method, top_features = explainer.explain_row(active.bundle, X[0])
+    explanation = {
+        "top_features": top_features,
+        "explanation_method": method,
+        "explanation_units": UNITS[method],
     }
+    if cache_key is not None:
+        # store the explanation with the score once no tree SHAP upgrade can replace it
+        if explainer.is_final(active.bundle, method):
+            cache.put(cache_key, {**result, **explanation})
+        elif cached is None:
+            cache.put(cache_key, result)
+
+    return {**result, **explanation}
@@ -0,0 +1,266 @@
+# app/services/post_commit_service.py
+import logging
+import os
+import queue
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.core.db import get_db
+from app.models.customer import customers_col, recent_spend_change_pct, risk_scores_col
+from app.models.user import get_user_by_id
+from app.services.ml_service import score_customer
+from app.services.whatsapp_service import send_flagged_risk_message
+
+logger = logging.getLogger("early_risk_app")
+
+# customer scores (and the transaction path) use the default admin model
+ADMIN_USERNAME = "admin"
+# concurrent WhatsApp sends; kept apart so a slow API never delays scoring
+ALERT_WORKERS = 2
+
+
+# ---------------------------------------------------------------------------
+# Work done for a customer after a transaction commits
+# ---------------------------------------------------------------------------
+# Customer docs carry:
+#   score_status      "pending" (set by the transaction write), "processing",
+#                     "scored" or "failed"
+#   scored_version    the agg.version the stored risk_band / last_score reflect
+#   score_owner       pipeline holding the customer while it is scored, and
+#   score_lease_until when that claim lapses (the owner died)
+# A run first claims the customer with one conditional update, so however
+# many API workers queue it (every worker requeues at startup), only one
+# scores it at a time. A transaction landing mid-run sets "pending" again
+# but can't claim while the lease is live; the owner sees the agg.version
+# move when it finishes and scores again.
+SCORE_CLAIMABLE = ["pending", "failed", "processing"]
+
+
+def score_status(customer: dict) -> dict:
+    """Polling view of a customer's post-commit scoring state."""
+    return {
+        "score_status": customer.get("score_status") or "scored",
+        "agg_version": int((customer.get("agg") or {}).get("version", 0)),
+        "scored_version": customer.get("scored_version"),
+        "risk_band": customer.get("risk_band"),
+        "last_score": customer.get("last_score"),
+    }
+
+
+def claim_for_scoring(db, customer_id, owner: str):
+    """
+    Atomically take an unscored customer ("pending" / "failed", or
+    "processing" under a lapsed lease) for ``owner``: status "processing"
+    with a POST_COMMIT_LEASE_SECONDS lease. Returns the claimed customer,
+    or None when there's nothing to score or another owner holds it.
+    """
+    now = datetime.utcnow()
+    return customers_col(db).find_one_and_update(
+        {
+            "_id": customer_id,
+            "score_status": {"$in": SCORE_CLAIMABLE},
+            "$or": [{"score_lease_until": None}, {"score_lease_until": {"$lt": now}}],
+        },
+        {
+            "$set": {
+                "score_status": "processing",
+                "score_owner": owner,
+                "score_lease_until": now + timedelta(seconds=settings.POST_COMMIT_LEASE_SECONDS),
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _finish(db, customer: dict, version: int, owner: str, status: str, fields: dict) -> bool:
+    """
+    Store the outcome and release the claim. Returns True when a transaction
+    landed meanwhile, so the customer needs another run.
+    """
+    customers = customers_col(db)
+    release = {"score_owner": "", "score_lease_until": ""}
+    res = customers.update_one(
+        {"_id": customer["_id"], "agg.version": version, "score_owner": owner},
+        {"$set": {**fields, "score_status": status}, "$unset": release},
+    )
+    if res.matched_count:
+        return False
+    # agg moved on (it is "pending" again) or the lease lapsed and another owner took over
+    res = customers.update_one({"_id": customer["_id"], "score_owner": owner}, {"$set": fields, "$unset": release})
+    return res.matched_count > 0
+
+
+def rescore_customer(db, customer_id, owner: str):
+    """
+    Claim the customer, refresh the windowed spend feature, re-score its
+    current state, add a risk history record and store the band on the
+    customer; repeated while transactions land during the run. Returns the
+    updated customer, or None when there was nothing to do (not pending,
+    claimed elsewhere, already scored at this agg version) or scoring
+    failed.
+    """
+    scored = None
+    while True:
+        customer = claim_for_scoring(db, customer_id, owner)
+        if customer is None:
+            return scored
+        version = int((customer.get("agg") or {}).get("version", 0))
+        if customer.get("scored_version") == version:
+            if not _finish(db, customer, version, owner, "scored", {}):
+                return scored
+            continue
+
+        try:
+            customer["RecentSpendChangePct"] = recent_spend_change_pct(db, customer)
+            risk = score_customer(ADMIN_USERNAME, customer)
+        except Exception as e:
+            error = str(e.detail) if isinstance(e, HTTPException) else str(e)
+            logger.exception(f"Post-commit scoring of customer {customer_id} failed")
+            fields = {"score_error": error, "updated_at": datetime.utcnow()}
+            if not _finish(db, customer, version, owner, "failed", fields):
+                return None
+            continue
+
+        now = datetime.utcnow()
+        risk_scores_col(db).insert_one(
+            {
+                "customer_id": str(customer["_id"]),
+                "username": customer.get("username"),
+                "ml_probability": risk["ml_probability"],
+                "ensemble_probability": risk["ensemble_probability"],
+                "risk_band": risk["risk_band"],
+                "agg_version": version,
+                "timestamp": now,
+            }
+        )
+        fields = {
+            "RecentSpendChangePct": customer["RecentSpendChangePct"],
+            "risk_band": risk["risk_band"],
+            "last_score": risk["ensemble_probability"],
+            "scored_version": version,
+            "score_error": None,
+            "updated_at": now,
+        }
+        customer.update(fields)
+        scored = customer
+        if not _finish(db, customer, version, owner, "scored", fields):
+            return scored
+
+
+def send_high_risk_alert(db, customer: dict):
+    """WhatsApp alert for a customer whose risk band is High."""
+    user_id = customer.get("user_id")
+    if not user_id:
+        return
+    user = get_user_by_id(db, user_id)
+    phone = user.get("phone") if user else None
+    if phone:
+        reason = "Your recent spending behaviour indicates elevated delinquency risk."
+        send_flagged_risk_message(
+            phone=phone,
+            username=user["username"],
+            band="High",
+            reason=reason,
+        )
+
+
+# ---------------------------------------------------------------------------
+# Ordered background pipeline
+# ---------------------------------------------------------------------------
+class PostCommitPipeline:
+    """
+    Runs rescore_customer (then any alert) off the request path. Customers
+    are hashed onto ``workers`` queues, each drained by a single thread, so
+    one customer's runs never overlap or reorder. A customer already waiting
+    in its queue isn't queued twice: the run reads the latest state, so a
+    burst of transactions costs one scoring. Across API processes, runs are
+    serialized by claim_for_scoring under this pipeline's ``owner`` id. With
+    ``workers=0`` everything runs inline in submit().
+    """
+
+    def __init__(self, db, workers: int):
+        self.db = db
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._waiting: set = set()
+        self._lock = threading.Lock()
+        self._alerts = ThreadPoolExecutor(max_workers=ALERT_WORKERS, thread_name_prefix="risk-alert")
+        for i, q in enumerate(self._queues):
+            threading.Thread(target=self._drain, args=(q,), name=f"post-commit-{i}", daemon=True).start()
+
+    def submit(self, customer_id):
+        if not self._queues:
+            self._run(customer_id, inline=True)
+            return
+        with self._lock:
+            if customer_id in self._waiting:
+                return
+            self._waiting.add(customer_id)
+        self._queues[hash(str(customer_id)) % len(self._queues)].put(customer_id)
+
+    def _run(self, customer_id, inline: bool = False):
+        customer = rescore_customer(self.db, customer_id, self.owner)
+        if customer is not None and customer["risk_band"] == "High":
+            if inline:
+                send_high_risk_alert(self.db, customer)
+            else:
+                self._alerts.submit(send_high_risk_alert, self.db, customer)
+
+    def _drain(self, q: queue.Queue):
+        while True:
+            customer_id = q.get()
+            # from here on a new transaction queues the customer again
+            with self._lock:
+                self._waiting.discard(customer_id)
+            try:
+                self._run(customer_id)
+            except Exception:
+                logger.exception(f"Post-commit work for customer {customer_id} failed")
+            finally:
+                q.task_done()
+
+    def join(self):
+        """Block until everything queued so far has been processed."""
+        for q in self._queues:
+            q.join()
+
+    def stats(self) -> dict:
+        return {"workers": len(self._queues), "queued": sum(q.qsize() for q in self._queues)}
+
+
+_pipeline: PostCommitPipeline | None = None
+_pipeline_lock = threading.Lock()
+
+
+def get_post_commit_pipeline() -> PostCommitPipeline:
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = PostCommitPipeline(get_db(), max(0, settings.POST_COMMIT_WORKERS))
+    return _pipeline
+
+
+def requeue_unscored(db) -> int:
+    """
+    Queue customers left "pending" or "failed", or "processing" by a
+    process that stopped, e.g. by a restart that dropped the in-memory
+    queues. Every API worker does this at startup; the claim in
+    rescore_customer lets only one of them score each customer. Returns
+    how many were queued.
+    """
+    pipeline = get_post_commit_pipeline()
+    count = 0
+    for c in customers_col(db).find({"score_status": {"$in": SCORE_CLAIMABLE}}, {"_id": 1}):
+        pipeline.submit(c["_id"])
+        count += 1
+    if count:
+        logger.info(f"Queued {count} customer(s) with unfinished post-commit scoring")
+    return count
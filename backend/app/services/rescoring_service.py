@@ -0,0 +1,318 @@
+# app/services/rescoring_service.py
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument, UpdateOne
+
+from app.core.config import settings
+from app.ml.ml_pipeline import FEATURE_COLUMNS
+from app.models.customer import customers_col, risk_scores_col
+from app.ml.explainer import UNITS, explain_matrix
+from app.ml.model_loader import load_models_for
+from app.services.ml_service import score_matrix, customer_risk_bands, require_active_model
+
+logger = logging.getLogger("early_risk_app")
+
+# job ids currently executing in this process
+_running: set[str] = set()
+_running_lock = threading.Lock()
+
+
+def rescore_jobs_col(db):
+    return db["rescore_jobs"]
+
+
+def _customer_filter(last_id=None) -> dict:
+    query = {"source": "app_user"}
+    if last_id is not None:
+        query["_id"] = {"$gt": last_id}
+    return query
+
+
+def start_rescore_job(db, admin_username: str) -> dict:
+    """
+    Create a portfolio rescoring job pinned to the admin's active model
+    version and start it in a background thread.
+    """
+    active = require_active_model(admin_username)
+
+    now = datetime.utcnow()
+    job = {
+        "admin_username": admin_username,
+        "version": active.version,
+        "status": "pending",
+        "total": customers_col(db).count_documents(_customer_filter()),
+        "processed": 0,
+        "last_id": None,
+        "error": None,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "updated_at": now,
+    }
+    job["_id"] = rescore_jobs_col(db).insert_one(job).inserted_id
+    _launch(db, str(job["_id"]))
+    return job
+
+
+def resume_rescore_job(db, admin_username: str, job_id: str) -> dict:
+    """
+    Continue an interrupted or failed job from the last customer it wrote.
+    The job is claimed with a conditional update, so concurrent resumes
+    (from this or another API process) start it only once; a "running" job
+    counts as interrupted once it stops checkpointing for
+    RESCORE_STALE_SECONDS.
+    """
+    job = get_rescore_job(db, admin_username, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Rescore job not found")
+    if job["status"] == "completed":
+        raise HTTPException(status_code=400, detail="Rescore job already completed")
+
+    stale = datetime.utcnow() - timedelta(seconds=settings.RESCORE_STALE_SECONDS)
+    with _running_lock:
+        claimed = None
+        if job_id not in _running:
+            claimed = rescore_jobs_col(db).find_one_and_update(
+                {
+                    "_id": job["_id"],
+                    "$or": [
+                        {"status": {"$in": ["failed", "interrupted"]}},
+                        {"status": {"$in": ["pending", "running"]}, "updated_at": {"$lt": stale}},
+                    ],
+                },
+                {"$set": {"status": "pending", "updated_at": datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER,
+            )
+        if claimed is None:
+            raise HTTPException(status_code=409, detail="Rescore job is already running")
+        _running.add(job_id)
+    _start_thread(db, job_id)
+    return claimed
+
+
+def mark_interrupted_rescore_jobs(db) -> int:
+    """
+    Jobs left "pending" / "running" by a process that stopped (no checkpoint
+    for RESCORE_STALE_SECONDS) become "interrupted", so they show up as
+    resumable instead of running forever. Returns how many were marked.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=settings.RESCORE_STALE_SECONDS)
+    res = rescore_jobs_col(db).update_many(
+        {"status": {"$in": ["pending", "running"]}, "updated_at": {"$lt": stale}},
+        {"$set": {"status": "interrupted", "updated_at": datetime.utcnow()}},
+    )
+    if res.modified_count:
+        logger.warning(f"Marked {res.modified_count} stale rescore job(s) as interrupted")
+    return res.modified_count
+
+
+def get_rescore_job(db, admin_username: str, job_id: str):
+    if not ObjectId.is_valid(job_id):
+        return None
+    return rescore_jobs_col(db).find_one({"_id": ObjectId(job_id), "admin_username": admin_username})
+
+
+def list_rescore_jobs(db, admin_username: str, limit: int = 20):
+    return list(
+        rescore_jobs_col(db)
+        .find({"admin_username": admin_username})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+
+
+def rescore_progress(job: dict) -> dict:
+    """
+    Progress view of a job document: percent done, throughput and ETA.
+    """
+    total = job.get("total") or 0
+    processed = job.get("processed") or 0
+    started = job.get("started_at")
+    end = job.get("finished_at") or datetime.utcnow()
+    elapsed = (end - started).total_seconds() if started else 0.0
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    remaining = max(0, total - processed)
+    return {
+        "percent": (processed / total * 100.0) if total else 100.0,
+        "rows_per_sec": rate,
+        "eta_seconds": (remaining / rate) if rate > 0 else None,
+    }
+
+
+def _launch(db, job_id: str):
+    with _running_lock:
+        _running.add(job_id)
+    _start_thread(db, job_id)
+
+
+def _start_thread(db, job_id: str):
+    thread = threading.Thread(
+        target=run_rescore_job, args=(db, job_id), name=f"rescore-{job_id}", daemon=True
+    )
+    thread.start()
+
+
+def score_and_store_customers(db, chunk: list[dict], bundle, version: int, rescore_job_id=None):
+    """
+    Score customer docs (needing FEATURE_COLUMNS and username) in one
+    vectorized call, plus top feature attributions for the score history
+    per RESCORE_EXPLAIN_METHOD (batched when "tree_shap"), and write the band / last score to
+    the customers and a history row each to risk_scores, in bulk.
+
+    With ``rescore_job_id`` the history rows are upserted on (customer_id,
+    rescore_job_id), so a resumed job replaying the chunk it crashed in
+    doesn't write a second row per customer.
+    """
+    X = np.array(
+        [[float(c.get(col) or 0.0) for col in FEATURE_COLUMNS] for c in chunk],
+        dtype=float,
+    ).reshape(len(chunk), len(FEATURE_COLUMNS))
+    scores = score_matrix(bundle, X)
+    ensemble = scores["ensemble_probability"]
+    ml_prob = scores["ml_probability"]
+    bands = customer_risk_bands(ensemble)
+    explain = settings.RESCORE_EXPLAIN_METHOD
+    top = (
+        explain_matrix(bundle, X, explain, settings.EXPLAIN_TOP_K)
+        if explain != "none"
+        else None
+    )
+
+    now = datetime.utcnow()
+    customers_col(db).bulk_write(
+        [
+            UpdateOne(
+                {"_id": c["_id"]},
+                {
+                    "$set": {
+                        "risk_band": str(bands[i]),
+                        "last_score": float(ensemble[i]),
+                        "updated_at": now,
+                    }
+                },
+            )
+            for i, c in enumerate(chunk)
+        ],
+        ordered=False,
+    )
+    rows = [
+        {
+            "customer_id": str(c["_id"]),
+            "username": c.get("username"),
+            "ml_probability": float(ml_prob[i]),
+            "ensemble_probability": float(ensemble[i]),
+            "risk_band": str(bands[i]),
+            "model_version": version,
+            "top_features": top[i] if top is not None else None,
+            "explanation_method": explain if top is not None else None,
+            "explanation_units": UNITS.get(explain),
+            "timestamp": now,
+        }
+        for i, c in enumerate(chunk)
+    ]
+    if rescore_job_id is None:
+        risk_scores_col(db).insert_many(rows, ordered=False)
+        return
+    risk_scores_col(db).bulk_write(
+        [
+            UpdateOne(
+                {"customer_id": row["customer_id"], "rescore_job_id": rescore_job_id},
+                {"$set": row},
+                upsert=True,
+            )
+            for row in rows
+        ],
+        ordered=False,
+    )
+
+
+def run_rescore_job(db, job_id: str):
+    """
+    Walk app-user customers in _id order, chunk by chunk, scoring and
+    writing each chunk with score_and_store_customers. The job document
+    records the last _id written, so a restarted job resumes where it
+    stopped; history rows are keyed by the job, so the chunk replayed after
+    a crash overwrites its rows instead of duplicating them.
+    """
+    jobs = rescore_jobs_col(db)
+    customers = customers_col(db)
+    oid = ObjectId(job_id)
+
+    try:
+        job = jobs.find_one({"_id": oid})
+        username, version = job["admin_username"], job["version"]
+        last_id = job.get("last_id")
+        processed = job.get("processed") or 0
+        chunk_size = settings.RESCORE_CHUNK_SIZE
+        # the job is pinned to its version; holding the bundle keeps it loaded throughout
+        bundle = load_models_for(username, version)
+
+        jobs.update_one(
+            {"_id": oid},
+            {
+                "$set": {
+                    "status": "running",
+                    "error": None,
+                    "started_at": job.get("started_at") or datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+        )
+
+        projection = {col: 1 for col in FEATURE_COLUMNS}
+        projection["username"] = 1
+
+        while True:
+            chunk = list(
+                customers.find(_customer_filter(last_id), projection)
+                .sort("_id", 1)
+                .limit(chunk_size)
+            )
+            if not chunk:
+                break
+
+            t0 = time.perf_counter()
+            score_and_store_customers(db, chunk, bundle, version, rescore_job_id=oid)
+
+            last_id = chunk[-1]["_id"]
+            processed += len(chunk)
+            jobs.update_one(
+                {"_id": oid},
+                {
+                    "$set": {
+                        "last_id": last_id,
+                        "processed": processed,
+                        "updated_at": datetime.utcnow(),
+                    }
+                },
+            )
+            logger.info(
+                f"Rescore {job_id}: {processed} customers "
+                f"({len(chunk) / max(time.perf_counter() - t0, 1e-9):.0f}/s)"
+            )
+
+        jobs.update_one(
+            {"_id": oid},
+            {
+                "$set": {
+                    "status": "completed",
+                    "finished_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+        )
+    except Exception as e:
+        logger.exception(f"Rescore job {job_id} failed")
+        jobs.update_one(
+            {"_id": oid},
+            {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.utcnow()}},
+        )
+    finally:
+        with _running_lock:
+            _running.discard(job_id)
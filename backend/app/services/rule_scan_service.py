@@ -0,0 +1,113 @@
+# app/services/rule_scan_service.py
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.ml.ml_pipeline import FEATURE_COLUMNS
+from app.ml.rule_engine import RULE_NAMES, RULE_BITS, compiled_rules
+from app.models.customer import customers_col
+
+
+@dataclass(frozen=True)
+class RuleSnapshot:
+    """Portfolio feature matrix with each customer's rule trigger bitmask."""
+    ids: np.ndarray  # customer _id as str, aligned with X
+    usernames: np.ndarray
+    X: np.ndarray
+    bits: np.ndarray  # uint16, bit i = RULES[i]
+    built_at: float
+
+
+_snapshot: RuleSnapshot | None = None
+_snapshot_lock = threading.Lock()
+
+
+def build_rule_snapshot(db) -> RuleSnapshot:
+    projection = {col: 1 for col in FEATURE_COLUMNS}
+    projection["username"] = 1
+    ids, usernames, rows = [], [], []
+    for c in customers_col(db).find({"source": "app_user"}, projection):
+        ids.append(str(c["_id"]))
+        usernames.append(c.get("username"))
+        rows.append([float(c.get(col) or 0.0) for col in FEATURE_COLUMNS])
+
+    X = np.array(rows, dtype=np.float64).reshape(len(rows), len(FEATURE_COLUMNS))
+    return RuleSnapshot(
+        ids=np.array(ids, dtype=object),
+        usernames=np.array(usernames, dtype=object),
+        X=X,
+        bits=compiled_rules.trigger_bits(X),
+        built_at=time.time(),
+    )
+
+
+def get_rule_snapshot(db, refresh: bool = False) -> RuleSnapshot:
+    """
+    Shared snapshot, rebuilt from Mongo when older than
+    RULE_SNAPSHOT_TTL_SECONDS or on request.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        stale = (
+            _snapshot is None
+            or refresh
+            or time.time() - _snapshot.built_at > settings.RULE_SNAPSHOT_TTL_SECONDS
+        )
+        if stale:
+            _snapshot = build_rule_snapshot(db)
+        return _snapshot
+
+
+def scan_rules(
+    db,
+    rules: list[str] | None = None,
+    match: str = "any",
+    limit: int = 100,
+    offset: int = 0,
+    refresh: bool = False,
+) -> dict:
+    """
+    Customers whose trigger mask matches ``rules`` (any / all of them; no
+    rules = any rule fired). Selection is a mask test over the snapshot;
+    trigger messages are built only for the page of rows returned.
+    """
+    unknown = [r for r in rules or [] if r not in RULE_BITS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown rules: {unknown}")
+
+    snap = get_rule_snapshot(db, refresh=refresh)
+    t0 = time.perf_counter()
+
+    wanted = np.uint16(0)
+    for r in rules or []:
+        wanted |= RULE_BITS[r]
+    if not wanted:
+        selected = snap.bits != 0
+    elif match == "all":
+        selected = (snap.bits & wanted) == wanted
+    else:
+        selected = (snap.bits & wanted) != 0
+    rows = np.flatnonzero(selected)
+    page = rows[offset:offset + limit]
+
+    results = [
+        {
+            "customer_id": snap.ids[i],
+            "username": snap.usernames[i],
+            "trigger_mask": int(snap.bits[i]),
+            "rules": [t.model_dump() for t in compiled_rules.triggers(snap.X[i], int(snap.bits[i]))],
+        }
+        for i in page
+    ]
+    return {
+        "total": int(len(rows)),
+        "scanned": int(len(snap.bits)),
+        "counts": {name: int(np.count_nonzero(snap.bits & RULE_BITS[name])) for name in RULE_NAMES},
+        "scan_ms": (time.perf_counter() - t0) * 1000.0,
+        "snapshot_age_seconds": time.time() - snap.built_at,
+        "results": results,
+    }
@@ -0,0 +1,326 @@
+# app/services/training_job_service.py
+import logging
+import multiprocessing
+import shutil
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.core.db import get_db
+from app.ml.model_registry import get_active_model_version, get_model_version, list_model_versions
+from app.services.upload_service import SpooledUpload
+
+logger = logging.getLogger("early_risk_app")
+
+# share of overall progress covered by each training stage, in order
+TRAINING_STAGES = {
+    "queued": 0.0,
+    "loading": 0.05,
+    "training": 0.65,
+    "saving": 0.05,
+    "explainer": 0.15,
+    "registering": 0.10,
+}
+
+# minimum seconds between progress writes from a running job
+PROGRESS_WRITE_INTERVAL = 0.5
+# concurrent submits racing for the same version retry with the next one
+VERSION_RESERVE_ATTEMPTS = 5
+
+
+class TrainingCancelled(Exception):
+    pass
+
+
+def training_jobs_col(db):
+    return db["training_jobs"]
+
+
+def _next_version_for(db, username: str) -> int:
+    """
+    Next version number for this admin, counting versions reserved by
+    queued or running training jobs as taken. Only a candidate: the
+    reservation is the job insert, which the unique training_jobs_version
+    index rejects if a concurrent submit took the same number.
+    """
+    versions = list_model_versions(username)
+    latest = int(versions[0]["version"]) if versions else 0
+    reserved = training_jobs_col(db).find_one(
+        {"admin_username": username, "status": {"$in": ["pending", "running"]}},
+        {"version": 1},
+        sort=[("version", -1)],
+    )
+    if reserved:
+        latest = max(latest, int(reserved["version"]))
+    return latest + 1
+
+
+def _discard_artifacts(username: str, version: int):
+    """Drop the artifact directory of a version that never got registered."""
+    from app.services.ml_service import get_artifact_dir_for
+
+    if get_model_version(username, version) is None:
+        shutil.rmtree(get_artifact_dir_for(username, version), ignore_errors=True)
+
+
+def _overall_percent(stage: str, fraction: float) -> float:
+    done = 0.0
+    for name, weight in TRAINING_STAGES.items():
+        if name == stage:
+            return round((done + weight * min(max(fraction, 0.0), 1.0)) * 100.0, 1)
+        done += weight
+    return round(done * 100.0, 1)
+
+
+# ---------------------------------------------------------------------------
+# Executed in the training worker (a separate process by default)
+# ---------------------------------------------------------------------------
+class _JobReporter:
+    """Progress callback for train_models: writes throttled progress to the
+    job document and raises TrainingCancelled once a cancel was requested."""
+
+    def __init__(self, jobs, oid):
+        self.jobs = jobs
+        self.oid = oid
+        self.stage = None
+        self.last_write = 0.0
+
+    def __call__(self, stage: str, fraction: float):
+        now = time.monotonic()
+        if stage == self.stage and now - self.last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self.stage, self.last_write = stage, now
+        job = self.jobs.find_one_and_update(
+            {"_id": self.oid},
+            {
+                "$set": {
+                    "stage": stage,
+                    "percent": _overall_percent(stage, fraction),
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+            projection={"cancel_requested": 1},
+        )
+        if job and job.get("cancel_requested"):
+            raise TrainingCancelled()
+
+
+def run_training_job(job_id: str) -> str:
+    """
+    Train the job's version from its uploaded file and record the outcome
+    on the job document. Returns the final status.
+    """
+    from app.services.ml_service import train_version
+
+    jobs = training_jobs_col(get_db())
+    oid = ObjectId(job_id)
+    job = jobs.find_one_and_update(
+        {"_id": oid, "status": "pending", "cancel_requested": {"$ne": True}},
+        {"$set": {"status": "running", "started_at": datetime.utcnow(), "updated_at": datetime.utcnow()}},
+    )
+    if not job:
+        return "cancelled"
+
+    username, version = job["admin_username"], job["version"]
+    reporter = _JobReporter(jobs, oid)
+    status, update = "completed", {}
+    try:
+        reporter("loading", 0.0)
+        metrics = train_version(
+            username,
+            Path(job["file_path"]),
+            version,
+            progress=reporter,
+            sha256=job.get("file_sha256"),
+            parent_version=job.get("parent_version"),
+            add_trees=job.get("add_trees"),
+        )
+        update = {"metrics": metrics, "stage": "done", "percent": 100.0}
+    except TrainingCancelled:
+        status = "cancelled"
+    except HTTPException as e:
+        status, update = "failed", {"error": str(e.detail)}
+    except Exception as e:
+        logger.exception(f"Training job {job_id} failed")
+        status, update = "failed", {"error": str(e)}
+    finally:
+        Path(job["file_path"]).unlink(missing_ok=True)
+    if status != "completed":
+        # drop the partial artifacts; the version number is free again
+        _discard_artifacts(username, version)
+
+    jobs.update_one(
+        {"_id": oid},
+        {
+            "$set": {"status": status, "finished_at": datetime.utcnow(), "updated_at": datetime.utcnow(), **update},
+            "$unset": {"reserved": ""},
+        },
+    )
+    return status
+
+
+# ---------------------------------------------------------------------------
+# API process side
+# ---------------------------------------------------------------------------
+_executor: Executor | None = None
+_executor_lock = threading.Lock()
+# futures of jobs submitted from this process, for cancelling queued jobs
+_futures: dict[str, Future] = {}
+
+
+def _get_executor() -> Executor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = max(1, settings.TRAINING_WORKERS)
+            if settings.TRAINING_EXECUTOR == "thread":
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="training")
+            else:
+                # spawn: the worker starts with fresh Mongo clients and no
+                # copied threads/locks from the API process
+                _executor = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+                )
+        return _executor
+
+
+def _on_job_done(job_id: str, username: str, version: int, future: Future):
+    _futures.pop(job_id, None)
+    if future.cancelled():
+        return
+    try:
+        status = future.result()
+    except Exception as e:
+        # the worker process died (e.g. OOM); record it since it couldn't
+        logger.error(f"Training worker for job {job_id} crashed: {e}")
+        training_jobs_col(get_db()).update_one(
+            {"_id": ObjectId(job_id), "status": {"$in": ["pending", "running"]}},
+            {
+                "$set": {"status": "failed", "error": f"Training worker crashed: {e}", "finished_at": datetime.utcnow()},
+                "$unset": {"reserved": ""},
+            },
+        )
+        _discard_artifacts(username, version)
+        return
+    if status == "completed":
+        from app.services.ml_service import activate_trained_version
+
+        activate_trained_version(username, version)
+
+
+def submit_training_job(
+    db,
+    username: str,
+    upload: SpooledUpload,
+    mode: str = "full",
+    add_trees: int | None = None,
+) -> dict:
+    """
+    Queue training of the admin's next version from a spooled upload and
+    return the job document immediately. The job owns the spool file and
+    deletes it when training ends. The version is reserved by inserting
+    the job (``reserved`` until it ends, unique per admin and version);
+    a submit that loses the race to a concurrent one takes the next number.
+
+    ``mode="incremental"`` continues the admin's currently active version
+    (recorded on the job as parent_version) instead of training from
+    scratch; ``add_trees`` overrides INCREMENTAL_FOREST_TREES.
+    """
+    parent_version = None
+    if mode == "incremental":
+        active = get_active_model_version(username)
+        if not active:
+            upload.path.unlink(missing_ok=True)
+            raise HTTPException(status_code=400, detail="No active model to continue from")
+        parent_version = int(active["version"])
+
+    now = datetime.utcnow()
+    job = {
+        "admin_username": username,
+        "version": None,
+        "reserved": True,
+        "filename": upload.filename,
+        "file_path": str(upload.path),
+        "file_sha256": upload.sha256,
+        "file_size": upload.size,
+        "mode": mode,
+        "parent_version": parent_version,
+        "add_trees": add_trees,
+        "status": "pending",
+        "stage": "queued",
+        "percent": 0.0,
+        "metrics": None,
+        "error": None,
+        "cancel_requested": False,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "updated_at": now,
+    }
+    for _ in range(VERSION_RESERVE_ATTEMPTS):
+        job["version"] = _next_version_for(db, username)
+        try:
+            job["_id"] = training_jobs_col(db).insert_one(job).inserted_id
+            break
+        except DuplicateKeyError:
+            job.pop("_id", None)
+    else:
+        upload.path.unlink(missing_ok=True)
+        raise HTTPException(status_code=409, detail="Could not reserve a model version; try again")
+    job_id = str(job["_id"])
+
+    future = _get_executor().submit(run_training_job, job_id)
+    _futures[job_id] = future
+    future.add_done_callback(
+        lambda f: _on_job_done(job_id, username, job["version"], f)
+    )
+    return job
+
+
+def get_training_job(db, username: str, job_id: str) -> dict:
+    job = None
+    if ObjectId.is_valid(job_id):
+        job = training_jobs_col(db).find_one({"_id": ObjectId(job_id), "admin_username": username})
+    if not job:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
+
+
+def list_training_jobs(db, username: str, limit: int = 20):
+    return list(
+        training_jobs_col(db)
+        .find({"admin_username": username})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+
+
+def cancel_training_job(db, username: str, job_id: str) -> dict:
+    """
+    Cancel a queued job outright, or ask a running one to stop at its next
+    progress checkpoint.
+    """
+    job = get_training_job(db, username, job_id)
+    if job["status"] not in ("pending", "running"):
+        raise HTTPException(status_code=400, detail=f"Training job already {job['status']}")
+
+    jobs = training_jobs_col(db)
+    jobs.update_one({"_id": job["_id"]}, {"$set": {"cancel_requested": True, "updated_at": datetime.utcnow()}})
+
+    future = _futures.get(job_id)
+    if job["status"] == "pending" and (future is None or future.cancel()):
+        # never started (or queued in another worker, whose run will see the flag)
+        jobs.update_one(
+            {"_id": job["_id"], "status": "pending"},
+            {"$set": {"status": "cancelled", "finished_at": datetime.utcnow()}, "$unset": {"reserved": ""}},
+        )
+        Path(job["file_path"]).unlink(missing_ok=True)
+
+    return jobs.find_one({"_id": job["_id"]})
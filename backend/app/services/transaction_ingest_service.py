@@ -0,0 +1,469 @@
+# app/services/transaction_ingest_service.py
+import csv
+import io
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.models.customer import (
+    customers_col,
+    normalize_category,
+    rebuild_customer_aggregates,
+    rebuild_customer_aggregates_retrying,
+    transactions_col,
+)
+from app.services.ml_service import require_active_model
+from app.services.rescoring_service import score_and_store_customers
+
+logger = logging.getLogger("early_risk_app")
+
+# cap on rejected rows listed in a report
+REPORT_LIMIT = 100
+# ways a record can name its customer, in order of precedence
+CUSTOMER_KEYS = ("customer_id", "CustomerID", "username")
+# customers whose histories are read together for the aggregate recompute
+AGGREGATE_CHUNK_CUSTOMERS = 500
+# report counters copied onto the job document as it runs
+PROGRESS_COUNTERS = ("rows", "inserted", "rejected", "failed", "customers", "rescored")
+
+NOT_UTF8 = "not valid UTF-8"
+
+
+def ingest_jobs_col(db):
+    return db["ingest_jobs"]
+
+
+def _is_utf8(value: str) -> bool:
+    # undecodable bytes survive the surrogateescape decode as lone surrogates
+    try:
+        value.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _records_from_csv(f) -> Iterator[tuple[int, dict | str]]:
+    for row, record in enumerate(csv.DictReader(f), start=2):
+        if not all(_is_utf8(v) for v in record.values() if isinstance(v, str)):
+            yield row, NOT_UTF8
+            continue
+        yield row, record
+
+
+def _records_from_ndjson(f) -> Iterator[tuple[int, dict | str]]:
+    for row, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        if not _is_utf8(line):
+            yield row, NOT_UTF8
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row, f"invalid JSON: {e}"
+            continue
+        yield row, record if isinstance(record, dict) else "expected a JSON object"
+
+
+_READERS = {".csv": _records_from_csv, ".ndjson": _records_from_ndjson, ".jsonl": _records_from_ndjson}
+
+
+def _reader_for(path: Path):
+    reader = _READERS.get(path.suffix.lower())
+    if reader is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type; use CSV or NDJSON")
+    return reader
+
+
+def iter_transaction_records(path: Path, raw: BinaryIO) -> Iterator[tuple[int, dict | str]]:
+    """
+    (row number, record) for every record of a CSV (header row) or NDJSON
+    file, streamed from its open binary handle ``raw``; a record that can't
+    be decoded (including one that isn't UTF-8) is an error string.
+    """
+    reader = _reader_for(path)
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="surrogateescape", newline="")
+    return reader(text)
+
+
+def _parse_timestamp(value, default: datetime) -> datetime:
+    """ISO 8601 string or epoch seconds, as naive UTC like datetime.utcnow()."""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    ts = datetime.fromisoformat(str(value).strip())
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _parse_record(record: dict, now: datetime) -> tuple[tuple[str, str], dict]:
+    """
+    ((customer key field, value), transaction fields) for one record;
+    raises ValueError when it is unusable.
+    """
+    customer = next(((k, str(record[k]).strip()) for k in CUSTOMER_KEYS if record.get(k)), None)
+    if customer is None:
+        raise ValueError(f"missing customer ({' / '.join(CUSTOMER_KEYS)})")
+    amount = float(record.get("amount"))
+    # same rule as TransactionCreate
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("amount must be a positive number")
+    description = record.get("description")
+    return customer, {
+        "amount": amount,
+        "category": normalize_category(record.get("category")),
+        "description": str(description) if description not in (None, "") else None,
+        "timestamp": _parse_timestamp(record.get("timestamp"), now),
+    }
+
+
+def _resolve_customers(db, keys: set, known: dict):
+    """Look up the customers named by ``keys`` not already in ``known``, one query per key field."""
+    missing: dict[str, set] = {}
+    for field, value in keys - known.keys():
+        missing.setdefault(field, set()).add(value)
+
+    projection = {"username": 1, "CustomerID": 1}
+    for field, values in missing.items():
+        if field == "customer_id":
+            ids = [ObjectId(v) for v in values if ObjectId.is_valid(v)]
+            query = {"_id": {"$in": ids}}
+        else:
+            query = {field: {"$in": list(values)}, "source": "app_user"}
+        for c in customers_col(db).find(query, projection):
+            value = str(c["_id"]) if field == "customer_id" else c[field]
+            known[(field, value)] = c
+
+    # remember misses too, so they aren't queried again
+    for field, values in missing.items():
+        for value in values:
+            known.setdefault((field, value), None)
+
+
+def _insert_batch(db, pending: list, known: dict, report: dict, affected: set):
+    """Resolve the batch's customers and insert its transactions in one unordered insert_many."""
+    _resolve_customers(db, {key for _, key, _ in pending}, known)
+    docs = []
+    for row, key, fields in pending:
+        customer = known.get(key)
+        if customer is None:
+            _reject(report, row, f"unknown customer {key[0]}={key[1]}")
+            continue
+        # same document shape as handle_add_transaction
+        docs.append({"customer_id": str(customer["_id"]), "username": customer.get("username"), **fields})
+    if not docs:
+        return
+
+    failed_at = set()
+    try:
+        transactions_col(db).insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            failed_at.add(err["index"])
+        report["failed"] += len(failed_at)
+    for i, doc in enumerate(docs):
+        if i not in failed_at:
+            report["inserted"] += 1
+            affected.add(doc["customer_id"])
+
+
+def _reject(report: dict, row: int, error: str):
+    report["rejected"] += 1
+    if len(report["errors"]) < REPORT_LIMIT:
+        report["errors"].append({"row": row, "error": error})
+
+
+def _rebuild_chunk(db, customer_ids: list[str]) -> list[dict]:
+    """
+    Rebuild a chunk of customers' aggregates, reading the customers and
+    their histories with one query each. Customers whose "agg" changed
+    after it was read are redone one by one.
+    """
+    customers = list(customers_col(db).find({"_id": {"$in": [ObjectId(c) for c in customer_ids]}}))
+    histories: dict[str, list] = {}
+    cursor = transactions_col(db).find(
+        {"customer_id": {"$in": customer_ids}},
+        {"customer_id": 1, "amount": 1, "category": 1, "timestamp": 1, "pending": 1},
+    )
+    for t in cursor:
+        histories.setdefault(t["customer_id"], []).append(t)
+
+    rebuilt = []
+    for customer in customers:
+        cust_id = str(customer["_id"])
+        version = (customer.get("agg") or {}).get("version")
+        updated = rebuild_customer_aggregates(
+            db, customer, expected_version=version, txs=histories.pop(cust_id, [])
+        )
+        if updated is None:
+            updated = rebuild_customer_aggregates_retrying(db, cust_id)
+        if updated is not None:
+            rebuilt.append(updated)
+    return rebuilt
+
+
+def ingest_transaction_file(
+    db, path: Path, admin_username: str = "admin", rescore: bool = True, progress: Callable | None = None
+) -> dict:
+    """
+    Bulk-load a CSV or NDJSON file of transactions (backfills, card-network
+    history). Each record names its customer by customer_id, CustomerID or
+    username and carries amount, category, optional description and
+    optional timestamp (ISO 8601 or epoch seconds; default now).
+
+    Categories are normalized like single transactions. Records are
+    inserted with unordered insert_many batches of INGEST_BATCH_ROWS; then
+    each affected customer's aggregates are recomputed once from its full
+    history, and with ``rescore`` the customers are scored with the admin's
+    active model in vectorized RESCORE_CHUNK_SIZE batches. Unlike
+    handle_add_transaction, credit limits are not enforced (the history
+    already happened) and no WhatsApp alerts are sent.
+
+    ``progress(phase, report, done, total)`` is called after every insert
+    batch ("inserting": bytes read of the file size) and aggregate chunk
+    ("aggregates": customers of those affected).
+    """
+    t0 = time.perf_counter()
+    active = require_active_model(admin_username) if rescore else None
+
+    report = {"rows": 0, "inserted": 0, "rejected": 0, "failed": 0, "customers": 0, "rescored": 0,
+              "model_version": active.version if active else None, "errors": []}
+    now = datetime.utcnow()
+    known: dict = {}
+    affected: set[str] = set()
+    pending = []
+    size = path.stat().st_size
+    with open(path, "rb") as raw:
+        for row, record in iter_transaction_records(path, raw):
+            report["rows"] += 1
+            if isinstance(record, str):
+                _reject(report, row, record)
+                continue
+            try:
+                key, fields = _parse_record(record, now)
+            except (TypeError, ValueError, OverflowError, OSError) as e:
+                _reject(report, row, str(e))
+                continue
+            pending.append((row, key, fields))
+            if len(pending) >= settings.INGEST_BATCH_ROWS:
+                _insert_batch(db, pending, known, report, affected)
+                pending = []
+                if progress:
+                    # the text layer reads ahead, so this is approximate
+                    progress("inserting", report, min(raw.tell(), size), size)
+        if pending:
+            _insert_batch(db, pending, known, report, affected)
+    t_insert = time.perf_counter()
+
+    # one recompute per customer, however many of its transactions arrived
+    affected = sorted(affected)
+    if progress:
+        progress("aggregates", report, 0, len(affected))
+    chunk = []
+    for i in range(0, len(affected), AGGREGATE_CHUNK_CUSTOMERS):
+        rebuilt = _rebuild_chunk(db, affected[i : i + AGGREGATE_CHUNK_CUSTOMERS])
+        report["customers"] += len(rebuilt)
+        if active is not None:
+            chunk += rebuilt
+            if len(chunk) >= settings.RESCORE_CHUNK_SIZE:
+                score_and_store_customers(db, chunk, active.bundle, active.version)
+                report["rescored"] += len(chunk)
+                chunk = []
+        if progress:
+            progress("aggregates", report, min(i + AGGREGATE_CHUNK_CUSTOMERS, len(affected)), len(affected))
+    if chunk:
+        score_and_store_customers(db, chunk, active.bundle, active.version)
+        report["rescored"] += len(chunk)
+    t_end = time.perf_counter()
+
+    report["seconds"] = {
+        "insert": round(t_insert - t0, 3),
+        "aggregates_and_rescore": round(t_end - t_insert, 3),
+        "total": round(t_end - t0, 3),
+    }
+    report["tx_per_sec"] = round(report["inserted"] / max(t_end - t0, 1e-9), 1)
+    logger.info(
+        f"Ingested {report['inserted']} of {report['rows']} transactions for {report['customers']} customers "
+        f"({report['tx_per_sec']:.0f} tx/s; {report['rejected']} rejected, {report['failed']} failed)"
+    )
+    return report
+
+
+def create_ingest_job(
+    db, path: Path, admin_username: str, rescore: bool = True, filename: str | None = None,
+    delete_file: bool = False,
+) -> dict:
+    """
+    Record an ingestion job for ``path`` without starting it. The file type
+    and (with ``rescore``) the admin's active model are checked up front, so
+    those mistakes are a 400 rather than a failed job. With ``delete_file``
+    the job owns the file (a spooled upload) and removes it when it ends.
+    """
+    _reader_for(path)
+    active = require_active_model(admin_username) if rescore else None
+
+    now = datetime.utcnow()
+    job = {
+        "admin_username": admin_username,
+        "filename": filename or path.name,
+        "path": str(path),
+        "delete_file": delete_file,
+        "rescore": rescore,
+        "model_version": active.version if active else None,
+        "status": "pending",
+        "phase": None,
+        "done": 0,
+        "total": 0,
+        "report": None,
+        "error": None,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "updated_at": now,
+    }
+    job["_id"] = ingest_jobs_col(db).insert_one(job).inserted_id
+    return job
+
+
+def start_ingest_job(db, path: Path, admin_username: str, rescore: bool = True, filename: str | None = None,
+                     delete_file: bool = False) -> dict:
+    """Create an ingestion job and run it in a background thread."""
+    job = create_ingest_job(db, path, admin_username, rescore, filename, delete_file)
+    job_id = str(job["_id"])
+    thread = threading.Thread(
+        target=run_ingest_job, args=(db, job_id), name=f"ingest-{job_id}", daemon=True
+    )
+    thread.start()
+    return job
+
+
+def run_ingest_job(db, job_id: str):
+    """
+    Run ingest_transaction_file for a job, checkpointing its phase, progress
+    and report counters on the job document after every batch. Ingestion
+    isn't resumable (inserted rows would be inserted again), so a failed or
+    interrupted job is only reported.
+    """
+    jobs = ingest_jobs_col(db)
+    oid = ObjectId(job_id)
+    job = jobs.find_one({"_id": oid})
+    path = Path(job["path"])
+
+    def checkpoint(phase: str, report: dict, done: int, total: int):
+        counters = {f"report.{k}": report[k] for k in PROGRESS_COUNTERS}
+        jobs.update_one(
+            {"_id": oid},
+            {"$set": {"phase": phase, "done": done, "total": total, **counters, "updated_at": datetime.utcnow()}},
+        )
+
+    try:
+        jobs.update_one(
+            {"_id": oid},
+            {
+                "$set": {
+                    "status": "running",
+                    "report": {k: 0 for k in PROGRESS_COUNTERS},
+                    "started_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+        )
+        report = ingest_transaction_file(
+            db, path, job["admin_username"], rescore=job["rescore"], progress=checkpoint
+        )
+        jobs.update_one(
+            {"_id": oid},
+            {
+                "$set": {
+                    "status": "completed",
+                    "report": report,
+                    "finished_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+        )
+    except Exception as e:
+        logger.exception(f"Ingest job {job_id} failed")
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        jobs.update_one(
+            {"_id": oid},
+            {"$set": {"status": "failed", "error": detail, "updated_at": datetime.utcnow()}},
+        )
+    finally:
+        if job.get("delete_file"):
+            path.unlink(missing_ok=True)
+
+
+def mark_interrupted_ingest_jobs(db) -> int:
+    """
+    Jobs left "pending" / "running" by a process that stopped (no checkpoint
+    for INGEST_STALE_SECONDS) become "interrupted", and the uploads they
+    owned are removed. Returns how many were marked.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=settings.INGEST_STALE_SECONDS)
+    query = {"status": {"$in": ["pending", "running"]}, "updated_at": {"$lt": stale}}
+    marked = 0
+    for job in ingest_jobs_col(db).find(query, {"path": 1, "delete_file": 1}):
+        res = ingest_jobs_col(db).update_one(
+            {"_id": job["_id"], **query},
+            {"$set": {"status": "interrupted", "updated_at": datetime.utcnow()}},
+        )
+        if res.modified_count:
+            marked += 1
+            if job.get("delete_file"):
+                Path(job["path"]).unlink(missing_ok=True)
+    if marked:
+        logger.warning(f"Marked {marked} stale ingest job(s) as interrupted")
+    return marked
+
+
+def get_ingest_job(db, admin_username: str, job_id: str):
+    if not ObjectId.is_valid(job_id):
+        return None
+    return ingest_jobs_col(db).find_one({"_id": ObjectId(job_id), "admin_username": admin_username})
+
+
+def list_ingest_jobs(db, admin_username: str, limit: int = 20):
+    return list(
+        ingest_jobs_col(db)
+        .find({"admin_username": admin_username}, {"report.errors": 0})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+
+
+def ingest_progress(job: dict) -> dict:
+    """
+    Progress view of a job document: percent of the current phase, rows
+    read per second and the ETA of the phase.
+    """
+    total = job.get("total") or 0
+    done = job.get("done") or 0
+    started = job.get("started_at")
+    end = job.get("finished_at") or datetime.utcnow()
+    elapsed = (end - started).total_seconds() if started else 0.0
+    rows = (job.get("report") or {}).get("rows") or 0
+    # bytes per second; the aggregate phase isn't timed on its own, so it has no ETA
+    rate = done / elapsed if elapsed > 0 and job.get("phase") == "inserting" else None
+    if job.get("status") == "completed":
+        percent = 100.0
+    else:
+        percent = (done / total * 100.0) if total else 0.0
+    return {
+        "phase": job.get("phase"),
+        "percent": percent,
+        "rows_per_sec": rows / elapsed if elapsed > 0 else 0.0,
+        "eta_seconds": ((total - done) / rate) if rate else None,
+    }
@@ -0,0 +1,54 @@
+# app/services/upload_service.py
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import settings
+
+# bytes read from the upload per iteration
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class SpooledUpload:
+    path: Path
+    filename: str
+    sha256: str
+    size: int
+
+
+def spool_upload(file: UploadFile, prefix: str = "upload_") -> SpooledUpload:
+    """
+    Stream an upload into a uniquely named file under UPLOAD_SPOOL_DIR,
+    hashing it on the way. Memory use is one chunk regardless of file size,
+    and concurrent uploads with the same filename never share a path. The
+    original extension is kept so loaders can dispatch on it.
+    """
+    filename = Path(file.filename or "upload").name
+    spool_dir = Path(settings.UPLOAD_SPOOL_DIR)
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=prefix, suffix=Path(filename).suffix.lower(), dir=spool_dir)
+    path = Path(tmp)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := file.file.read(SPOOL_CHUNK_BYTES):
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Upload exceeds {settings.UPLOAD_MAX_BYTES} bytes",
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+    return SpooledUpload(path=path, filename=filename, sha256=digest.hexdigest(), size=size)
@@ -0,0 +1,176 @@
+# app/services/warmup_service.py
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.core.db import get_db
+from app.ml.active_models import get_active_models
+from app.models.customer import recover_pending_transactions
+from app.services.post_commit_service import requeue_unscored
+from app.services.rescoring_service import mark_interrupted_rescore_jobs
+from app.services.transaction_ingest_service import mark_interrupted_ingest_jobs
+
+logger = logging.getLogger("early_risk_app")
+
+# seconds between Mongo connection attempts while the database is unreachable
+DB_RETRY_SECONDS = 2.0
+
+_state = {
+    "ready": False,
+    "phase": "pending",
+    "started_at": None,
+    "finished_at": None,
+    "models": [],
+    "errors": [],
+}
+_state_lock = threading.Lock()
+_recovery_thread: threading.Thread | None = None
+
+
+def _set_state(**updates):
+    with _state_lock:
+        _state.update(updates)
+
+
+def readiness() -> dict:
+    with _state_lock:
+        return {**_state, "models": list(_state["models"]), "errors": list(_state["errors"])}
+
+
+def is_ready() -> bool:
+    with _state_lock:
+        return _state["ready"]
+
+
+def _connect():
+    """Connect to Mongo and ensure indexes, retrying until the server answers."""
+    while True:
+        try:
+            db = get_db()  # creates indexes on first call
+            db.command("ping")
+            return db
+        except Exception as e:
+            logger.warning(f"Warm-up: database not reachable yet ({e}); retrying")
+            time.sleep(DB_RETRY_SECONDS)
+
+
+def settle_pending_transactions(db) -> dict:
+    recovered = recover_pending_transactions(db, timedelta(seconds=settings.PENDING_TX_STALE_SECONDS))
+    if recovered["committed"] or recovered["removed"]:
+        logger.warning(f"Settled stale pending transactions: {recovered}")
+    return recovered
+
+
+def _recover_pending_periodically(db):
+    while True:
+        time.sleep(max(settings.PENDING_TX_STALE_SECONDS, 1))
+        try:
+            settle_pending_transactions(db)
+        except Exception:
+            logger.exception("Pending transaction recovery failed")
+
+
+def start_pending_recovery(db):
+    """
+    Settle stale pending transactions every PENDING_TX_STALE_SECONDS, so a
+    row a failed request couldn't settle doesn't wait for the next restart.
+    Started once per process.
+    """
+    global _recovery_thread
+    with _state_lock:
+        if _recovery_thread is not None:
+            return
+        _recovery_thread = threading.Thread(
+            target=_recover_pending_periodically, args=(db,), name="pending-tx-recovery", daemon=True
+        )
+        _recovery_thread.start()
+
+
+def _record_error(error: dict):
+    with _state_lock:
+        _state["errors"] = [*_state["errors"], error]
+
+
+def _step(name: str, fn, *args):
+    """
+    Run one warm-up step. A failure is logged and recorded in the readiness
+    state (so /health/ready shows it) instead of aborting the remaining steps.
+    """
+    try:
+        return fn(*args)
+    except Exception as e:
+        logger.exception(f"Warm-up step {name} failed")
+        _record_error({"step": name, "error": str(e)})
+        return None
+
+
+def _load_models() -> list[dict]:
+    # loads and warms every admin's active version, then keeps them current
+    registry = get_active_models()
+    try:
+        results = registry.refresh(wait=True)
+    finally:
+        registry.start_watching()
+    for r in results:
+        if "error" in r:
+            _record_error(r)
+    loaded = [
+        {"username": username, "version": version}
+        for username, version in registry.stats()["active"].items()
+    ]
+    _set_state(models=loaded)
+    return loaded
+
+
+def warm_up():
+    """
+    Startup phase: connect to Mongo and ensure indexes, load the active model
+    version of every admin and run a warm-up inference per bundle (single-row
+    through the batcher, and a small batch) so lazy allocations and worker
+    threads exist before real traffic arrives. A bundle that fails to load is
+    reported and retried by the registry watcher on its next poll.
+    Transactions a crashed request left pending are settled (and from then
+    on every PENDING_TX_STALE_SECONDS), and customers
+    whose post-commit scoring didn't finish before the last shutdown are
+    queued again.
+
+    A step that raises is recorded in ``errors`` and the rest still run;
+    the process then reports ready in phase "degraded" (models that didn't
+    load are loaded by the first requests or the next registry poll).
+    """
+    _set_state(phase="connecting", started_at=datetime.utcnow())
+    db = _connect()
+
+    _set_state(phase="loading_models")
+    loaded = _step("load_models", _load_models) or []
+
+    _set_state(phase="recovering")
+    _step("mark_interrupted_rescore_jobs", mark_interrupted_rescore_jobs, db)
+    _step("mark_interrupted_ingest_jobs", mark_interrupted_ingest_jobs, db)
+    _step("settle_pending_transactions", settle_pending_transactions, db)
+    _step("start_pending_recovery", start_pending_recovery, db)
+    _step("requeue_unscored", requeue_unscored, db)
+
+    errors = readiness()["errors"]
+    failed_steps = [e for e in errors if "step" in e]
+    _set_state(
+        ready=True,
+        phase="degraded" if failed_steps else "ready",
+        finished_at=datetime.utcnow(),
+    )
+    logger.info(f"Warm-up complete: {len(loaded)} model(s) loaded, {len(errors)} error(s)")
+
+
+def skip_warmup():
+    """Report ready immediately; models are then loaded by the first requests."""
+    get_active_models().start_watching()
+    start_pending_recovery(get_db())
+    _set_state(ready=True, phase="skipped", finished_at=datetime.utcnow())
+
+
+def start_warmup() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,50 @@
+"""
+Apply the index registry and check every registered query shape's plan.
+
+    python scripts/check_indexes.py [--no-apply]
+
+Creates missing indexes (recreating any whose definition changed), then
+runs explain() on each query shape in app/core/indexes.py and flags plans
+with a COLLSCAN (no usable index) or a SORT stage (sorted in memory).
+Exits non-zero if any query is flagged or an index could not be applied.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pymongo import MongoClient  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.indexes import apply_indexes, explain_query_shapes  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--no-apply", action="store_true", help="only explain; don't create indexes")
+    args = parser.parse_args()
+
+    # a bare client: get_db() would apply the indexes regardless of --no-apply
+    db = MongoClient(settings.MONGODB_URI)[settings.MONGODB_DB]
+    failed = []
+    if not args.no_apply:
+        report = apply_indexes(db)
+        failed = report["failed"]
+        print(json.dumps(report, indent=2))
+
+    flagged = 0
+    for result in explain_query_shapes(db):
+        status = "FLAG" if result["problems"] else "ok"
+        flagged += bool(result["problems"])
+        print(f"{status:4}  {result['collection']:15} {result['query']:26} {' > '.join(result['stages'])}")
+        if result["problems"]:
+            print(f"      {result['source']}: {', '.join(result['problems'])}")
+
+    print(f"{flagged} flagged query shape(s)")
+    sys.exit(1 if flagged or failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Parity and latency check for the compiled RandomForest engine.
+
+    python scripts/check_tree_engine.py artifacts/admin/v1 [training.csv]
+
+Compares CompiledForest.predict_proba with tree_model.predict_proba on the
+threshold probe set (and on the scaled training rows when a file is given),
+then reports single-row and batch latency for both paths. Exits non-zero
+if the probabilities are not identical.
+"""
+import sys
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.ml.tree_engine import CompiledForest, check_parity, parity_probe  # noqa: E402
+
+
+def _per_call_us(fn, X, repeats):
+    fn(X)
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn(X)
+    return (time.perf_counter() - t0) / repeats * 1e6
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+
+    artifact_dir = Path(sys.argv[1])
+    forest = joblib.load(artifact_dir / "tree_model.pkl")
+    compiled = CompiledForest.from_sklearn(forest)
+
+    X = parity_probe(forest)
+    if len(sys.argv) > 2:
+        import pandas as pd
+        from app.ml.ml_pipeline import FEATURE_COLUMNS, normalize_bank_dataframe
+
+        scaler = joblib.load(artifact_dir / "scaler.pkl")
+        df = normalize_bank_dataframe(pd.read_csv(sys.argv[2]))
+        X = np.vstack([X, scaler.transform(df[FEATURE_COLUMNS].values)])
+
+    ok = check_parity(forest, compiled, X)
+    print(f"parity on {len(X)} rows: {'identical' if ok else 'MISMATCH'}")
+
+    def sklearn_fn(A):
+        return forest.predict_proba(A)[:, 1]
+
+    row = X[:1]
+    print(f"single row  compiled: {_per_call_us(compiled.predict_proba, row, 500):9.1f} us")
+    print(f"single row  sklearn:  {_per_call_us(sklearn_fn, row, 20):9.1f} us")
+    print(f"{len(X)} rows  compiled: {_per_call_us(compiled.predict_proba, X, 5) / 1000:9.1f} ms")
+    print(f"{len(X)} rows  sklearn:  {_per_call_us(sklearn_fn, X, 5) / 1000:9.1f} ms")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Export nn_weights.npz for model versions trained before the NumPy MLP engine.
+
+    python scripts/export_mlp_weights.py [artifact_dir ...]
+
+With no arguments every artifacts/<admin>/v<N> directory is checked. For
+each directory with nn_model.pt but no nn_weights.npz, the torch MLP is
+loaded, checked against the NumPy forward pass and exported. Serving
+never writes artifacts, so run this once after upgrading. Exits non-zero
+if any export fails.
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import ARTIFACTS_DIR  # noqa: E402
+from app.ml.ml_pipeline import FEATURE_COLUMNS  # noqa: E402
+from app.ml.mlp_engine import NN_WEIGHTS_FILE, export_mlp  # noqa: E402
+from app.ml.model_loader import _load_torch_mlp  # noqa: E402
+
+
+def main():
+    dirs = [Path(a) for a in sys.argv[1:]] or sorted(ARTIFACTS_DIR.glob("*/v*"))
+    # standardised feature space, like the scaled test split used at training time
+    check_rows = np.random.default_rng(0).normal(size=(512, len(FEATURE_COLUMNS)))
+
+    failed = 0
+    for artifact_dir in dirs:
+        nn_path = artifact_dir / "nn_model.pt"
+        if not nn_path.exists():
+            continue
+        if (artifact_dir / NN_WEIGHTS_FILE).exists():
+            print(f"{artifact_dir}: already exported")
+            continue
+        try:
+            export_mlp(_load_torch_mlp(nn_path), artifact_dir, check_rows)
+            print(f"{artifact_dir}: exported {NN_WEIGHTS_FILE}")
+        except (RuntimeError, ValueError, OSError) as e:
+            failed += 1
+            print(f"{artifact_dir}: FAILED ({e})")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
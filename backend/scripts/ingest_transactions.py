@@ -0,0 +1,72 @@
+"""
+Bulk-load transactions from a CSV or NDJSON file.
+
+    python scripts/ingest_transactions.py FILE [--admin admin] [--no-rescore]
+
+Each record names its customer (customer_id, CustomerID or username) and
+has amount, category and optionally description and timestamp. Records are
+inserted in unordered batches, each affected customer's aggregates are
+recomputed once, and the customers are rescored with the admin's active
+model in vectorized batches.
+
+Runs as an ingest job like POST /admin/transactions/ingest, so the job is
+also listed by GET /admin/transactions/ingest. Progress goes to stderr; the
+final report, including tx_per_sec, is printed as JSON. Exits non-zero if
+the job failed or any record was rejected or failed to insert.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import HTTPException  # noqa: E402
+
+from app.core.db import get_db  # noqa: E402
+from app.services.transaction_ingest_service import (  # noqa: E402
+    get_ingest_job,
+    ingest_progress,
+    start_ingest_job,
+)
+
+# seconds between progress lines
+POLL_SECONDS = 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", type=Path, help=".csv, .ndjson or .jsonl file")
+    parser.add_argument("--admin", default="admin", help="admin whose active model rescores customers")
+    parser.add_argument("--no-rescore", action="store_true", help="only insert and recompute aggregates")
+    args = parser.parse_args()
+
+    db = get_db()
+    try:
+        job = start_ingest_job(db, args.file.resolve(), args.admin, rescore=not args.no_rescore)
+    except HTTPException as e:
+        sys.exit(f"error: {e.detail}")
+    job_id = str(job["_id"])
+    print(f"Ingest job {job_id}", file=sys.stderr)
+
+    while job["status"] in ("pending", "running"):
+        time.sleep(POLL_SECONDS)
+        job = get_ingest_job(db, args.admin, job_id)
+        progress = ingest_progress(job)
+        if progress["phase"]:
+            print(
+                f"  {progress['phase']}: {progress['percent']:.1f}% "
+                f"({progress['rows_per_sec']:.0f} rows/s)",
+                file=sys.stderr,
+            )
+
+    if job["status"] != "completed":
+        sys.exit(f"Ingest job {job_id} {job['status']}: {job.get('error')}")
+    report = job["report"]
+    print(json.dumps(report, indent=2, default=str))
+    sys.exit(1 if report["rejected"] or report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
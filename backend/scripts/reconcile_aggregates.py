@@ -0,0 +1,35 @@
+"""
+Verify the running transaction aggregates stored on customer documents.
+
+    python scripts/reconcile_aggregates.py [--fix]
+
+Recomputes every customer's balance, spend totals, per-category spend and
+counts from the transactions collection and compares them (and the
+UtilisationPct / MerchantMixIndex / CashWithdrawalPct derived from them)
+with what is stored. --fix rebuilds the mismatching customers. Exits
+non-zero if mismatches remain.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.db import get_db  # noqa: E402
+from app.services.aggregate_reconcile_service import reconcile_customer_aggregates  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fix", action="store_true", help="rebuild mismatching customers")
+    args = parser.parse_args()
+
+    report = reconcile_customer_aggregates(get_db(), fix=args.fix)
+    print(json.dumps(report, indent=2))
+    unresolved = report["mismatched"] - report["fixed"]
+    sys.exit(1 if unresolved else 0)
+
+
+if __name__ == "__main__":
+    main()
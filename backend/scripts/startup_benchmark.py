@@ -0,0 +1,81 @@
+"""
+Cold-start budget check for the API process.
+
+    python scripts/startup_benchmark.py [--runs 5] [--max-seconds 2.0] [--max-rss-mb 200]
+
+Imports app.main in fresh interpreters and reports median import time, peak
+RSS and which heavy training-only packages got pulled in. Exits non-zero if
+a budget is exceeded or any of torch / shap / pandas / sklearn is imported
+at startup (they must stay lazy, loaded only for retraining, explaining or
+the first model load).
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ["torch", "shap", "pandas", "sklearn", "scipy", "joblib"]
+FORBIDDEN_AT_STARTUP = ["torch", "shap", "pandas", "sklearn"]
+
+PROBE = f"""
+import json, resource, sys, time
+t0 = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t0
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss_kb //= 1024
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": rss_kb / 1024,
+    "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_once() -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--max-rss-mb", type=float, default=None)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    seconds = statistics.median(r["seconds"] for r in results)
+    rss_mb = statistics.median(r["rss_mb"] for r in results)
+    heavy = sorted({m for r in results for m in r["heavy"]})
+
+    print(f"import app.main: {seconds:.2f} s (median of {args.runs}), peak RSS {rss_mb:.0f} MB")
+    print(f"heavy modules imported at startup: {', '.join(heavy) or 'none'}")
+
+    failures = []
+    if args.max_seconds is not None and seconds > args.max_seconds:
+        failures.append(f"import time {seconds:.2f} s > budget {args.max_seconds:.2f} s")
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        failures.append(f"RSS {rss_mb:.0f} MB > budget {args.max_rss_mb:.0f} MB")
+    forbidden = [m for m in heavy if m in FORBIDDEN_AT_STARTUP]
+    if forbidden:
+        failures.append(f"training-only modules imported at startup: {', '.join(forbidden)}")
+
+    for f in failures:
+        print(f"FAIL: {f}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
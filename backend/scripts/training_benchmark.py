@@ -0,0 +1,91 @@
+"""
+Wall time per training stage, sequential vs parallel member training.
+
+    python scripts/training_benchmark.py path/to/training.csv [--runs 1] [--skip-identity]
+
+Trains the ensemble into temporary directories, once with the members
+fitted one after another and once concurrently in the process pool, and
+prints the per-stage timings of each. Unless --skip-identity is given it
+also checks that both runs wrote byte-for-byte identical artifacts and
+exits non-zero if they differ. Nothing is registered or written to Mongo.
+"""
+import argparse
+import hashlib
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from app.core.config import settings  # noqa: E402
+from app.ml.ml_pipeline import train_models  # noqa: E402
+from app.ml.training_members import forest_jobs  # noqa: E402
+from app.services.ml_service import _load_training_dataframe  # noqa: E402
+
+ARTIFACTS = [
+    "logreg_model.pkl",
+    "tree_model.pkl",
+    "scaler.pkl",
+    "nn_model.pt",
+    "nn_weights.npz",
+    "explainer_shap.pkl",
+    "baseline_stats.json",
+]
+
+
+def digests(artifact_dir: Path) -> dict:
+    return {name: hashlib.sha256((artifact_dir / name).read_bytes()).hexdigest() for name in ARTIFACTS}
+
+
+def run(df, parallel: bool, runs: int) -> tuple[dict, dict]:
+    timings_per_run = []
+    for _ in range(runs):
+        out = Path(tempfile.mkdtemp(prefix="training_benchmark_"))
+        timings = {}
+        aucs = train_models(df, artifact_dir=out, timings=timings, parallel=parallel, record_metadata=False)
+        timings_per_run.append(timings)
+    stages = timings_per_run[0].keys()
+    median = {s: statistics.median(t[s] for t in timings_per_run) for s in stages}
+    median["total"] = sum(v for k, v in median.items() if not k.startswith("fit_"))
+    print(
+        f"{'parallel' if parallel else 'sequential':>10}: "
+        + "  ".join(f"{k}={v:.2f}s" for k, v in median.items())
+        + f"  (AUCs {', '.join(f'{a:.4f}' for a in aucs)})"
+    )
+    return median, digests(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data", type=Path)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--skip-identity", action="store_true")
+    args = parser.parse_args()
+
+    df = _load_training_dataframe(args.data)
+    print(
+        f"{len(df)} rows; forest n_jobs={forest_jobs()}, "
+        f"torch threads={settings.TRAINING_TORCH_THREADS}"
+    )
+
+    # warm the pool once so worker start-up isn't billed to the first timed run
+    train_models(df, artifact_dir=Path(tempfile.mkdtemp()), parallel=True, record_metadata=False)
+
+    sequential, seq_digests = run(df, parallel=False, runs=args.runs)
+    parallel, par_digests = run(df, parallel=True, runs=args.runs)
+    print(f"speed-up (members): {sequential['members'] / parallel['members']:.2f}x, "
+          f"(total): {sequential['total'] / parallel['total']:.2f}x")
+
+    if args.skip_identity:
+        return
+    different = [name for name in ARTIFACTS if seq_digests[name] != par_digests[name]]
+    if different:
+        print(f"FAIL: artifacts differ between sequential and parallel: {', '.join(different)}")
+        sys.exit(1)
+    print("artifacts identical: " + ", ".join(ARTIFACTS))
+
+
+if __name__ == "__main__":
+    main()
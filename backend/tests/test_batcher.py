@@ -0,0 +1,69 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.ml.batcher import InferenceBatcher
+
+BUNDLE = SimpleNamespace(username="admin", version=1)
+
+
+def _predict(bundle, X):
+    s = X.sum(axis=1)
+    return s, s * 2, s * 3
+
+
+def test_idle_row_is_scored_without_waiting_for_the_window():
+    batcher = InferenceBatcher(_predict, window_ms=500.0, max_rows=64)
+    t0 = time.perf_counter()
+    p_log, p_tree, p_nn = batcher.submit(BUNDLE, np.array([1.0, 2.0]))
+    assert time.perf_counter() - t0 < 0.25
+    assert (p_log, p_tree, p_nn) == (3.0, 6.0, 9.0)
+    assert batcher.stats()["avg_wait_ms"] < 1.0
+
+
+def test_rows_arriving_during_a_batch_are_coalesced():
+    release = threading.Event()
+    batch_sizes = []
+
+    def slow_predict(bundle, X):
+        batch_sizes.append(len(X))
+        if len(batch_sizes) == 1:
+            release.wait(5)
+        return _predict(bundle, X)
+
+    batcher = InferenceBatcher(slow_predict, window_ms=5000.0, max_rows=64)
+    results = {}
+
+    def score(i):
+        results[i] = batcher.submit(BUNDLE, np.array([float(i), 0.0]))
+
+    first = threading.Thread(target=score, args=(0,))
+    first.start()
+    while not batch_sizes:
+        time.sleep(0.001)
+    others = [threading.Thread(target=score, args=(i,)) for i in range(1, 6)]
+    for t in others:
+        t.start()
+    while batcher.stats()["queue_depth"] < 5:
+        time.sleep(0.001)
+    release.set()
+    for t in [first, *others]:
+        t.join(5)
+
+    assert batch_sizes == [1, 5]
+    assert {i: r[0] for i, r in results.items()} == {i: float(i) for i in range(6)}
+
+
+def test_errors_reach_the_caller():
+    def failing(bundle, X):
+        raise ValueError("bad row")
+
+    batcher = InferenceBatcher(failing, window_ms=1.0, max_rows=4)
+    try:
+        batcher.submit(BUNDLE, np.array([1.0]))
+    except ValueError as e:
+        assert str(e) == "bad row"
+    else:
+        raise AssertionError("expected ValueError")
@@ -0,0 +1,80 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from app.ml.ml_pipeline import FEATURE_COLUMNS, TARGET_COLUMN, baseline_stats_of, merge_baseline_stats
+from app.ml.training_members import incremental_scaler, rebase_forest
+
+N_FEATURES = len(FEATURE_COLUMNS)
+
+
+def _raw_rows(rng, n):
+    # coarse, repeated values like the bank data (percentages, ratios to 2 dp)
+    return np.round(rng.uniform(0, 100, size=(n, N_FEATURES)), 2).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def parent():
+    rng = np.random.default_rng(0)
+    X = _raw_rows(rng, 4000)
+    y = (X[:, 0] + X[:, 1] - X[:, 4] + rng.normal(0, 20, size=len(X)) > 50).astype(int)
+    scaler = StandardScaler().fit(X)
+    forest = RandomForestClassifier(n_estimators=30, max_depth=8, random_state=0)
+    # fitted on the float32 transform, like train_models
+    return scaler, forest.fit(scaler.transform(X), y), X
+
+
+@pytest.mark.parametrize("shift", [(1.0, 0.5), (1.3, 5.0), (0.8, -10.0)])
+def test_rebased_forest_matches_parent(parent, shift):
+    scaler, forest, X = parent
+    rng = np.random.default_rng(1)
+    new_scaler = copy.deepcopy(scaler).partial_fit(_raw_rows(rng, 2000) * shift[0] + shift[1])
+    rebased = rebase_forest(copy.deepcopy(forest), scaler, new_scaler, X)
+
+    seen = X.astype(np.float64)
+    unseen = seen[:2000] * (1 + rng.normal(0, 1e-3, size=(2000, N_FEATURES)))
+    for rows in (seen, unseen):
+        np.testing.assert_array_equal(
+            rebased.predict_proba(new_scaler.transform(rows)), forest.predict_proba(scaler.transform(rows))
+        )
+
+
+def test_incremental_scaler_keeps_parent_for_tiny_shift(parent):
+    scaler, forest, X = parent
+    new_scaler = copy.deepcopy(scaler).partial_fit(np.tile(scaler.mean_, (2, 1)))
+    chosen, error = incremental_scaler(forest, scaler, new_scaler, X)
+    assert chosen is scaler and error is None
+
+
+def test_incremental_scaler_accepts_exact_rebase(parent):
+    scaler, forest, X = parent
+    new_scaler = copy.deepcopy(scaler).partial_fit(X * 1.3 + 5)
+    chosen, error = incremental_scaler(forest, scaler, new_scaler, X)
+    assert chosen is new_scaler and error == 0.0
+
+
+def test_merged_baseline_stats_equal_stats_of_all_rows():
+    rng = np.random.default_rng(2)
+    df = pd.DataFrame(rng.normal(5.0, 3.0, size=(1000, N_FEATURES)), columns=FEATURE_COLUMNS)
+    df[TARGET_COLUMN] = rng.integers(0, 2, size=len(df))
+    merged = merge_baseline_stats(baseline_stats_of(df.iloc[:700]), baseline_stats_of(df.iloc[700:]))
+    full = baseline_stats_of(df)
+
+    assert merged["rows"] == full["rows"]
+    assert merged["target_rate"] == pytest.approx(full["target_rate"])
+    for key in ("feature_means", "feature_stds"):
+        assert merged[key] == pytest.approx(full[key])
+
+
+def test_merge_without_parent_row_count_keeps_new_stats():
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame(rng.normal(size=(100, N_FEATURES)), columns=FEATURE_COLUMNS)
+    df[TARGET_COLUMN] = rng.integers(0, 2, size=len(df))
+    parent = baseline_stats_of(df.iloc[:50])
+    del parent["rows"]
+    new = baseline_stats_of(df.iloc[50:])
+    assert merge_baseline_stats(parent, new) == new
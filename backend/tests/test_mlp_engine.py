@@ -0,0 +1,94 @@
+import warnings
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.ml.mlp_engine import (  # noqa: E402
+    EQUIVALENCE_ATOL,
+    NN_WEIGHTS_FILE,
+    NumpyMLP,
+    check_equivalence,
+    export_mlp,
+)
+from app.ml.torch_mlp import MLP  # noqa: E402
+
+N_FEATURES = 7
+
+
+@pytest.fixture(scope="module")
+def torch_model():
+    # a few optimiser steps so the weights aren't just the initialisation
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    X = torch.tensor(rng.normal(size=(2000, N_FEATURES)), dtype=torch.float32)
+    y = (X[:, 0] - X[:, 3] > 0).float().unsqueeze(1)
+    model = MLP(N_FEATURES)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-2)
+    for _ in range(50):
+        optimizer.zero_grad()
+        torch.nn.functional.binary_cross_entropy_with_logits(model(X), y).backward()
+        optimizer.step()
+    return model.eval()
+
+
+def _torch_logits(model, X):
+    with torch.no_grad():
+        return model(torch.tensor(X, dtype=torch.float32)).numpy().ravel()
+
+
+def test_logits_match_torch(torch_model):
+    X = np.random.default_rng(1).normal(0.0, 2.0, size=(5000, N_FEATURES))
+    numpy_mlp = NumpyMLP.from_state_dict(torch_model.state_dict())
+    np.testing.assert_allclose(numpy_mlp.logits(X), _torch_logits(torch_model, X), rtol=0, atol=1e-5)
+    assert check_equivalence(torch_model, numpy_mlp, X) <= EQUIVALENCE_ATOL
+
+
+def test_single_row_and_extreme_inputs(torch_model):
+    numpy_mlp = NumpyMLP.from_state_dict(torch_model.state_dict())
+    X = np.vstack([np.zeros(N_FEATURES), np.full(N_FEATURES, 50.0), np.full(N_FEATURES, -50.0)])
+    for row in X:
+        row = row[None, :]
+        np.testing.assert_allclose(
+            numpy_mlp.logits(row), _torch_logits(torch_model, row), rtol=1e-6, atol=1e-5
+        )
+
+
+def test_probabilities_saturate_without_overflow_warnings(torch_model):
+    numpy_mlp = NumpyMLP.from_state_dict(torch_model.state_dict())
+    X = np.vstack([np.full(N_FEATURES, 1e4), np.full(N_FEATURES, -1e4)])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        p = numpy_mlp.predict_proba(X)
+    assert np.all((p >= 0.0) & (p <= 1.0))
+
+
+def test_folded_scaling_matches_torch_on_raw_features(torch_model):
+    rng = np.random.default_rng(2)
+    mean = rng.uniform(-1000, 1000, size=N_FEATURES)
+    scale = rng.uniform(0.5, 5000, size=N_FEATURES)
+    X_raw = mean + scale * rng.normal(size=(2000, N_FEATURES))
+
+    folded = NumpyMLP.from_state_dict(torch_model.state_dict()).fold_input_scaling(mean, scale)
+    expected = _torch_logits(torch_model, (X_raw - mean) / scale)
+    np.testing.assert_allclose(folded.logits(X_raw), expected, rtol=0, atol=1e-4)
+
+
+def test_check_equivalence_rejects_a_different_model(torch_model):
+    state = {k: v.clone() for k, v in torch_model.state_dict().items()}
+    state["net.5.bias"] += 0.5
+    other = NumpyMLP.from_state_dict(state)
+    X = np.random.default_rng(3).normal(size=(100, N_FEATURES))
+    with pytest.raises(RuntimeError):
+        check_equivalence(torch_model, other, X)
+
+
+def test_export_writes_loadable_weights_atomically(torch_model, tmp_path):
+    X = np.random.default_rng(4).normal(size=(512, N_FEATURES))
+    exported = export_mlp(torch_model, tmp_path, X)
+
+    assert [p.name for p in tmp_path.iterdir()] == [NN_WEIGHTS_FILE]
+    loaded = NumpyMLP.load(tmp_path / NN_WEIGHTS_FILE)
+    np.testing.assert_array_equal(loaded.logits(X), exported.logits(X))
+    np.testing.assert_allclose(loaded.logits(X), _torch_logits(torch_model, X), rtol=0, atol=1e-5)
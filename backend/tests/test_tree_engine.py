@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from app.ml.tree_engine import CompiledForest, compile_forest, parity_probe
+
+
+def _fitted_forest(missing_in_training: bool, seed: int = 0) -> RandomForestClassifier:
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(3000, 7))
+    y = (X[:, 0] + X[:, 1] ** 2 - X[:, 4] + rng.normal(size=len(X)) > 1).astype(int)
+    if missing_in_training:
+        X[rng.random(X.shape) < 0.05] = np.nan
+    forest = RandomForestClassifier(
+        n_estimators=25, max_depth=10, min_samples_leaf=2, class_weight="balanced", random_state=seed
+    )
+    return forest.fit(X, y)
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["complete", "missing"])
+def forest(request):
+    return _fitted_forest(missing_in_training=request.param)
+
+
+def _assert_identical(forest, X):
+    compiled = CompiledForest.from_sklearn(forest)
+    np.testing.assert_array_equal(compiled.predict_proba(X), forest.predict_proba(X)[:, 1])
+
+
+def test_random_rows(forest):
+    X = np.random.default_rng(1).normal(0.0, 2.0, size=(5000, 7))
+    _assert_identical(forest, X)
+
+
+def test_rows_on_split_thresholds(forest):
+    # every finite split threshold, placed exactly on its feature: <= vs < shows up here
+    rng = np.random.default_rng(2)
+    trees = [e.tree_ for e in forest.estimators_]
+    thresholds = np.concatenate([t.threshold[t.children_left != -1] for t in trees])
+    features = np.concatenate([t.feature[t.children_left != -1] for t in trees])
+    keep = np.isfinite(thresholds)
+    thresholds, features = thresholds[keep], features[keep]
+
+    X = rng.normal(size=(len(thresholds), 7))
+    X[np.arange(len(thresholds)), features] = thresholds
+    _assert_identical(forest, X)
+    # and one float32 step either side of the threshold
+    below = X.copy()
+    below[np.arange(len(thresholds)), features] = np.nextafter(
+        thresholds.astype(np.float32), np.float32(-np.inf)
+    )
+    above = X.copy()
+    above[np.arange(len(thresholds)), features] = np.nextafter(
+        thresholds.astype(np.float32), np.float32(np.inf)
+    )
+    _assert_identical(forest, np.vstack([below, above]))
+
+
+def test_nan_inputs(forest):
+    rng = np.random.default_rng(3)
+    X = rng.normal(0.0, 2.0, size=(5000, 7))
+    X[rng.random(X.shape) < 0.2] = np.nan
+    X[:7] = np.nan
+    _assert_identical(forest, X)
+
+
+def test_parity_probe_and_row_blocks(forest):
+    X = parity_probe(forest)
+    # more rows than one ROW_BLOCK, and a single row
+    _assert_identical(forest, np.vstack([X] * 3))
+    _assert_identical(forest, X[:1])
+
+
+def test_compile_forest_passes_its_own_check(forest):
+    assert compile_forest(forest) is not None
+
+
+def test_rejects_wrong_width(forest):
+    with pytest.raises(ValueError):
+        CompiledForest.from_sklearn(forest).predict_proba(np.zeros((2, 6)))
@@ -1,18 +1,67 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import api from "../api";
 
+const POLL_MS = 1500;
+const FINISHED = ["completed", "failed", "cancelled"];
+
 export default function AdminModelsPage() {
   const [models, setModels] = useState([]);
   const [file, setFile] = useState(null);
+  const [incremental, setIncremental] = useState(false);
   const [loadingUpload, setLoadingUpload] = useState(false);
+  const [job, setJob] = useState(null);
+  const pollRef = useRef(null);
 
   const loadModels = async () => {
     const res = await api.get("/risk/models");
     setModels(res.data);
   };
 
+  const stopPolling = () => {
+    if (pollRef.current) {
+      clearTimeout(pollRef.current);
+      pollRef.current = null;
+    }
+  };
+
+  const pollJob = async (jobId) => {
+    try {
+      const res = await api.get(`/risk/retrain/jobs/${jobId}`);
+      setJob(res.data);
+
+      if (!FINISHED.includes(res.data.status)) {
+        pollRef.current = setTimeout(() => pollJob(jobId), POLL_MS);
+        return;
+      }
+
+      pollRef.current = null;
+      if (res.data.status === "completed") {
+        await loadModels();
+        alert(`Model v${res.data.version} retrained and set active`);
+      } else if (res.data.status === "failed") {
+        alert(res.data.error || "Retraining failed");
+      }
+    } catch (err) {
+      pollRef.current = setTimeout(() => pollJob(jobId), POLL_MS);
+    }
+  };
+
   useEffect(() => {
     loadModels().catch(() => {});
+
+    // resume watching a job that is still training
+    api
+      .get("/risk/retrain/jobs")
+      .then((res) => {
+        const active = res.data.jobs.find((j) => !FINISHED.includes(j.status));
+        if (active) {
+          setJob(active);
+          pollJob(active.id);
+        }
+      })
+      .catch(() => {});
+
+    return stopPolling;
   }, []);
 
   const handleUpload = async (e) => {
@@ -24,12 +73,14 @@ export default function AdminModelsPage() {
       const form = new FormData();
       form.append("file", file);
 
-      await api.post("/risk/retrain", form, {
+      const res = await api.post("/risk/retrain", form, {
         headers: { "Content-Type": "multipart/form-data" },
+        params: { mode: incremental ? "incremental" : "full" },
       });
 
-      await loadModels();
-      alert("Model retrained and set active");
+      setJob(res.data);
+      stopPolling();
+      pollJob(res.data.id);
     } catch (err) {
       alert(err?.response?.data?.detail || "Upload failed");
     } finally {
@@ -37,6 +88,18 @@ export default function AdminModelsPage() {
     }
   };
 
+  const handleCancel = async () => {
+    if (!job) return;
+    try {
+      const res = await api.post(`/risk/retrain/jobs/${job.id}/cancel`);
+      setJob(res.data);
+    } catch (err) {
+      alert(err?.response?.data?.detail || "Cancel failed");
+    }
+  };
+
+  const training = job && !FINISHED.includes(job.status);
+
   return (
     <div className="app-root">
       <div className="app-main">
@@ -59,10 +122,45 @@ export default function AdminModelsPage() {
               />
             </label>
 
-            <button type="submit" disabled={loadingUpload}>
+            <label>
+              <input
+                type="checkbox"
+                checked={incremental}
+                onChange={(e) => setIncremental(e.target.checked)}
+              />
+              <span>Incremental (continue the active model with these new rows)</span>
+            </label>
+
+            <button type="submit" disabled={loadingUpload || training}>
               {loadingUpload ? "Uploading..." : "Upload & Retrain"}
             </button>
           </form>
+
+          {job && (
+            <div className="training-job">
+              <p>
+                Version v{job.version}
+                {job.parent_version && ` (from v${job.parent_version})`}: <strong>{job.status}</strong>
+                {training && ` — ${job.stage} (${Math.round(job.percent || 0)}%)`}
+                {job.cancel_requested && training && " — cancelling..."}
+              </p>
+              {training && (
+                <>
+                  <progress max="100" value={job.percent || 0} />
+                  <button
+                    type="button"
+                    onClick={handleCancel}
+                    disabled={job.cancel_requested}
+                  >
+                    Cancel
+                  </button>
+                </>
+              )}
+              {job.status === "failed" && job.error && (
+                <p className="muted">{job.error}</p>
+              )}
+            </div>
+          )}
         </div>
 
         {/* Model Versions Table */}
@@ -1,6 +1,9 @@
 import React, { useEffect, useState } from "react";
 import api from "../api";
 
+// post-commit scoring states that mean a newer score is on its way
+const SCORING_IN_PROGRESS = ["pending", "processing"];
+
 export default function UserDashboard() {
   const [summary, setSummary] = useState(null);
   const [txForm, setTxForm] = useState({
@@ -37,6 +40,21 @@ export default function UserDashboard() {
     load().catch(() => setLoading(false));
   }, []);
 
+  // risk is re-scored in the background after a transaction; wait for it
+  // ("pending" until a worker claims it, then "processing"; "scored" or "failed" when done)
+  async function waitForScore(attempts = 20, delayMs = 250) {
+    for (let i = 0; i < attempts; i++) {
+      try {
+        const res = await api.get("/user/score_status");
+        if (!SCORING_IN_PROGRESS.includes(res.data.score_status)) return;
+      } catch (error) {
+        // the transaction went through; just show whatever is stored
+        return;
+      }
+      await new Promise((resolve) => setTimeout(resolve, delayMs));
+    }
+  }
+
   const onTxChange = (e) => {
     setTxForm((f) => ({ ...f, [e.target.name]: e.target.value }));
   };
@@ -63,8 +81,9 @@ export default function UserDashboard() {
         description: txForm.description || null,
       });
 
-      // Reset form and reload data
+      // Reset form and reload data once the new risk score is in
       setTxForm({ amount: "", category: "food_online", description: "" });
+      await waitForScore();
       await load();
     } catch (error) {
       console.error("Error adding transaction:", error);